@@ -0,0 +1,220 @@
+import argparse, json, logging, time, platform, tempfile
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+import crawl, daemon, messageparser, sipgate_stub, e164
+from cassette import Cassette
+from substitution_notes import generate_substitution_notes
+from dummy_server import DummyScheduleServer
+from sipgate_api import ApiCaller
+from sipgate_stub import SipgateStub
+
+HEADERS = {'Authorization': 'Basic dGVzdA==', 'Accept': 'application/json', 'Content-Type': 'application/json'}
+SHIFT_STARTS = ["08:00", "20:00"]
+SHIFT_ENDS = ["20:00", "08:00"]
+DEFAULT_NUMBER = "+49111"
+DUMMY_MONTHS = [(2019, 5), (2019, 7), (2019, 8)]
+
+
+def time_it(function: Callable, repeat: int = 5) -> Dict[str, float]:
+    """
+    Calls `function` `repeat` times and returns the fastest and the mean wall-clock time in seconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return {'best': min(durations), 'mean': sum(durations) / len(durations)}
+
+
+def benchmark_device_fetch(user_count: int, delay: float, concurrency: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    """
+    Loads the device directory of `user_count` users from a local stub that answers after `delay` seconds,
+    once serially and once with `concurrency` parallel requests.
+    """
+    results = {}
+    with sipgate_stub.create_team(user_count, delay) as stub:
+        for name, concurrency in [('serial', 1), ('concurrent', concurrency)]:
+            api = ApiCaller(stub.base_url, HEADERS, max_concurrent_requests=concurrency)
+            users = api.get_users()
+            results[f"device_fetch_{name}"] = time_it(lambda: api.fetch_private_phone_number_to_user_mapping(users), repeat)
+    return results
+
+
+def benchmark_day_extraction(month: str, day: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    """
+    Parses a single day of a `dummy_dienstplan` month, once via the entire document and once via the fast path.
+    """
+    with open(f"dummy_dienstplan/{month}/index.htm", "rb") as html_file:
+        html = html_file.read()
+    return {
+        'day_info_full_parse': time_it(lambda: crawl.get_day_info(crawl.get_day_rows(crawl.get_month_view(html))[day - 1]), repeat),
+        'day_info_fast_path': time_it(lambda: crawl.extract_day_info(html, day), repeat),
+    }
+
+
+def benchmark_messageparser(note_count: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    notes = generate_substitution_notes(note_count)
+    return {
+        'parse_rules_from_message': time_it(
+            lambda: [messageparser.parse_rules_from_message("08:00", "20:00", DEFAULT_NUMBER, note) for note in notes], repeat),
+    }
+
+
+def parse_days(day_infos: List[crawl.DayInfo]) -> List[List[List[crawl.TimeSlot]]]:
+    return [[crawl.parse_day_info(day_info, group_id, SHIFT_STARTS, SHIFT_ENDS, DEFAULT_NUMBER)
+             for group_id in range(len(day_info.groups))] for day_info in day_infos]
+
+
+def benchmark_pipeline(repeat: int) -> Dict[str, Dict[str, float]]:
+    """
+    Times every stage of crawl -> parse -> intervals on all `dummy_dienstplan` months, served by an in-process
+    web server, and the entire pipeline end to end.
+    """
+    with DummyScheduleServer() as server:
+        def fetch_all():
+            return [crawl.get_html_of_month(server.base_url, year, month, testing=True) for year, month in DUMMY_MONTHS]
+
+        def end_to_end():
+            for html in fetch_all():
+                parse_days(list(map(crawl.get_day_info, crawl.get_day_rows(crawl.get_month_view(html)))))
+
+        htmls = fetch_all()
+        month_views = [crawl.get_month_view(html) for html in htmls]
+        day_rows = [day_row for month_view in month_views for day_row in crawl.get_day_rows(month_view)]
+        day_infos = list(map(crawl.get_day_info, day_rows))
+        shifts = [(SHIFT_STARTS[shift_id], SHIFT_ENDS[shift_id], shift and shift.phone_number or DEFAULT_NUMBER, shift and shift.note or "")
+                  for day_info in day_infos for group in day_info.groups for shift_id, shift in enumerate(group)]
+
+        return {
+            'get_html_of_month': time_it(fetch_all, repeat),
+            'get_month_view': time_it(lambda: [crawl.get_month_view(html) for html in htmls], repeat),
+            'get_day_rows': time_it(lambda: [crawl.get_day_rows(month_view) for month_view in month_views], repeat),
+            'get_day_info': time_it(lambda: list(map(crawl.get_day_info, day_rows)), repeat),
+            'parse_day_info': time_it(lambda: parse_days(day_infos), repeat),
+            'get_interval_list_from_message': time_it(
+                lambda: [messageparser.get_interval_list_from_message(*shift) for shift in shifts], repeat),
+            'pipeline_end_to_end': time_it(end_to_end, repeat),
+        }
+
+
+def benchmark_phone_numbers(count: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    """
+    Normalizes the phone numbers of the `test_crawler` cases `count` times over, with and without the memo,
+    like every run does for all scraped numbers and every `NUMBER_MAP` entry.
+    """
+    from test_crawler import testdata
+    phone_numbers = [phone_number for phone_number, _ in testdata] * count
+    return {
+        'phone_number_normalize_uncached': time_it(lambda: [e164.normalize_uncached(phone_number) for phone_number in phone_numbers], repeat),
+        'phone_number_normalize': time_it(lambda: [e164.normalize(phone_number) for phone_number in phone_numbers], repeat),
+    }
+
+
+def create_schedule_team(months: List[tuple]) -> SipgateStub:
+    """
+    A Sipgate stub with a device for every phone number of the `dummy_dienstplan` `months`, and a public number per line.
+    """
+    private_numbers = {DEFAULT_NUMBER}
+    for year, month in months:
+        with open(f"dummy_dienstplan/{year}-{month:02}/index.htm", "rb") as html_file:
+            day_infos = list(map(crawl.get_day_info, crawl.get_day_rows(crawl.get_month_view(html_file.read()))))
+        private_numbers.update(time_slot.phone_number for time_slots_of_day in parse_days(day_infos)
+                               for time_slots in time_slots_of_day for time_slot in time_slots)
+    private_numbers = sorted(filter(None, map(e164.normalize, private_numbers)))
+    users = [{'id': f"w{i}", 'firstname': "", 'lastname': number, 'email': ""} for i, number in enumerate(private_numbers)]
+    devices = {f"w{i}": [{'id': f"x{i}", 'number': number, 'activePhonelines': [{'id': f"p{i}"}]}]
+               for i, number in enumerate(private_numbers)}
+    numbers = [{'id': str(i), 'number': f"+49231{i:05}", 'endpointId': None} for i in range(3)]
+    return SipgateStub(users, devices, numbers)
+
+
+def simulate_runs(config_data: dict, cassette: Cassette, start: datetime, days: int, interval: int) -> int:
+    """
+    Runs the daemon every `interval` minutes for `days` days of simulated time from `start`,
+    with all HTTP traffic going through `cassette`. Returns how many times it ran.
+    """
+    now = [start]
+    schedule_daemon = daemon.ScheduleDaemon(config_data, clock=lambda: now[0], cassette=cassette)
+    runs = 0
+    while now[0] < start + timedelta(days=days):
+        schedule_daemon.tick()
+        now[0] += timedelta(minutes=interval)
+        runs += 1
+    return runs
+
+
+def benchmark_replay(days: int, interval: int, repeat: int, cassette_directory: str = None) -> Dict[str, Dict[str, float]]:
+    """
+    Records `days` days of daemon runs every `interval` minutes against local stub servers into a cassette,
+    then replays them without any server, as fast as the CPU allows.
+    """
+    start = datetime(2019, 7, 2)
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        cassette_directory = cassette_directory or temporary_directory
+        with DummyScheduleServer() as server, create_schedule_team(DUMMY_MONTHS) as stub:
+            config_data = {
+                "TESTING": True,
+                "test_base_url": server.base_url,
+                "schedule_login_payload": {},
+                "fallback_phone_number": DEFAULT_NUMBER,
+                "NUMBER_MAP": {"NFS1": "+4923100000", "NFS2": "+4923100001", "Leitung": "+4923100002"},
+                "sipgate": {"base_url": stub.base_url, "pass_base64": "", "dryrun": False},
+                "daemon": {"poll_interval": interval * 60},
+            }
+            record_start = time.perf_counter()
+            runs = simulate_runs(config_data, Cassette(cassette_directory, 'record'), start, days, interval)
+            record_duration = time.perf_counter() - record_start
+
+        # the servers are gone, everything has to come from the cassette
+        replay = time_it(lambda: simulate_runs(config_data, Cassette(cassette_directory, 'replay'), start, days, interval), repeat)
+    return {
+        'month_record': {'best': record_duration, 'mean': record_duration, 'runs': runs},
+        'month_replay': dict(replay, runs=runs),
+    }
+
+
+BENCHMARKS = {
+    'sipgate': lambda args: benchmark_device_fetch(args.users, args.delay, args.concurrency, args.repeat),
+    'day_extraction': lambda args: benchmark_day_extraction("2019-05", 15, args.repeat),
+    'pipeline': lambda args: benchmark_pipeline(args.repeat),
+    'messageparser': lambda args: benchmark_messageparser(args.notes, args.repeat),
+    'phone_numbers': lambda args: benchmark_phone_numbers(args.phone_numbers, args.repeat),
+    'replay': lambda args: benchmark_replay(args.days, args.interval, args.repeat, args.cassette),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks against local stub servers")
+    parser.add_argument('benchmarks', nargs='*', help=f"benchmarks to run out of {', '.join(BENCHMARKS)}, all by default")
+    parser.add_argument('--users', type=int, default=200, help="number of simulated Sipgate users")
+    parser.add_argument('--delay', type=float, default=0.01, help="simulated API latency in seconds")
+    parser.add_argument('--concurrency', type=int, default=8, help="parallel Sipgate requests")
+    parser.add_argument('--notes', type=int, default=5000, help="number of synthetic substitution notes to parse")
+    parser.add_argument('--phone-numbers', type=int, default=10000, help="how many times to normalize the phone numbers of the tests")
+    parser.add_argument('--days', type=int, default=31, help="days of simulated daemon runs to record and replay")
+    parser.add_argument('--interval', type=int, default=5, help="minutes between the simulated daemon runs")
+    parser.add_argument('--cassette', help="keep the recorded cassette of the replay benchmark in this directory")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="also write the results as json to this file, e.g. to compare releases")
+    args = parser.parse_args()
+    unknown_benchmarks = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown_benchmarks:
+        parser.error(f"unknown benchmarks {', '.join(unknown_benchmarks)}")
+
+    # the dummy notes are full of malformed substitutions, keep their errors out of the output
+    logging.basicConfig(level=logging.CRITICAL)
+    results = {
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'html_parser': crawl.parser_backend,
+        'repeat': args.repeat,
+        'timings': {},
+    }
+    for name in args.benchmarks or BENCHMARKS:
+        results['timings'].update(BENCHMARKS[name](args))
+
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
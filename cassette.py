@@ -0,0 +1,144 @@
+import base64, hashlib, json, os, threading
+from typing import Dict, List
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+RECORD = 'record'
+REPLAY = 'replay'
+# response headers that aren't stored: the Date, so that a server answering the same over and over is recorded once,
+# and the ones carrying sessions or credentials, so that a cassette can be shared
+UNRECORDED_HEADERS = {'date', 'set-cookie', 'set-cookie2', 'authorization', 'proxy-authorization', 'www-authenticate',
+                      'proxy-authenticate', 'authentication-info', 'cookie', 'x-api-key', 'x-auth-token'}
+
+
+class CassetteAdapter(BaseAdapter):
+    """
+    Transport adapter of a `Cassette`, mount it on a `requests.Session` (or pass it to `ApiCaller` as `transport`).
+    """
+
+    def __init__(self, cassette: 'Cassette'):
+        super().__init__()
+        self.cassette = cassette
+        self.__http = HTTPAdapter() if cassette.mode == RECORD else None
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if self.cassette.mode == RECORD:
+            response = self.__http.send(request, **kwargs)
+            self.cassette.record(request, response)
+            return response
+        return self.cassette.replay(request)
+
+    def close(self):
+        if self.__http:
+            self.__http.close()
+
+
+class Cassette(object):
+    """
+    Records the HTTP responses of a run into `directory`, or replays them from there without any network access.
+
+    Requests are told apart by method, url and a hash of their body. The request headers and bodies aren't stored,
+    and neither are cookies or credentials the responses carry, so neither the Sipgate credentials, the login payload
+    nor the session of the schedule end up in the cassette.
+    The responses to the same request are replayed in the order they were recorded, the last one over and over
+    once they are used up (consecutive equal responses are stored once, with a count, so polling stays small).
+    """
+
+    def __init__(self, directory: str, mode: str = REPLAY):
+        if mode not in (RECORD, REPLAY):
+            raise Exception(f"Unknown cassette mode '{mode}', expected '{RECORD}' or '{REPLAY}'")
+        self.directory = directory
+        self.mode = mode
+        self.recorded = 0
+        self.replayed = 0
+        self.__lock = threading.Lock()
+        # key -> {method, url, responses: [{status, reason, headers, body, count}]}
+        self.__interactions: Dict[str, dict] = {}
+        # key -> how many responses were replayed
+        self.__positions: Dict[str, int] = {}
+        self.adapter = CassetteAdapter(self)
+        if mode == RECORD:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def get_key(request: requests.PreparedRequest) -> str:
+        body = request.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        return hashlib.sha256(b'\n'.join([request.method.encode(), request.url.encode(), body])).hexdigest()[:32]
+
+    def mount(self, session: requests.Session) -> requests.Session:
+        if self.mode == REPLAY:
+            # there is no network to go through a proxy to, and looking one up per request is costly
+            session.trust_env = False
+        session.mount('http://', self.adapter)
+        session.mount('https://', self.adapter)
+        return session
+
+    def __load(self, key: str) -> dict:
+        if key not in self.__interactions:
+            path = os.path.join(self.directory, key + '.json')
+            interaction = None
+            if os.path.exists(path):
+                with open(path, 'r') as interaction_file:
+                    interaction = json.load(interaction_file)
+            self.__interactions[key] = interaction
+        return self.__interactions[key]
+
+    def record(self, request: requests.PreparedRequest, response: requests.Response):
+        key = Cassette.get_key(request)
+        recorded_response = {
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {name: value for name, value in response.headers.items() if name.lower() not in UNRECORDED_HEADERS},
+            'body': base64.b64encode(response.content).decode('ascii'),
+        }
+        with self.__lock:
+            interaction = self.__load(key) or {'method': request.method, 'url': request.url, 'responses': []}
+            self.__interactions[key] = interaction
+            responses: List[dict] = interaction['responses']
+            if responses and {**responses[-1], 'count': 1} == {**recorded_response, 'count': 1}:
+                responses[-1]['count'] += 1
+            else:
+                responses.append(dict(recorded_response, count=1))
+            self.recorded += 1
+
+            path = os.path.join(self.directory, key + '.json')
+            with open(path + '.tmp', 'w') as interaction_file:
+                json.dump(interaction, interaction_file, indent=1)
+            os.replace(path + '.tmp', path)
+
+    def replay(self, request: requests.PreparedRequest) -> requests.Response:
+        key = Cassette.get_key(request)
+        with self.__lock:
+            interaction = self.__load(key)
+            if not interaction:
+                # like an unreachable server, so that the callers handle it as usual
+                raise requests.exceptions.ConnectionError(f"No recorded response to {request.method} {request.url}", request=request)
+            position = self.__positions.get(key, 0)
+            self.__positions[key] = position + 1
+            self.replayed += 1
+
+        for recorded_response in interaction['responses']:
+            if position < recorded_response['count']:
+                break
+            position -= recorded_response['count']
+
+        response = requests.Response()
+        response.status_code = recorded_response['status']
+        response.reason = recorded_response['reason']
+        response.headers = CaseInsensitiveDict(recorded_response['headers'])
+        response._content = base64.b64decode(recorded_response['body'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def rewind(self):
+        """
+        Replays every request from its first response again.
+        """
+        with self.__lock:
+            self.__positions.clear()
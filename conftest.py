@@ -0,0 +1,15 @@
+import pytest
+import crawl
+
+
+@pytest.fixture
+def dummy_schedule(monkeypatch):
+    """
+    Serves the months of `dummy_dienstplan` to `crawl.get_html_of_month` and `crawl.fetch_month` without a web server.
+    """
+    def get_html_of_month(base_url, year, month, **kwargs):
+        with open(f"dummy_dienstplan/{year}-{month:02}/index.htm", "rb") as html_file:
+            return html_file.read()
+    monkeypatch.setattr(crawl, "get_html_of_month", get_html_of_month)
+    monkeypatch.setattr(crawl, "fetch_month", lambda base_url, year, month, **kwargs: crawl.MonthPage(
+        get_html_of_month(base_url, year, month), None, None))
@@ -1,10 +1,13 @@
-import requests, json, re
-from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
+import requests, json, re, os, hashlib, itertools, bisect, heapq, logging, threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime, timedelta, date
+from bs4 import BeautifulSoup, UnicodeDammit, FeatureNotFound
 from sipgate_api import SipgateManager
-from typing import List, Set, Dict, Tuple, Optional
-from dataclasses import dataclass
-from messageparser import get_interval_list_from_message
+from typing import List, Set, Dict, Tuple, Optional, Callable, Iterator
+from dataclasses import dataclass, asdict
+from messageparser import get_interval_list_from_message, get_cached_interval_list
+
+logger = logging.getLogger('crawl')
 
 
 @dataclass
@@ -32,6 +35,16 @@ class DayInfo:
     groups: List[List[Optional[ShiftInfo]]]
     note: Optional[ShiftInfo]
 
+    @staticmethod
+    def from_dict(day_info: dict) -> 'DayInfo':
+        """
+        Inverse of `dataclasses.asdict`.
+        """
+        to_shift_info = lambda shift: shift and ShiftInfo(**shift)
+        return DayInfo(day=day_info['day'],
+            groups=[list(map(to_shift_info, group)) for group in day_info['groups']],
+            note=to_shift_info(day_info['note']))
+
 
 def build_url_for_month(base_url: str, year: int, month: int):
     relative_date_url = f"{year}-{str(month).rjust(2, '0')}/"
@@ -39,26 +52,361 @@ def build_url_for_month(base_url: str, year: int, month: int):
     return url
 
 
-def get_html_of_month(base_url: str, year: int, month: int, login_payload=None, testing=False):
-    url = build_url_for_month(base_url=base_url, year=year, month=month)
+@dataclass
+class MonthPage:
+    """
+    Response for the page of a month.
+    `content` is None if the server answered that the page was not modified.
+    """
+    content: Optional[bytes]
+    etag: Optional[str]
+    last_modified: Optional[str]
 
-    r = requests.post(url, login_payload) if not testing else requests.get(url)
+
+def fetch_month(base_url: str, year: int, month: int, login_payload=None, testing=False, session=None,
+                etag: str = None, last_modified: str = None) -> MonthPage:
+    """
+    Downloads the page of the given month.
+    Pass a `requests.Session` as `session` to reuse connections across calls.
+
+    If `etag` or `last_modified` of a previous response are given, the page is requested conditionally.
+    That only works for GET, the login POST of the production server always returns the full page.
+    """
+    url = build_url_for_month(base_url=base_url, year=year, month=month)
+    http = session or requests
+
+    if testing:
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        r = http.get(url, headers=headers)
+    else:
+        r = http.post(url, login_payload)
+
+    if r.status_code == 304:
+        return MonthPage(content=None, etag=etag, last_modified=last_modified)
     if not r.ok:
         raise Exception(f"Request to '{url}' failed (HTTP Status Code {r.status_code}): Text: {r.text}")
     
-    return r.content
+    return MonthPage(content=r.content, etag=r.headers.get('ETag'), last_modified=r.headers.get('Last-Modified'))
 
 
-def get_month_view(html_text: str):
+def get_html_of_month(base_url: str, year: int, month: int, login_payload=None, testing=False, session=None):
+    """
+    Downloads the html of the given month.
+    Pass a `requests.Session` as `session` to reuse connections across calls.
+    """
+    return fetch_month(base_url, year, month, login_payload=login_payload, testing=testing, session=session).content
+
+
+# Tree builders BeautifulSoup can use, fastest first
+PARSER_BACKENDS = ['lxml', 'html.parser', 'html5lib']
+parser_backend = 'html.parser'
+
+
+def get_available_parser_backends() -> List[str]:
+    """
+    The installed backends of `PARSER_BACKENDS`, fastest first. `html.parser` is always available.
+    """
+    available = []
+    for backend in PARSER_BACKENDS:
+        try:
+            BeautifulSoup("", backend)
+            available.append(backend)
+        except FeatureNotFound:
+            pass
+    return available
+
+
+def set_parser_backend(backend: str = "auto"):
+    """
+    Selects the html parser used by `parse_html` and everything built upon it.
+
+    Parameters
+    ----------
+    backend: One of `PARSER_BACKENDS`, or "auto" for the fastest installed one
+    """
+    global parser_backend
+    available = get_available_parser_backends()
+    if backend == "auto":
+        backend = available[0]
+    elif backend not in available:
+        raise Exception(f"HTML parser '{backend}' is not installed, available are {available}")
+    parser_backend = backend
+
+
+def parse_html(html_text: str, backend: str = None) -> BeautifulSoup:
+    return BeautifulSoup(html_text, backend or parser_backend)
+
+
+def get_adjacent_month(year: int, month: int, offset: int) -> Tuple[int, int]:
+    """
+    (year, month) `offset` months before (negative) or after the given one.
+    """
+    index = year * 12 + month - 1 + offset
+    return index // 12, index % 12 + 1
+
+
+def get_resident_months(instant: datetime) -> List[Tuple[int, int]]:
+    """
+    The previous, current and next month of `instant`: the night shift of the last day of the previous month
+    reaches into the 1st, and the shifts of the 1st of the next month are needed on the last day.
+    """
+    return [get_adjacent_month(instant.year, instant.month, offset) for offset in (-1, 0, 1)]
+
+
+class MonthCache(object):
+    """
+    Downloads and parses the page of every month at most once, e.g. during a single run.
+    `fetch_count` and `parse_count` tell how often that actually happened.
+
+    Months can be loaded in the background with `prefetch`, a long running process calls `warm` regularly
+    so that the previous, current and next month stay resident and the month rollover never waits for the server.
+    """
+
+    def __init__(self, base_url: str, login_payload=None, testing=False, session=None, schedule_cache: 'ScheduleCache' = None,
+                 clock=datetime.now):
+        self.base_url = base_url
+        self.login_payload = login_payload
+        self.testing = testing
+        self.session = session
+        self.schedule_cache = schedule_cache
+        self.fetch_count = 0
+        self.parse_count = 0
+        self.fragment_parse_count = 0
+        self.__clock = clock
+        # guards the dicts below, it is never held while downloading
+        self.__lock = threading.RLock()
+        # loading a month is serialized by its own lock, so that a prefetch and the caller never fetch the same month twice,
+        # but the prefetch of one month never holds up loading another one
+        self.__month_locks: Dict[Tuple[int, int], threading.RLock] = {}
+        self.__executor: Optional[ThreadPoolExecutor] = None
+        self.__prefetches: Dict[Tuple[int, int], Future] = {}
+        self.__html: Dict[Tuple[int, int], bytes] = {}
+        self.__soups: Dict[Tuple[int, int], BeautifulSoup] = {}
+        self.__day_infos: Dict[Tuple[int, int], List[DayInfo]] = {}
+        self.__loaded_at: Dict[Tuple[int, int], datetime] = {}
+
+    def __get_month_lock(self, year: int, month: int) -> threading.RLock:
+        with self.__lock:
+            return self.__month_locks.setdefault((year, month), threading.RLock())
+
+    def get_html(self, year: int, month: int) -> bytes:
+        with self.__get_month_lock(year, month):
+            html = self.__html.get((year, month))
+            if html is None:
+                html = get_html_of_month(self.base_url, year, month, login_payload=self.login_payload, testing=self.testing,
+                                         session=self.session)
+                with self.__lock:
+                    self.__html[(year, month)] = html
+                    self.__loaded_at.setdefault((year, month), self.__clock())
+                    self.fetch_count += 1
+            return html
+
+    def get_soup(self, year: int, month: int) -> BeautifulSoup:
+        with self.__get_month_lock(year, month):
+            soup = self.__soups.get((year, month))
+            if soup is None:
+                soup = parse_html(self.get_html(year, month))
+                with self.__lock:
+                    self.__soups[(year, month)] = soup
+                    self.parse_count += 1
+            return soup
+
+    def get_month_view(self, year: int, month: int):
+        return find_month_view(self.get_soup(year, month))
+
+    def get_day_row(self, year: int, month: int, day: int):
+        """
+        The tr-row of a single day. Unless the month has already been parsed, only that row is parsed.
+        """
+        if (year, month) in self.__soups:
+            return get_day_rows(self.get_month_view(year, month))[day - 1]
+        self.fragment_parse_count += 1
+        return get_day_row(self.get_html(year, month), day)
+
+    def get_day_infos(self, year: int, month: int) -> List[DayInfo]:
+        """
+        The parsed days of a month. With a `schedule_cache` an unchanged page isn't parsed at all.
+        """
+        day_infos = self.__day_infos.get((year, month))
+        if day_infos is not None:
+            return day_infos
+        with self.__get_month_lock(year, month):
+            day_infos = self.__day_infos.get((year, month))
+            if day_infos is None:
+                if self.schedule_cache:
+                    day_infos = self.schedule_cache.get_day_infos(
+                        self.base_url, year, month, login_payload=self.login_payload, testing=self.testing, session=self.session)
+                    with self.__lock:
+                        self.__loaded_at.setdefault((year, month), self.__clock())
+                    for change in self.schedule_cache.changes.get((year, month), []):
+                        logger.info(f"Schedule of {year}-{month:02} changed: {change}")
+                else:
+                    day_infos = list(map(get_day_info, get_day_rows(self.get_month_view(year, month))))
+                with self.__lock:
+                    self.__day_infos[(year, month)] = day_infos
+            return day_infos
+
+    def get_loaded_at(self, year: int, month: int) -> Optional[datetime]:
+        """
+        When the month was downloaded, None if it isn't resident.
+        """
+        return self.__loaded_at.get((year, month))
+
+    def forget(self, year: int, month: int):
+        """
+        Drops a month, so that it is downloaded again on the next access.
+        """
+        with self.__lock:
+            for months in (self.__html, self.__soups, self.__day_infos, self.__loaded_at):
+                months.pop((year, month), None)
+
+    def prefetch(self, year: int, month: int) -> Future:
+        """
+        Loads the days of a month in a background thread, unless that is already happening.
+        """
+        with self.__lock:
+            future = self.__prefetches.get((year, month))
+            if future is None or future.done():
+                if self.__executor is None:
+                    self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+                future = self.__executor.submit(self.get_day_infos, year, month)
+                future.add_done_callback(lambda future: future.exception() and logger.warning(
+                    f"Failed to prefetch schedule of {year}-{month:02}: {future.exception()}"))
+                self.__prefetches[(year, month)] = future
+            return future
+
+    def warm(self, instant: datetime, prefetch_days: int = 3):
+        """
+        Keeps only the previous, current and next month of `instant` resident, and prefetches the next month
+        during the last `prefetch_days` days of a month and the previous one on the 1st.
+        """
+        resident_months = get_resident_months(instant)
+        with self.__lock:
+            for year, month in set(self.__html) | set(self.__day_infos):
+                if (year, month) not in resident_months:
+                    self.forget(year, month)
+
+        days_left = (datetime(*resident_months[2], 1) - instant).days
+        if days_left < prefetch_days and resident_months[2] not in self.__day_infos:
+            self.prefetch(*resident_months[2])
+        if instant.day == 1 and resident_months[0] not in self.__day_infos:
+            self.prefetch(*resident_months[0])
+
+
+class ScheduleCache(object):
+    """
+    Persists the parsed days of every month together with the validators (ETag, Last-Modified),
+    a hash of the page and a fingerprint of every day's tr-row they were parsed from.
+
+    The page is requested conditionally, and if the server answers 304 or the page has the same hash
+    as before, the stored days are returned without parsing the html again. Otherwise only the rows
+    whose fingerprint changed are parsed, and what changed is recorded in `changes`.
+    Without a `path` the cache only lives in memory, e.g. in a long running process.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.not_modified_count = 0
+        self.unchanged_count = 0
+        self.parse_count = 0
+        self.row_parse_count = 0
+        # (year, month) -> the changes found by the latest crawl of that month
+        self.changes: Dict[Tuple[int, int], List[ShiftChange]] = {}
+        self.__entries: Optional[Dict[str, dict]] = None
+        # several months may be loaded at once, e.g. by a prefetch, but the pages are downloaded outside of this lock
+        self.__lock = threading.Lock()
+
+    def __load(self) -> Dict[str, dict]:
+        if self.__entries is None:
+            self.__entries = {}
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r') as cache_file:
+                        self.__entries = json.load(cache_file)
+                except (OSError, ValueError):
+                    pass
+        return self.__entries
+
+    def __save(self):
+        if not self.path:
+            return
+        # write to a temporary file first, so an interrupted write never leaves a corrupt cache behind
+        with open(self.path + '.tmp', 'w') as cache_file:
+            json.dump(self.__entries, cache_file)
+        os.replace(self.path + '.tmp', self.path)
+
+    def get_day_infos(self, base_url: str, year: int, month: int, login_payload=None, testing=False, session=None) -> List[DayInfo]:
+        url = build_url_for_month(base_url, year, month)
+        with self.__lock:
+            entry = self.__load().get(url)
+
+        page = fetch_month(base_url, year, month, login_payload=login_payload, testing=testing, session=session,
+                           etag=entry and entry['etag'], last_modified=entry and entry['last_modified'])
+        if page.content is None and not entry:
+            # a 304 without an entry it could refer to, e.g. from a proxy or a replayed cassette, the page is needed
+            page = fetch_month(base_url, year, month, login_payload=login_payload, testing=testing, session=session)
+            if page.content is None:
+                raise Exception(f"Request to '{url}' answered 304 Not Modified, but the month isn't cached")
+        with self.__lock:
+            return self.__update(url, year, month, entry, page)
+
+    def __update(self, url: str, year: int, month: int, entry: Optional[dict], page: MonthPage) -> List[DayInfo]:
+        self.changes[(year, month)] = []
+        if page.content is None and entry:
+            self.not_modified_count += 1
+            return list(map(DayInfo.from_dict, entry['day_infos']))
+
+        content_hash = hashlib.sha256(page.content).hexdigest()
+        if entry and entry['hash'] == content_hash:
+            self.unchanged_count += 1
+            return list(map(DayInfo.from_dict, entry['day_infos']))
+
+        self.parse_count += 1
+        html_text = UnicodeDammit(page.content, is_html=True).unicode_markup
+        rows = find_day_rows_html(html_text)
+        row_hashes = [hashlib.sha256(row.encode()).hexdigest() for row in rows]
+        old_row_hashes = entry and entry.get('row_hashes') or []
+        old_day_infos = list(map(DayInfo.from_dict, entry['day_infos'])) if entry else []
+
+        day_infos = []
+        for i, row in enumerate(rows):
+            if i < len(old_row_hashes) and i < len(old_day_infos) and old_row_hashes[i] == row_hashes[i]:
+                day_infos.append(old_day_infos[i])
+                continue
+            self.row_parse_count += 1
+            day_info = parse_day_row_html(row)
+            if entry:
+                old_day_info = old_day_infos[i] if i < len(old_day_infos) else None
+                self.changes[(year, month)].extend(diff_day_infos(year, month, i + 1, old_day_info, day_info))
+            day_infos.append(day_info)
+
+        self.__entries[url] = {'etag': page.etag, 'last_modified': page.last_modified, 'hash': content_hash,
+                        'row_hashes': row_hashes, 'day_infos': list(map(asdict, day_infos))}
+        self.__save()
+        return day_infos
+
+
+def get_month_view(html_text: str, backend: str = None):
     """
     Get's the month-view div from the html of a crawlable website.
     """
+    return find_month_view(parse_html(html_text, backend))
+
+
+def find_month_view(soup: BeautifulSoup):
+    """
+    Get's the month-view div from an already parsed website.
+    """
     CSS_CLASS_MONTH_VIEW = "month-view"
     
-    soup = BeautifulSoup(html_text, 'html.parser')
     month_view = soup.find_all("div", attrs={"class": CSS_CLASS_MONTH_VIEW})
     if not month_view:
-        raise Exception(f"Failed to find '.{CSS_CLASS_MONTH_VIEW}' in html", html_text)
+        # e.g. an expired login or an error page, the start of it tells which
+        raise Exception(f"Failed to find '.{CSS_CLASS_MONTH_VIEW}' in html", str(soup)[:500])
     if len(month_view) != 1:
         raise Exception(f"Expected 1 month-view, found {len(month_view)}")
     return month_view[0]
@@ -155,6 +503,136 @@ def get_day_info(day_row) -> DayInfo:
         note=get_shift_info(tds[-1]))
 
 
+REGEX_MONTH_VIEW = re.compile(r'<div\b[^>]*\bclass="(?:[^"]*\s)?month-view(?:\s[^"]*)?"', re.IGNORECASE)
+REGEX_DAY_CELL = re.compile(r'<td\b[^>]*\bclass="(?:[^"]*\s)?tag(?:\s[^"]*)?"', re.IGNORECASE)
+REGEX_ROW_TAG = re.compile(r'<(/?)tr\b', re.IGNORECASE)
+
+
+def find_row_around(html_text: str, search_start: int, cell_start: int) -> Tuple[int, int]:
+    """
+    Start and end offset of the tr-row containing the cell at `cell_start`, whose opening tag is after `search_start`.
+    """
+    row_start = next(tag for tag in reversed(list(REGEX_ROW_TAG.finditer(html_text, search_start, cell_start)))
+                     if not tag.group(1)).start()
+    # the row contains nested tables, so the closing tag of the row is found by counting the nesting depth
+    depth = 0
+    for tag in REGEX_ROW_TAG.finditer(html_text, row_start):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return row_start, html_text.index('>', tag.end()) + 1
+    raise Exception("Row is never closed")
+
+
+def find_day_row_html(html_text: str, day: int) -> str:
+    """
+    Cuts the tr-row of a day out of the html of a month, without parsing the document.
+
+    Parameters
+    ----------
+    day: day of the month, starting at 1
+    """
+    month_view = REGEX_MONTH_VIEW.search(html_text)
+    if not month_view:
+        raise Exception("Failed to find '.month-view' in html")
+
+    # the first td.tag is the one of the header row
+    day_cell = next(itertools.islice(REGEX_DAY_CELL.finditer(html_text, month_view.end()), day, None), None)
+    if not day_cell:
+        raise Exception(f"Failed to find day {day} in month view")
+
+    row_start, row_end = find_row_around(html_text, month_view.end(), day_cell.start())
+    return html_text[row_start:row_end]
+
+
+def find_day_rows_html(html_text: str) -> List[str]:
+    """
+    Cuts the tr-rows of all days out of the html of a month in a single pass, without parsing the document.
+    Equivalent to `find_day_row_html` for every day of the month.
+    """
+    month_view = REGEX_MONTH_VIEW.search(html_text)
+    if not month_view:
+        raise Exception("Failed to find '.month-view' in html")
+
+    rows = []
+    row_end = month_view.end()
+    # the first td.tag is the one of the header row
+    for day_cell in itertools.islice(REGEX_DAY_CELL.finditer(html_text, month_view.end()), 1, None):
+        if day_cell.start() < row_end:
+            continue
+        row_start, row_end = find_row_around(html_text, row_end, day_cell.start())
+        rows.append(html_text[row_start:row_end])
+    if not rows:
+        raise Exception("Failed to find any days")
+    return rows
+
+
+def get_day_row(html_text, day: int, backend: str = None):
+    """
+    Fast path to a single day's row (tr) which only parses that row instead of the entire month.
+    Equivalent to `get_day_rows(get_month_view(html_text))[day - 1]`.
+    """
+    if isinstance(html_text, bytes):
+        html_text = UnicodeDammit(html_text, is_html=True).unicode_markup
+    # some parsers drop a tr outside of a table
+    return parse_html(f"<table>{find_day_row_html(html_text, day)}</table>", backend).find("tr")
+
+
+def extract_day_info(html_text, day: int, backend: str = None) -> DayInfo:
+    return get_day_info(get_day_row(html_text, day, backend))
+
+
+def parse_day_row_html(row_html: str, backend: str = None) -> DayInfo:
+    """
+    Parses a tr-row cut out by `find_day_row_html` or `find_day_rows_html`.
+    """
+    # some parsers drop a tr outside of a table
+    return get_day_info(parse_html(f"<table>{row_html}</table>", backend).find("tr"))
+
+
+@dataclass
+class ShiftChange:
+    """
+    A shift of the schedule that changed between two crawls, e.g. "day 14, group 1, shift 1: phone_number changed".
+    `field` is "name", "phone_number" or "note", or "shift" if the whole shift was added or removed.
+    """
+    year: int
+    month: int
+    day: int
+    group_id: int
+    shift_id: int
+    field: str
+    old: Optional[str]
+    new: Optional[str]
+
+    def __str__(self):
+        return f"day {self.day}, group {self.group_id}, shift {self.shift_id}: {self.field} changed"
+
+
+def diff_day_infos(year: int, month: int, day: int, old: Optional[DayInfo], new: DayInfo) -> List[ShiftChange]:
+    """
+    The shifts of `new` that differ from `old`, field by field.
+    """
+    changes = []
+    old_groups = old.groups if old else []
+    for group_id in range(max(len(old_groups), len(new.groups))):
+        old_shifts = old_groups[group_id] if group_id < len(old_groups) else []
+        new_shifts = new.groups[group_id] if group_id < len(new.groups) else []
+        for shift_id in range(max(len(old_shifts), len(new_shifts))):
+            old_shift = old_shifts[shift_id] if shift_id < len(old_shifts) else None
+            new_shift = new_shifts[shift_id] if shift_id < len(new_shifts) else None
+            if old_shift == new_shift:
+                continue
+            if not old_shift or not new_shift:
+                changes.append(ShiftChange(year, month, day, group_id, shift_id, "shift",
+                                           old_shift and old_shift.name, new_shift and new_shift.name))
+                continue
+            for field in ("name", "phone_number", "note"):
+                if getattr(old_shift, field) != getattr(new_shift, field):
+                    changes.append(ShiftChange(year, month, day, group_id, shift_id, field,
+                                               getattr(old_shift, field), getattr(new_shift, field)))
+    return changes
+
+
 @dataclass
 class TimeSlot(object):
     start_time: str
@@ -182,14 +660,194 @@ def parse_day_info(
     shifts = day_info.groups[group_id]
 
     return [
-        TimeSlot(*interval) for shift_id, shift in enumerate(shifts) for interval in get_interval_list_from_message(
+        TimeSlot(*interval) for shift_id, shift in enumerate(shifts) for interval in get_cached_interval_list(
             shift_starts[shift_id],
             shift_ends[shift_id],
-            shift and shift.phone_number or DEFAULT_NUMBER,
+            shift and shift.phone_number or default_number,
             shift and shift.note or "")
     ]
 
 
+# (start, end, phone_number)
+Segment = Tuple[datetime, datetime, str]
+
+
+def time_on_shift(shift_date: date, shift_start: str, time_string: str, is_end: bool = False) -> datetime:
+    """
+    Anchors a "HH:MM" string of a shift to a datetime.
+
+    Times before the shift start belong to the next day, e.g. 07:00 of the 20:00 - 08:00 shift.
+    An end time equal to the shift start means the shift runs for a full day.
+    """
+    anchor = datetime.combine(shift_date, datetime.strptime(shift_start, "%H:%M").time())
+    instant = datetime.combine(shift_date, datetime.strptime(time_string, "%H:%M").time())
+    if instant < anchor or (is_end and instant == anchor):
+        instant += timedelta(days=1)
+    return instant
+
+
+def get_segments_of_day(
+    day_info: DayInfo,
+    shift_date: date,
+    shift_starts: List[str],
+    shift_ends: List[str],
+    default_number: str) -> List[List[Segment]]:
+    """
+    Translates a day of the schedule into datetime segments, one list per group (phone line).
+    """
+    segments = []
+    for shifts in day_info.groups:
+        group_segments = []
+        for shift_id, shift in enumerate(shifts):
+            for start_time, end_time, phone_number in get_cached_interval_list(
+                    shift_starts[shift_id],
+                    shift_ends[shift_id],
+                    shift and shift.phone_number or default_number,
+                    shift and shift.note or ""):
+                group_segments.append((
+                    time_on_shift(shift_date, shift_starts[shift_id], start_time),
+                    time_on_shift(shift_date, shift_starts[shift_id], end_time, is_end=True),
+                    phone_number))
+        segments.append(group_segments)
+    return segments
+
+
+class RoutingTimeline(object):
+    """
+    Sorted segments of every phone line, to look up who is on call at any instant without touching html.
+
+    Adjacent segments with the same phone number are merged, so every segment boundary is an actual change.
+    """
+
+    def __init__(self, lines: List[List[Segment]]):
+        self.lines: List[List[Segment]] = [self.merge(segments) for segments in lines]
+        self.__starts = [[start for start, _, _ in segments] for segments in self.lines]
+
+    @staticmethod
+    def merge(segments: List[Segment]) -> List[Segment]:
+        merged: List[Segment] = []
+        for segment in sorted(segments):
+            if merged and merged[-1][1] == segment[0] and merged[-1][2] == segment[2]:
+                merged[-1] = (merged[-1][0], segment[1], segment[2])
+            else:
+                merged.append(segment)
+        return merged
+
+    @classmethod
+    def from_days(
+        cls,
+        days: List[Tuple[date, DayInfo]],
+        shift_starts: List[str],
+        shift_ends: List[str],
+        default_number: str,
+        line_count: int = None):
+        """
+        Compiles `(shift date, DayInfo)` pairs into a timeline of `line_count` lines (all groups by default).
+        """
+        lines: List[List[Segment]] = [[] for _ in range(line_count or 0)]
+        for shift_date, day_info in days:
+            for line_id, group_segments in enumerate(get_segments_of_day(day_info, shift_date, shift_starts, shift_ends, default_number)):
+                if line_count is None and line_id >= len(lines):
+                    lines.append([])
+                if line_id < len(lines):
+                    lines[line_id].extend(group_segments)
+        return cls(lines)
+
+    def replace_days(
+        self,
+        days: List[Tuple[date, DayInfo]],
+        shift_starts: List[str],
+        shift_ends: List[str],
+        default_number: str):
+        """
+        Patches the timeline with re-parsed `(shift date, DayInfo)` pairs, leaving all other days untouched.
+
+        The shifts of a day are expected to cover the 24 hours from the first shift start.
+        """
+        for shift_date, day_info in days:
+            window_start = time_on_shift(shift_date, shift_starts[0], shift_starts[0])
+            window_end = window_start + timedelta(days=1)
+            day_segments = get_segments_of_day(day_info, shift_date, shift_starts, shift_ends, default_number)
+            for line_id, segments in enumerate(self.lines):
+                starts = self.__starts[line_id]
+                # the affected segments and their neighbours, which may have to be merged with the new ones
+                low = max(bisect.bisect_right(starts, window_start) - 2, 0)
+                high = min(bisect.bisect_left(starts, window_end) + 1, len(segments))
+                patch = day_segments[line_id] if line_id < len(day_segments) else []
+                for start, end, phone_number in segments[low:high]:
+                    if start < window_start:
+                        patch.append((start, min(end, window_start), phone_number))
+                    if end > window_end:
+                        patch.append((max(start, window_end), end, phone_number))
+                segments[low:high] = self.merge(patch)
+                starts[:] = [start for start, _, _ in segments]
+
+    def discard_before(self, instant: datetime):
+        """
+        Drops the segments which ended before `instant`, so a long running process doesn't keep every past day.
+        """
+        for line_id, segments in enumerate(self.lines):
+            # segments don't overlap, so all before the one containing `instant` have ended
+            index = bisect.bisect_right(self.__starts[line_id], instant) - 1
+            if index > 0:
+                del segments[:index]
+                del self.__starts[line_id][:index]
+
+    def lookup(self, line_id: int, instant: datetime) -> Optional[str]:
+        """
+        The phone number line `line_id` is routed to at `instant`, None if the timeline doesn't cover it.
+        """
+        index = bisect.bisect_right(self.__starts[line_id], instant) - 1
+        if index < 0:
+            return None
+        start, end, phone_number = self.lines[line_id][index]
+        return phone_number if instant < end else None
+
+    def lookup_all(self, instant: datetime) -> List[Optional[str]]:
+        return [self.lookup(line_id, instant) for line_id in range(len(self.lines))]
+
+    def change_points(self, after: datetime) -> Iterator[datetime]:
+        """
+        Every instant after `after` at which any line changes its phone number, in order.
+        """
+        boundaries = []
+        for line_id, segments in enumerate(self.lines):
+            # the segment containing `after` may end after it
+            index = max(bisect.bisect_right(self.__starts[line_id], after) - 1, 0)
+            boundaries.append(itertools.chain.from_iterable((start, end) for start, end, _ in segments[index:]))
+        previous = None
+        for instant in heapq.merge(*boundaries):
+            if instant > after and instant != previous:
+                previous = instant
+                yield instant
+
+
+def build_month_timeline(
+    get_day_infos: Callable[[int, int], List[DayInfo]],
+    year: int,
+    month: int,
+    shift_starts: List[str],
+    shift_ends: List[str],
+    default_number: str,
+    line_count: int = None) -> RoutingTimeline:
+    """
+    Compiles every day of a month into a `RoutingTimeline`, together with the last day of the previous month,
+    whose night shift reaches into the first morning of the month.
+
+    `get_day_infos(year, month)` is e.g. `MonthCache.get_day_infos`.
+    """
+    first_day = date(year, month, 1)
+    days = [(first_day + timedelta(days=i), day_info) for i, day_info in enumerate(get_day_infos(year, month))]
+
+    last_day_of_previous_month = first_day - timedelta(days=1)
+    try:
+        previous_day_infos = get_day_infos(last_day_of_previous_month.year, last_day_of_previous_month.month)
+        days.insert(0, (last_day_of_previous_month, previous_day_infos[-1]))
+    except Exception as e:
+        logger.warning(f"Schedule of {last_day_of_previous_month} is not available: {e}")
+
+    return RoutingTimeline.from_days(days, shift_starts, shift_ends, default_number, line_count)
+
 if __name__ == "__main__":
     # Constants
     SHIFT_STARTS = ["08:00", "20:00"]
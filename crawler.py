@@ -1,41 +1,95 @@
-import requests, json, re, logging
+import requests, json, logging, argparse, asyncio, functools, threading
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
-from sipgate_api import SipgateManager
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+from sipgate_api import ApiCaller, SipgateManager, DirectorySnapshot, PlannedRedirect, RedirectJournal, RedirectResult, RedirectStatus
+import crawl, messageparser, e164
+from cassette import Cassette
+from crawl import MonthCache
 
 logger = logging.getLogger('crawler')
 warnings, errors = 0, 0
+TESTING = False
+# a run applies the shift which is due now, and then the one of the same time on the next day
+NEXTDAY_RUNS = (False, True)
+
+
+@dataclass
+class Tally:
+    """
+    The errors and warnings of one of several runs in the same process, see `own_tally`.
+    """
+    errors: int = 0
+    warnings: int = 0
+
+
+# the `Tally` of a thread, if it counts on its own
+tallies = threading.local()
+
+
+@contextmanager
+def own_tally() -> Iterator[Tally]:
+    """
+    Counts the errors and warnings of the current thread into a `Tally` of its own instead of the module's
+    `errors` and `warnings`, e.g. for one of several tenants running at once.
+    """
+    tally = Tally()
+    tallies.current = tally
+    try:
+        yield tally
+    finally:
+        tallies.current = None
+
+
+def count(error_count: int = 0, warning_count: int = 0):
+    """
+    Adds to the `Tally` of the current thread, if it has one, otherwise to the module's `errors` and `warnings`.
+    """
+    global errors, warnings
+    tally = getattr(tallies, 'current', None)
+    if tally:
+        tally.errors += error_count
+        tally.warnings += warning_count
+    else:
+        errors += error_count
+        warnings += warning_count
 
 def format_phone_number(phone_number: str, country_code: str = '+49'):
     """
     Extracts the phone number from `phone_number`, removing all special characters.
     If it is not prefixed with a country calling code, it is prefixed with `country_code`.
+    See `e164.normalize`.
     """
+    return e164.normalize(phone_number, country_code)
 
-    if phone_number == None:
-        return None
-    
-    # delete everything but digits, except for a '+' in the first position
-    # [^0-9\+] matches every character that is not a digit or a + sign
-    # (?!^)\+ matches all + signs that are not at at the start of the string
-    new_phone_number = re.sub(r"[^0-9\+]|(?!^)\+", "", phone_number)
-    # if after that the number is fully numeric, we need to add the +, maybe even the country code
-    if new_phone_number.isnumeric():
-        new_phone_number = new_phone_number.lstrip('0')
-        if new_phone_number.find(country_code[1:]) == 0:
-            # the nationalcode is already at the start of the number, assuming only the + sign is missing
-            new_phone_number = '+' + new_phone_number
-        else:
-            new_phone_number = country_code + new_phone_number
-    return new_phone_number
-
-
-def fetch_shift_schedule_entries(base_url, login_payload, is_first_shift, target_daytime_object):
+
+# the columns of the schedule, in order
+LINE_KEYS = ["NFS1", "NFS2", "Leitung"]
+
+def get_line_columns(line_keys: list, lines: list = None) -> dict:
+    """
+    The column of the schedule of every line in `line_keys`, by name.
+
+    `lines` names all columns of the schedule in order ("lines" in the config). Without it, only the columns of
+    `LINE_KEYS` are known, so that the order of NUMBER_MAP never decides which column a line is routed by.
+    """
+    lines = lines or LINE_KEYS
+    unknown_keys = [key for key in line_keys if key not in lines]
+    if unknown_keys:
+        raise Exception(f"Lines {unknown_keys} aren't columns of the schedule, list all columns in order in \"lines\" of the config")
+    return {key: lines.index(key) for key in line_keys}
+
+
+def fetch_shift_schedule_entries(base_url, login_payload, is_first_shift, target_daytime_object, month_cache: MonthCache = None, line_keys: list = None, lines: list = None):
     """
     Parameters:
     base_url (string): regular beginning of shift
     login_payload   (string): regular end of shift
     day_of_month (string): regular phone number for this shift
+    month_cache (MonthCache): shares downloaded and parsed months between calls, a new one is used if omitted
+    line_keys (list): names of the lines to look up, e.g. the keys of NUMBER_MAP. Defaults to all of `lines`
+    lines (list): names of all columns of the schedule, in order. Defaults to `LINE_KEYS`, see `get_line_columns`
 
     Returns:
     ```
@@ -48,67 +102,48 @@ def fetch_shift_schedule_entries(base_url, login_payload, is_first_shift, target
     """
 
     global TESTING
+    columns = get_line_columns(line_keys or lines or LINE_KEYS, lines)
 
     # Da der Testserver kein Login fordert (und kein POST versteht), 
     # reicht hier ein einfacher GET, für production wird die login_payload gebraucht
-
-    relative_date_url = datetime.strftime(target_daytime_object, "%Y-%m") # YYYY-mm
-    url = base_url + relative_date_url
-
-    logger.debug(f"Connecting to shift-server at {url}")
-    r = requests.get(url) if TESTING else requests.post(url, data=login_payload)
-    if not r.ok:
-        raise Exception("Request to '{}' failed (HTTP Status Code {}): Text: {}".format(r.url, r.status_code, r.text))
-
-    soup = BeautifulSoup(r.content, features="html.parser")
-    # print(soup)
-
-    # class "tag" markiert die tage im Monat
-    all_days = soup.find_all(class_="tag")
-
-    # current_day_of_month ist immer der richtige tag
-    current_day = all_days[target_daytime_object.day]
-
-    day_row = current_day.parent
-
-    # Die drei Hauptspalten der aktuellen Zeile, also drei Leitungen separieren, die haben die Klasse "trenner"
+    month_cache = month_cache or MonthCache(base_url, login_payload, testing=TESTING)
+
+    logger.debug(f"Getting {datetime.strftime(target_daytime_object, '%Y-%m')} from shift-server at {base_url}")
+
+    if month_cache.schedule_cache:
+        # the schedule cache asks the server whether the month changed and keeps its parsed days,
+        # so an unchanged month is neither downloaded nor parsed again
+        day_info = month_cache.get_day_infos(target_daytime_object.year, target_daytime_object.month)[target_daytime_object.day - 1]
+        if len(day_info.groups) <= max(columns.values()):
+            raise Exception(f"Expected {max(columns.values()) + 1} lines in the schedule, found {len(day_info.groups)}")
+        logger.info(f"{'1' if is_first_shift else '2'}. shift selected")
+        redirects = {}
+        for key, column in columns.items():
+            [Slot1, Slot2] = get_time_slot_numbers(day_info.groups[column], key.lower())
+            redirects[key] = format_phone_number(Slot1 if is_first_shift else Slot2)
+        return redirects
+
+    # Zeile mit der class "tag" des Tages, ohne den ganzen Monat zu parsen
+    day_row = month_cache.get_day_row(target_daytime_object.year, target_daytime_object.month, target_daytime_object.day)
+
+    # Die Hauptspalten der aktuellen Zeile, also die Leitungen separieren, die haben die Klasse "trenner"
     Leitungen = day_row.find_all(class_="trenner")
+    if len(Leitungen) <= max(columns.values()):
+        raise Exception(f"Expected {max(columns.values()) + 1} lines in the schedule, found {len(Leitungen)}")
 
-    NFS1 = Leitungen[0]
-    NFS2 = Leitungen[1]
-    Leitung = Leitungen[2]
-
-    # FRAGE: Warum hier href als selector? - P:href kommt anstatt span wenn es keinen eintrag gibt
-
-    nfs1_soup = NFS1.find_all(['span', 'href'])
-    nfs2_soup = NFS2.find_all(['span', 'href'])
-    leitung_soup = Leitung.find_all(['span', 'href'])
-    # test = leitung_soup[1]
-    # print(test.contents)
-
-    # AB HIER IST NOCH NICHT RICHTIG
-    [NFS1_Slot1, NFS1_Slot2] = AssignNumbersToTimeSlots(nfs1_soup, "nfs1")
-    [NFS2_Slot1, NFS2_Slot2] = AssignNumbersToTimeSlots(nfs2_soup, "nfs2")
-    [Leitung_Slot1, Leitung_Slot2] = AssignNumbersToTimeSlots(leitung_soup, "leitung")
-
+    logger.info(f"{'1' if is_first_shift else '2'}. shift selected")
     redirects = {}
-
-    if is_first_shift:
-        logger.info('1. shift selected')
-        redirects['NFS1'] = format_phone_number(NFS1_Slot1)
-        redirects['NFS2'] = format_phone_number(NFS2_Slot1)
-        redirects['Leitung'] = format_phone_number(Leitung_Slot1)
-    else:
-        logger.info('2. shift selected')
-        redirects['NFS1'] = format_phone_number(NFS1_Slot2)
-        redirects['NFS2'] = format_phone_number(NFS2_Slot2)
-        redirects['Leitung'] = format_phone_number(Leitung_Slot2)
+    for key, column in columns.items():
+        Leitung = Leitungen[column]
+        # FRAGE: Warum hier href als selector? - P:href kommt anstatt span wenn es keinen eintrag gibt
+        [Slot1, Slot2] = AssignNumbersToTimeSlots(Leitung.find_all(['span', 'href']), key.lower())
+        redirects[key] = format_phone_number(Slot1 if is_first_shift else Slot2)
 
     return redirects
 
 
 def AssignNumbersToTimeSlots(double_cell_soup, phone_line: str):
-    global warnings, logger
+    global logger
     if len(double_cell_soup) == 4:
         logger.info(f'Two entries, one for each shift for line {phone_line}')
         
@@ -118,7 +153,7 @@ def AssignNumbersToTimeSlots(double_cell_soup, phone_line: str):
         slot2 = SecondNumber.contents[0]
     elif len(double_cell_soup) == 2:
         logger.warning(f'Only a single entry. Using the single entry for both shifts for line {phone_line}')
-        warnings += 1
+        count(warning_count=1)
 
         FirstNumber = double_cell_soup[1]
         slot1 = FirstNumber.contents[0]
@@ -130,68 +165,236 @@ def AssignNumbersToTimeSlots(double_cell_soup, phone_line: str):
     return slot1, slot2  # give attribute of certain leitung
 
 
-def determine_target_date(nextday = False):
+def get_time_slot_numbers(group: List[Optional[crawl.ShiftInfo]], phone_line: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    `AssignNumbersToTimeSlots` for the parsed shifts of a line, e.g. from `crawl.DayInfo.groups`.
+    """
+    entries = [shift.phone_number for shift in group if shift]
+    if len(entries) == 2:
+        logger.info(f'Two entries, one for each shift for line {phone_line}')
+        return entries[0], entries[1]
+    if len(entries) == 1:
+        logger.warning(f'Only a single entry. Using the single entry for both shifts for line {phone_line}')
+        count(warning_count=1)
+        return entries[0], entries[0]
+    return None, None
+
+
+def determine_target_date(nextday = False, now: datetime = None):
     """
     Gives the current datetime object, or the one from yesterday if the previous days nightshift is required.
     If nextday == True, the next day will be fetched.
+    On the 1st of a month before 08:00 that is the last day of the previous month.
     
     Parameters
     ----------
     nextday: bool
+    now: datetime, defaults to `datetime.now()`
 
     Returns
     -------
     <daytime oject>
     """
-    target_daytime_object = datetime.now() + timedelta(days=int(nextday))
-    # Zwischen 0 und 8 Uhr ist die Schicht von Gestern dran
-    # ToDo am 1. jeden Monats müsste man die letzte Schicht vom letzten Monat betrachten
+    target_daytime_object = (now or datetime.now()) + timedelta(days=int(nextday))
+    # Zwischen 0 und 8 Uhr ist die Schicht von Gestern dran, am 1. also die vom letzten Tag des Vormonats
     if target_daytime_object.hour < 8:
         target_daytime_object = target_daytime_object - timedelta(days=1)
     logger.debug(f"target datetime is {datetime.strftime(target_daytime_object, '%d.%m.%Y %H:%M')}")
     return target_daytime_object
 
 
-def make_redirects(sipgate_base_url, sipgate_headers, number_map, redirects, dryrun):
-    global warnings, errors, logger
-    sipgate_manager = SipgateManager(sipgate_base_url, sipgate_headers, dryrun)
+def make_redirects(sipgate_base_url, sipgate_headers, number_map, redirects, dryrun, sipgate_manager: SipgateManager = None, sipgate_options: dict = None):
+    """
+    Reroutes every public number of `number_map` to the private number in `redirects`.
+    A long running caller can pass an already connected `sipgate_manager` to skip the directory lookups.
+    With a redirect journal in `sipgate_options`, SIPGATE isn't asked at all while the journal knows
+    that every line already routes to the right number.
 
-    for key, private_phone_number in redirects.items():
-        logger.info(f"------------ Rerouting '{key}' ------------")
+    All redirects are validated up front, and only the public numbers which don't already route to the right
+    phone line are actually rerouted, in parallel.
 
+    Returns
+    -------
+    The `RedirectResult` of every line with a phone number.
+    """
+    global logger
+    desired_redirects = {}
+    for key, private_phone_number in redirects.items():
         if not private_phone_number: # Matches emptystring and None
-            errors += 1
+            count(error_count=1)
             logger.error(f"Key '{key}' has no assigned phone number, forwarding stays unchanged")
             continue
+        desired_redirects[format_phone_number(number_map[key])] = private_phone_number
+
+    journal = (sipgate_options or {}).get("journal")
+    believed_plans = not sipgate_manager and not dryrun and journal and journal.get_believed_plans(desired_redirects)
+    if believed_plans and not is_routed_as_believed(sipgate_base_url, sipgate_headers, believed_plans, sipgate_options):
+        logger.info("Lines were rerouted since they were journaled, probably by hand, loading the SIPGATE directory")
+        believed_plans = None
+    if believed_plans:
+        logger.debug("All lines are journaled as redirected already and still route so, skipping the SIPGATE directory")
+        results = [RedirectResult(plan, RedirectStatus.UNCHANGED) for plan in believed_plans]
+    else:
+        sipgate_manager = sipgate_manager or SipgateManager(sipgate_base_url, sipgate_headers, dryrun, **(sipgate_options or {}))
+        results = sipgate_manager.apply_redirects(desired_redirects)
+    keys = {format_phone_number(number): key for key, number in number_map.items()}
 
-        outbundnumber = format_phone_number(number_map[key])
-        if not sipgate_manager.set_redirect_phone_number(outbundnumber, private_phone_number):
-            errors = errors + 1
+    counts = {status: sum(result.status == status for result in results) for status in RedirectStatus}
+    logger.info("Redirects: " + ", ".join(f"{count} {status.value}" for status, count in counts.items()))
+    for result in results:
+        logger.info(f"  {keys.get(result.plan.outbound_phone_number)}: {result}")
 
+    count(error_count=counts[RedirectStatus.FAILED])
+    return results
 
-def fetch_and_apply_redirects(schedule_base_url: str, schedule_login_payload: str, numbermap: dict, sipgate_base_url: str, sipgate_headers: str, dryrun: bool, nextday: bool = False):
-    
-    target_daytime_object = determine_target_date(nextday)
 
-    is_first_shift = (8 <= target_daytime_object.hour < 20)
-    # is_second_shift = not is_first_shift
+def is_routed_as_believed(sipgate_base_url: str, sipgate_headers: dict, believed_plans: List[PlannedRedirect],
+                          sipgate_options: dict) -> bool:
+    """
+    True if the public numbers of `believed_plans` still route to the endpoints the journal believes they do.
+    The endpoints can be changed by hand in SIPGATE, so they are asked for with a single request for the numbers.
+    """
+    connection_options = {key: value for key, value in sipgate_options.items() if key not in ("directory_cache", "journal")}
+    numbers = ApiCaller(sipgate_base_url, sipgate_headers, **connection_options).get_public_phone_numbers()
+    return all(numbers.get(plan.outbound_phone_number, {}).get('endpointId') == plan.target_endpoint_id for plan in believed_plans)
 
-    redirects = fetch_shift_schedule_entries(schedule_base_url, schedule_login_payload, is_first_shift, target_daytime_object)
-    logger.info(f"Redirects: {redirects}")
 
-    make_redirects(sipgate_base_url, sipgate_headers, numbermap, redirects, dryrun)
+def run_in_thread(function, *args, **kwargs) -> asyncio.Future:
+    """
+    Runs `function` in a worker thread of the event loop, like `asyncio.to_thread`, which needs Python 3.9.
+    """
+    return asyncio.get_event_loop().run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+
+async def make_redirects_async(number_map, redirects, sipgate_manager: SipgateManager):
+    """
+    `make_redirects` in a worker thread, for `fetch_and_apply_redirects_async`.
+    """
+    return await run_in_thread(make_redirects, None, None, number_map, redirects, None, sipgate_manager=sipgate_manager)
+
+
+def is_first_shift_at(target_daytime_object: datetime) -> bool:
+    """
+    True for the first (08:00 - 20:00) shift.
+    """
+    return 8 <= target_daytime_object.hour < 20
+
 
+def log_result():
     if errors or warnings:
         logger.warning(f"Finished with {errors} error(s) and {warnings} warning(s).")
     else:
         logger.info("Success. Finished without errors or warnings")
+
+
+def fetch_and_apply_redirects(schedule_base_url: str, schedule_login_payload: str, numbermap: dict, sipgate_base_url: str, sipgate_headers: str, dryrun: bool, nextday: bool = False, sipgate_options: dict = None, month_cache: MonthCache = None, now: datetime = None, lines: list = None):
     
+    target_daytime_object = determine_target_date(nextday, now)
+
+    is_first_shift = is_first_shift_at(target_daytime_object)
+    # is_second_shift = not is_first_shift
+
+    redirects = fetch_shift_schedule_entries(schedule_base_url, schedule_login_payload, is_first_shift, target_daytime_object, month_cache, list(numbermap), lines)
+    logger.info(f"Redirects: {redirects}")
+
+    make_redirects(sipgate_base_url, sipgate_headers, numbermap, redirects, dryrun, sipgate_options=sipgate_options)
+
+    log_result()
+    return errors == 0
+
+
+async def fetch_and_apply_redirects_async(schedule_base_url: str, schedule_login_payload: str, numbermap: dict, sipgate_base_url: str, sipgate_headers: str, dryrun: bool, nextday: bool = False, sipgate_options: dict = None, month_cache: MonthCache = None, now: datetime = None, lines: list = None):
+    """
+    `fetch_and_apply_redirects`, but the schedule is crawled while the Sipgate directory is loaded,
+    and the lines are rerouted in parallel.
+
+    There is no async HTTP client, the blocking `requests` calls run in worker threads instead.
+    """
+    target_daytime_object = determine_target_date(nextday, now)
+
+    redirects, sipgate_manager = await asyncio.gather(
+        run_in_thread(fetch_shift_schedule_entries, schedule_base_url, schedule_login_payload,
+                      is_first_shift_at(target_daytime_object), target_daytime_object, month_cache, list(numbermap), lines),
+        run_in_thread(SipgateManager, sipgate_base_url, sipgate_headers, dryrun, **(sipgate_options or {})))
+    logger.info(f"Redirects: {redirects}")
+
+    await make_redirects_async(numbermap, redirects, sipgate_manager)
+
+    log_result()
     return errors == 0
 
-def run():
+
+def fetch_and_apply_redirects_concurrently(*args, **kwargs) -> bool:
+    """
+    Synchronous entry point of `fetch_and_apply_redirects_async`, takes the same arguments as `fetch_and_apply_redirects`.
+    """
+    # not `asyncio.run`, which needs Python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(fetch_and_apply_redirects_async(*args, **kwargs))
+    finally:
+        loop.close()
+
+
+def get_sipgate_options(sipgate_config: dict, refresh_directory: bool = False) -> dict:
+    """
+    Keyword arguments for `SipgateManager` from the "sipgate" section of the config.
+    If `refresh_directory` is set, the directory snapshot is invalidated so that it is fetched again.
+    """
+    sipgate_options = dict(sipgate_config.get("connection", {}))
+    directory_cache_config = sipgate_config.get("directory_cache")
+    if directory_cache_config:
+        directory_cache = DirectorySnapshot(directory_cache_config["path"], directory_cache_config.get("ttl", 86400))
+        if refresh_directory:
+            directory_cache.invalidate()
+        sipgate_options["directory_cache"] = directory_cache
+    journal_config = sipgate_config.get("journal")
+    if journal_config:
+        sipgate_options["journal"] = RedirectJournal(journal_config["path"], journal_config.get("max_age", 3600))
+    return sipgate_options
+
+
+def get_interval_cache(config_data: dict) -> messageparser.IntervalCache:
+    """
+    The cache of parsed substitution notes from the "interval_cache" section of the config,
+    persistent if it has a "path".
+    """
+    interval_cache_config = config_data.get("interval_cache", {})
+    return messageparser.IntervalCache(interval_cache_config.get("maxsize", 4096), interval_cache_config.get("path"))
+
+
+def get_cassette(config_data: dict) -> Optional[Cassette]:
+    """
+    The cassette to record the HTTP traffic to or to replay it from, from the "cassette" section of the config.
+    """
+    cassette_config = config_data.get("cassette")
+    return cassette_config and Cassette(cassette_config["path"], cassette_config.get("mode", "replay"))
+
+
+def use_cassette(cassette: Cassette, sipgate_options: dict) -> requests.Session:
+    """
+    Sends the Sipgate requests of `sipgate_options` through `cassette` and returns a session for the schedule which does the same.
+
+    A replay must not leave anything behind that a live run would trust, so the journal and the directory snapshot
+    are dropped from `sipgate_options` then.
+    """
+    logger.info(f"{cassette.mode.capitalize()}ing HTTP traffic in '{cassette.directory}'")
+    sipgate_options["transport"] = cassette.adapter
+    if cassette.mode == 'replay':
+        sipgate_options.pop("journal", None)
+        sipgate_options.pop("directory_cache", None)
+    return cassette.mount(requests.Session())
+
+
+def run(refresh_directory: bool = False, cassette: Cassette = None):
     with open('config.json', 'r') as config_file:
         config_data = json.load(config_file)
 
+    if "tenants" in config_data:
+        import tenants # imports this module
+        tenants.run_tenants(config_data, refresh_directory, cassette=cassette)
+        return
+
     global TESTING
     TESTING = config_data["TESTING"]
 
@@ -202,30 +405,51 @@ def run():
     SIPGATE_HEADERS = {'Authorization': 'Basic ' + config_data["sipgate"]["pass_base64"],
                     'Accept': 'application/json', 'Content-Type': 'application/json'}
     dryrun = config_data["sipgate"]["dryrun"]
+    SIPGATE_OPTIONS = get_sipgate_options(config_data["sipgate"], refresh_directory)
+    cassette = cassette or get_cassette(config_data)
+    session = cassette and use_cassette(cassette, SIPGATE_OPTIONS)
 
     logger.info(f"Test mode is {'enabled' if TESTING else 'disabled'}")
 
-    errors = 0
-    warnings = 0
-
-    success = fetch_and_apply_redirects(schedule_base_url,
-                                        schedule_login_payload,
-                                        NUMBER_MAP,
-                                        SIPGATE_BASE_URL,
-                                        SIPGATE_HEADERS,
-                                        dryrun,
-                                        nextday=False)
-
-    errors = 0
-    warnings = 0
-
-    success = fetch_and_apply_redirects(schedule_base_url,
-                                        schedule_login_payload,
-                                        NUMBER_MAP,
-                                        SIPGATE_BASE_URL,
-                                        SIPGATE_HEADERS,
-                                        dryrun,
-                                        nextday=True)
-
-if __name__ == "main":
-    run()
\ No newline at end of file
+    crawl.set_parser_backend(config_data.get("html_parser", "auto"))
+    logger.debug(f"Parsing html with {crawl.parser_backend}")
+    messageparser.set_interval_cache(get_interval_cache(config_data))
+
+    # crawl the schedule while loading the Sipgate directory and reroute the lines in parallel
+    apply_redirects = fetch_and_apply_redirects_concurrently if config_data.get("async_pipeline") else fetch_and_apply_redirects
+
+    # today and next day usually are in the same month, download and parse it only once
+    # and with a schedule cache, a month that didn't change since the last run isn't parsed again
+    schedule_cache_config = config_data.get("schedule_cache")
+    month_cache = MonthCache(schedule_base_url, schedule_login_payload, testing=TESTING, session=session,
+                             schedule_cache=schedule_cache_config and crawl.ScheduleCache(schedule_cache_config["path"]))
+
+    for nextday in NEXTDAY_RUNS:
+        errors = 0
+        warnings = 0
+
+        success = apply_redirects(schedule_base_url,
+                                            schedule_login_payload,
+                                            NUMBER_MAP,
+                                            SIPGATE_BASE_URL,
+                                            SIPGATE_HEADERS,
+                                            dryrun,
+                                            nextday=nextday,
+                                            sipgate_options=SIPGATE_OPTIONS,
+                                            month_cache=month_cache,
+                                            lines=config_data.get("lines"))
+
+    interval_cache = messageparser.interval_cache
+    logger.debug(f"Interval cache: {interval_cache.hits} hits, {interval_cache.misses} misses")
+    interval_cache.save()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Redirects the public phone numbers according to the shift schedule")
+    parser.add_argument('--refresh-directory', action='store_true', help="ignore the cached Sipgate directory and fetch it again")
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument('--record', metavar='DIRECTORY', help="record all HTTP responses into a cassette directory")
+    cassette_group.add_argument('--replay', metavar='DIRECTORY', help="replay the HTTP responses of a cassette directory instead of going online")
+    args = parser.parse_args()
+
+    cassette = args.record and Cassette(args.record, 'record') or args.replay and Cassette(args.replay, 'replay') or None
+    run(refresh_directory=args.refresh_directory, cassette=cassette)
@@ -0,0 +1,175 @@
+import json, logging, time, argparse
+import requests
+from datetime import datetime, timedelta, date
+from typing import List, Dict, Optional
+import crawl, crawler, messageparser
+from crawl import time_on_shift, RoutingTimeline
+from sipgate_api import SipgateManager
+from cassette import Cassette
+
+logger = logging.getLogger('daemon')
+
+SHIFT_STARTS = ["08:00", "20:00"]
+SHIFT_ENDS = ["20:00", "08:00"]
+
+class ScheduleDaemon(object):
+    """
+    Resident replacement for the cron triggered `crawler.run()`.
+
+    Reads the config once and keeps the parsed schedule, the Sipgate directory and the HTTP session in memory.
+    Instead of polling blindly it sleeps until the next shift or substitution boundary of the parsed schedule
+    (or until the schedule is due to be re-crawled, whatever comes first).
+    """
+
+    def __init__(self, config_data: dict, clock=datetime.now, sleep=time.sleep, refresh_directory: bool = False,
+                 cassette: Cassette = None):
+        daemon_config = config_data.get("daemon", {})
+
+        self.testing = config_data["TESTING"]
+        self.schedule_base_url = config_data["test_base_url" if self.testing else "real_base_url"]
+        self.schedule_login_payload = config_data["schedule_login_payload"]
+        self.default_number = config_data["fallback_phone_number"]
+        self.number_map = config_data["NUMBER_MAP"]
+        # the column of the schedule, i.e. the line of the timeline, of every key of NUMBER_MAP
+        self.line_columns = crawler.get_line_columns(list(self.number_map), config_data.get("lines"))
+        self.sipgate_base_url = config_data["sipgate"]["base_url"]
+        self.sipgate_headers = {'Authorization': 'Basic ' + config_data["sipgate"]["pass_base64"],
+                                'Accept': 'application/json', 'Content-Type': 'application/json'}
+        self.dryrun = config_data["sipgate"]["dryrun"]
+        self.sipgate_options = crawler.get_sipgate_options(config_data["sipgate"], refresh_directory)
+        self.poll_interval = timedelta(seconds=daemon_config.get("poll_interval", 300))
+        self.prefetch_days = daemon_config.get("prefetch_days", 3)
+        self.directory_refresh_interval = timedelta(seconds=daemon_config.get("directory_refresh_interval", 3600))
+
+        crawl.set_parser_backend(config_data.get("html_parser", "auto"))
+        schedule_cache_config = config_data.get("schedule_cache")
+        # kept in memory at least, so that a re-crawl only parses the rows which changed
+        self.schedule_cache = crawl.ScheduleCache(schedule_cache_config and schedule_cache_config["path"])
+        messageparser.set_interval_cache(crawler.get_interval_cache(config_data))
+
+        self.__clock = clock
+        self.__sleep = sleep
+        # all HTTP traffic is recorded into or replayed from the cassette, if there is one
+        self.cassette = cassette or crawler.get_cassette(config_data)
+        self.__session = crawler.use_cassette(self.cassette, self.sipgate_options) if self.cassette else requests.Session()
+        self.__sipgate_manager: Optional[SipgateManager] = None
+        self.__sipgate_manager_created: Optional[datetime] = None
+        self.month_cache = crawl.MonthCache(self.schedule_base_url, self.schedule_login_payload, testing=self.testing,
+                                            session=self.__session, schedule_cache=self.schedule_cache, clock=clock)
+        self.__applied_redirects: Dict[str, str] = {}
+        self.__timeline: Optional[RoutingTimeline] = None
+        # shift date -> the DayInfo it is in the timeline with
+        self.__timeline_days: Dict[date, crawl.DayInfo] = {}
+
+    def get_day_infos(self, year: int, month: int) -> List[crawl.DayInfo]:
+        """
+        Returns the parsed days of a month, re-crawling it once it is older than the poll interval.
+        """
+        loaded_at = self.month_cache.get_loaded_at(year, month)
+        if loaded_at and self.__clock() - loaded_at >= self.poll_interval:
+            logger.debug(f"Crawling schedule of {year}-{month:02}")
+            self.month_cache.forget(year, month)
+        return self.month_cache.get_day_infos(year, month)
+
+    def get_timeline(self, instant: datetime) -> RoutingTimeline:
+        """
+        The routing timeline of the days around `instant` (yesterday's night shift up to tomorrow's shifts).
+        Only the days which changed since the last call are compiled again.
+        """
+        days = []
+        for day_offset in (-1, 0, 1):
+            shift_date = (instant + timedelta(days=day_offset)).date()
+            try:
+                day_infos = self.get_day_infos(shift_date.year, shift_date.month)
+            except Exception as e:
+                if day_offset <= 0:
+                    raise
+                logger.warning(f"Schedule of {shift_date} is not available yet: {e}")
+                continue
+            days.append((shift_date, day_infos[shift_date.day - 1]))
+
+        if self.__timeline is None:
+            self.__timeline = RoutingTimeline.from_days(days, SHIFT_STARTS, SHIFT_ENDS, self.default_number, line_count=max(self.line_columns.values()) + 1)
+        else:
+            changed_days = [(shift_date, day_info) for shift_date, day_info in days if self.__timeline_days.get(shift_date) != day_info]
+            self.__timeline.replace_days(changed_days, SHIFT_STARTS, SHIFT_ENDS, self.default_number)
+            self.__timeline.discard_before(instant - timedelta(days=1))
+        self.__timeline_days = dict(days)
+        return self.__timeline
+
+    def get_redirects(self, instant: datetime, timeline: RoutingTimeline) -> Dict[str, Optional[str]]:
+        """
+        The private number every phone line has to be routed to at `instant`.
+        """
+        return {key: crawler.format_phone_number(timeline.lookup(line_id, instant)) for key, line_id in self.line_columns.items()}
+
+    def get_next_wakeup(self, instant: datetime, timeline: RoutingTimeline) -> datetime:
+        """
+        The next shift or substitution boundary after `instant`, at most one poll interval away.
+        """
+        return min(next(timeline.change_points(instant), instant + self.poll_interval), instant + self.poll_interval)
+
+    def get_sipgate_manager(self) -> SipgateManager:
+        now = self.__clock()
+        if not self.__sipgate_manager or now - self.__sipgate_manager_created >= self.directory_refresh_interval:
+            logger.debug("Loading Sipgate directory")
+            self.__sipgate_manager = SipgateManager(self.sipgate_base_url, self.sipgate_headers, self.dryrun,
+                                                   **self.sipgate_options)
+            self.__sipgate_manager_created = now
+        return self.__sipgate_manager
+
+    def tick(self) -> datetime:
+        """
+        Applies the redirects which are due now and returns when to wake up next.
+        """
+        now = self.__clock()
+        try:
+            timeline = self.get_timeline(now)
+        except Exception as e:
+            logger.error(f"Failed to crawl the schedule: {e}")
+            return now + self.poll_interval
+        messageparser.interval_cache.save()
+
+        redirects = self.get_redirects(now, timeline)
+        changed = {key: number for key, number in redirects.items() if self.__applied_redirects.get(key) != number}
+        if changed:
+            logger.info(f"Redirects: {changed}")
+            crawler.errors, crawler.warnings = 0, 0
+            try:
+                crawler.make_redirects(self.sipgate_base_url, self.sipgate_headers, self.number_map, changed, self.dryrun,
+                                       sipgate_manager=self.get_sipgate_manager())
+            except Exception as e:
+                # e.g. Sipgate is unreachable, the redirects are tried again on the next tick
+                logger.error(f"Failed to apply the redirects: {e}")
+                self.__sipgate_manager = None
+                return now + self.poll_interval
+            if not crawler.errors:
+                self.__applied_redirects.update(changed)
+
+        # load the next month in the background before the rollover needs it
+        self.month_cache.warm(now, self.prefetch_days)
+
+        next_wakeup = self.get_next_wakeup(now, timeline)
+        logger.debug(f"Next wakeup at {next_wakeup}")
+        return next_wakeup
+
+    def run_forever(self):
+        while True:
+            next_wakeup = self.tick()
+            delay = (next_wakeup - self.__clock()).total_seconds()
+            if delay > 0:
+                self.__sleep(delay)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keeps redirecting the public phone numbers according to the shift schedule")
+    parser.add_argument('--refresh-directory', action='store_true', help="ignore the cached Sipgate directory and fetch it again")
+    parser.add_argument('--record', metavar='DIRECTORY', help="record all HTTP responses into a cassette directory")
+    args = parser.parse_args()
+
+    with open('config.json', 'r') as config_file:
+        config_data = json.load(config_file)
+
+    logging.basicConfig(level=logging.INFO)
+    ScheduleDaemon(config_data, refresh_directory=args.refresh_directory,
+                   cassette=args.record and Cassette(args.record, 'record')).run_forever()
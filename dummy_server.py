@@ -0,0 +1,66 @@
+import os, threading, time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+DUMMY_DIENSTPLAN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dummy_dienstplan")
+
+
+class DummyScheduleHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        started_at = time.monotonic()
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        super().do_GET()
+        with self.server.lock:
+            self.server.intervals.append((self.path, started_at, time.monotonic()))
+
+    def send_response(self, code, message=None):
+        with self.server.lock:
+            self.server.responses.append((self.command, self.path, code))
+        super().send_response(code, message)
+
+
+class DummyScheduleServer(object):
+    """
+    Serves `dummy_dienstplan` in-process, like `start_dummy_server.bat` does on port 8081.
+    Supports `If-Modified-Since` and records the status code of every response in `responses`.
+    Every page is answered after `delay` seconds, to simulate the latency of the real server.
+    """
+
+    def __init__(self, directory: str = DUMMY_DIENSTPLAN, delay: float = 0):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), partial(DummyScheduleHandler, directory=directory))
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.responses = []
+        self.server.intervals = []
+        self.server.delay = delay
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    @property
+    def responses(self):
+        return self.server.responses
+
+    @property
+    def intervals(self):
+        """
+        (path, monotonic start, monotonic end) of every GET.
+        """
+        return self.server.intervals
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
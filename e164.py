@@ -0,0 +1,39 @@
+import re, sys
+from functools import lru_cache
+from typing import Optional
+
+# everything but digits, and every '+' which isn't the first character
+regex_non_digits = re.compile(r"[^0-9+]|(?!^)\+")
+
+
+def normalize_uncached(phone_number: Optional[str], country_code: str = '+49') -> Optional[str]:
+    """
+    The canonical E.164 form of `phone_number` (e.g. "+491729394781"), removing all special characters.
+
+    An international prefix "00" is replaced with '+', a number without any is prefixed with `country_code`
+    (after removing its leading trunk '0', unless it already starts with the digits of `country_code`).
+    """
+    if phone_number is None:
+        return None
+
+    digits = regex_non_digits.sub("", phone_number)
+    if not digits.isdigit():
+        # already prefixed with '+', or empty
+        return digits
+    if digits.startswith('00'):
+        return '+' + digits[2:]
+    digits = digits.lstrip('0')
+    if digits.startswith(country_code[1:]):
+        # the country code is already at the start of the number, assuming only the '+' is missing
+        return '+' + digits
+    return country_code + digits
+
+
+@lru_cache(maxsize=4096)
+def normalize(phone_number: Optional[str], country_code: str = '+49') -> Optional[str]:
+    """
+    `normalize_uncached`, memoized. The results are interned, so that the keys of the Sipgate directory
+    and the numbers parsed from the schedule are the very same strings.
+    """
+    normalized = normalize_uncached(phone_number, country_code)
+    return normalized and sys.intern(normalized)
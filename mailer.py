@@ -1,4 +1,4 @@
-import json, requests, logging
+import json, requests, logging, asyncio
 from datetime import datetime
 
 class MailgunApi(object):
@@ -14,15 +14,22 @@ class MailgunApi(object):
     def send_simple_message(self, recipients, subject, text):
 
         return requests.post(
-            f"https://api.eu.mailgun.net/v3/{mailgun_domain}/messages",
-            auth=("api", mailgun_key),
-            data={"from": f"Notfallseelsorge Schichtplan Sipgate Adapter <schichtsystem@{mailgun_domain}>",
-                "to": f"schichtsystem@{mailgun_domain}",
+            f"https://api.eu.mailgun.net/v3/{self.mailgun_domain}/messages",
+            auth=("api", self.mailgun_key),
+            data={"from": f"Notfallseelsorge Schichtplan Sipgate Adapter <schichtsystem@{self.mailgun_domain}>",
+                "to": f"schichtsystem@{self.mailgun_domain}",
                 "bcc": recipients,
                 "subject": subject,
                 "text": text})
 
 
+    async def send_simple_message_async(self, recipients, subject, text):
+        """
+        `send_simple_message` in a worker thread, so that an async caller isn't blocked.
+        """
+        return await asyncio.get_event_loop().run_in_executor(None, self.send_simple_message, recipients, subject, text)
+
+
     def send_confirmation_mail(self, recipients, text):
         time_string = datetime.strftime(datetime.now(), "%H:%M %d.%m.%y")
         return self.send_simple_message(recipients, f"Bestätigung Umstellung Telefonsystem {time_string} Uhr", text)
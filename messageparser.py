@@ -1,11 +1,18 @@
-import re
+import re, heapq, json, os, threading
+from collections import OrderedDict
 from typing import List, Set, Dict, Tuple, Optional
 import logging
 from enum import Enum
 
+logger = logging.getLogger("Parser")
+
 regex_valid_time = r"\d{1,2}\:\d\d"
-regex_from_to = re.compile(f" (?P<from>{regex_valid_time}) (?:uhr)? - (?P<to>{regex_valid_time}) (?:uhr)?".replace(' ', r'\s*'))
-regex_from_or_to = re.compile(f" (?P<fromOrTo>(?:bis)|(?:ab)) (?P<time>{regex_valid_time})".replace(' ', r'\s*'))
+# "08:00 uhr - 10:00 uhr" or else "bis 10:00" / "ab 08:00", in a single match
+regex_timeslot = re.compile(
+    f" (?:(?P<from>{regex_valid_time}) (?:uhr)? - (?P<to>{regex_valid_time}) (?:uhr)?|(?P<fromOrTo>(?:bis)|(?:ab)) (?P<time>{regex_valid_time}))"
+    .replace(' ', r'\s*'))
+regex_phone_number = re.compile(r"(?:\s)\+?\d{5,}")
+regex_timeslot_separator = re.compile(r"(?:und)|,")
 
 
 class FromOrTill(Enum):
@@ -13,14 +20,34 @@ class FromOrTill(Enum):
     TILL = 'bis'
 
 
+MINUTES_PER_DAY = 24 * 60
+
+
+def time_to_minutes(time: str) -> int:
+    """
+    "HH:MM" or "H:MM" to minutes since midnight.
+    """
+    hours, minutes = time.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
 class TimeRule(object):
-    def __init__(self, time: str, from_or_till: FromOrTill, phone_number: str, pair_id: int = None):
+    """
+    Start (FROM) or end (TILL) of a substitution.
+
+    Rules are ordered by `minutes`, the minutes since the start of their shift, so that e.g. 07:00 comes
+    after 20:00 in the 20:00 - 08:00 shift. Without a `shift_start` that's simply the minutes since midnight.
+    """
+    __slots__ = ('time', 'from_or_till', 'pair_id', 'phone_number', 'minutes', 'sortable_key')
+
+    def __init__(self, time: str, from_or_till: FromOrTill, phone_number: str, pair_id: int = None, shift_start: str = "00:00"):
         self.time = time
         self.from_or_till = from_or_till
         self.pair_id = pair_id
         self.phone_number = phone_number
-        # a comes before z, as FROM should be before TILL
-        self.sortable_key = f"{self.time}{'a' if self.from_or_till == FromOrTill.FROM else 'z'}"
+        self.minutes = (time_to_minutes(time) - time_to_minutes(shift_start)) % MINUTES_PER_DAY
+        # FROM comes before TILL
+        self.sortable_key = (self.minutes, 0 if self.from_or_till == FromOrTill.FROM else 1)
 
     def __repr__(self):
         return f"""TimeRule(time="{self.time}", from_or_till="{self.from_or_till}", pair_id={self.pair_id}, phone_number="{self.phone_number}")"""
@@ -45,89 +72,106 @@ def parse_rules_from_message(shift_start: str, shift_end: str, default_number: s
     -------
     Safely handles falsy messages (None, emptystring, ...) by returning the default_number for the entire timespan.
     """
-    logger = logging.getLogger("Parser")
-    logger.debug(f"Processing text '{message}'")
+    if not message:
+        return [TimeRule(time=shift_start, from_or_till=FromOrTill.FROM, phone_number=default_number, shift_start=shift_start)]
+
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("Processing text '%s'", message)
 
     rules: List[TimeRule] = []
-    
-    if message:
-        # pad all hours, 9:12 -> 09:12
-        message = message.lower()
-        re.sub(r"(?<=\D)(\d:\d\d)", r"0\1", message)
-        pair_id = 1
-
-        for substitute in message.split(';'):
-            logger.debug(f"Processing substitute '{substitute}'")
-
-            numbers = re.findall(r"(?:\s)\+?\d{5,}", substitute)
-            if len(numbers) != 1:
-                logger.error(f"Found {len(numbers)} telephone numbers in substitute segment '{substitute}' but expected only one")
+    pair_id = 1
+
+    for substitute in message.lower().split(';'):
+        if debug:
+            logger.debug("Processing substitute '%s'", substitute)
+
+        numbers = regex_phone_number.findall(substitute)
+        if len(numbers) != 1:
+            logger.error("Found %d telephone numbers in substitute segment '%s' but expected only one", len(numbers), substitute)
+            continue
+
+        number = numbers[0].strip()
+        if debug:
+            logger.debug("  Found phone number '%s' in substitute '%s'", number, substitute)
+
+        for timeslot in regex_timeslot_separator.split(substitute):
+            matches = regex_timeslot.match(timeslot)
+            if not matches:
+                logger.error("    Failed to parse timeslot '%s', make sure to use the format 'hh:mm - hh:mm' or 'ab hh:mm' or 'bis hh:mm'", timeslot)
                 continue
 
-            number = numbers[0].strip()
-            logger.debug(f"  Found phone number '{number}' in substitute '{substitute}'")
-
-            for timeslot in re.split(r"(?:und)|,", substitute):
-                logger.debug(f"  Processing timeslot '{timeslot}'")
-
-                matches = regex_from_to.match(timeslot)
-                if matches:
-                    # matches 12:30- 13:20 and 12:30 Uhr - 13:20 Uhr
-                    time_from, time_till = matches.group('from'), matches.group('to')
-                    logger.debug(f"    Extracted timeslot '{time_from}' to '{time_till}'")
-                    rules.append(TimeRule(time=time_from, from_or_till=FromOrTill.FROM, phone_number=number, pair_id=pair_id))
-                    rules.append(TimeRule(time=time_till, from_or_till=FromOrTill.TILL, phone_number=number, pair_id=pair_id))
-                    pair_id += 1
-                    continue
-
-                matches = regex_from_or_to.match(timeslot)
-                if matches:
-                    # Matches 'ab 13:20' or 'bis 13:20'
-                    prefix, time = matches.group('fromOrTo'), matches.group('time')
-                    logger.debug(f"    Extracted timeslot '{prefix}' '{time}'")
-                    if prefix == 'bis':
-                        logger.debug(f"    Equivalent to '{shift_start}' '{time}'")
-                        rules.append(TimeRule(time=shift_start, from_or_till=FromOrTill.FROM, phone_number=number))
-                        rules.append(TimeRule(time=time, from_or_till=FromOrTill.TILL, phone_number=number))
-                        continue
-                    elif prefix == 'ab':
-                        logger.debug(f"    Equivalent to '{time}' '{shift_end}'")
-                        rules.append(TimeRule(time=time, from_or_till=FromOrTill.FROM, phone_number=number))
-                        rules.append(TimeRule(time=shift_end, from_or_till=FromOrTill.TILL, phone_number=number))  # superfluous
-                        continue
-                    raise Exception(f"Failed to parse timeslot '{timeslot}', this should never happen")
-
-                logger.error(f"    Failed to parse timeslot '{timeslot}', make sure to use the format 'hh:mm - hh:mm' or 'ab hh:mm' or 'bis hh:mm'")
-
-    if not any(rule.time == shift_start for rule in rules):
-        rules.append(TimeRule(time=shift_start, from_or_till=FromOrTill.FROM, phone_number=default_number))
+            time_from, time_till, prefix, time = matches.group('from', 'to', 'fromOrTo', 'time')
+            if time_from:
+                # matches 12:30- 13:20 and 12:30 Uhr - 13:20 Uhr
+                if debug:
+                    logger.debug("    Extracted timeslot '%s' to '%s'", time_from, time_till)
+                rules.append(TimeRule(time=time_from, from_or_till=FromOrTill.FROM, phone_number=number, pair_id=pair_id, shift_start=shift_start))
+                rules.append(TimeRule(time=time_till, from_or_till=FromOrTill.TILL, phone_number=number, pair_id=pair_id, shift_start=shift_start))
+                pair_id += 1
+            elif prefix == 'bis':
+                # Matches 'bis 13:20', equivalent to 'shift_start - 13:20'
+                if debug:
+                    logger.debug("    Extracted timeslot '%s' '%s'", shift_start, time)
+                rules.append(TimeRule(time=shift_start, from_or_till=FromOrTill.FROM, phone_number=number, shift_start=shift_start))
+                rules.append(TimeRule(time=time, from_or_till=FromOrTill.TILL, phone_number=number, shift_start=shift_start))
+            else:
+                # Matches 'ab 13:20', equivalent to '13:20 - shift_end'
+                if debug:
+                    logger.debug("    Extracted timeslot '%s' '%s'", time, shift_end)
+                rules.append(TimeRule(time=time, from_or_till=FromOrTill.FROM, phone_number=number, shift_start=shift_start))
+                rules.append(TimeRule(time=shift_end, from_or_till=FromOrTill.TILL, phone_number=number, shift_start=shift_start))  # superfluous
+
+    if not any(rule.minutes == 0 for rule in rules):
+        rules.append(TimeRule(time=shift_start, from_or_till=FromOrTill.FROM, phone_number=default_number, shift_start=shift_start))
 
     return TimeRule.sort(rules)
 
 
 def time_rules_to_interval_list(rules: List[TimeRule], default_number: str, shift_end: str):
-    # tricky: we have to translate the rules into a continuous list of intervals with the correct number for that interval
-    # If we encouter a substitution ending rule, we need to change back to the previous number, so we need a stack to keep
-    # track of the currently active numbers and take the most recent one of those
+    """
+    Sweeps over the sorted `rules` and translates them into a continuous list of `[start, end, phone_number]` intervals.
 
+    Remarks
+    -------
+    Substitutions can overlap, the most recently started one that hasn't ended yet wins. When a substitution ends,
+    the number falls back to the one that was active before. Instead of scanning a stack on every end, the active
+    substitutions are kept in a heap (most recent on top) and ended ones are only dropped once they reach the top.
+    """
     intervals = []
-    # On the stack only the phone_number and pair_id are relevant
-    stack: List[TimeRule] = [TimeRule("", FromOrTill.FROM, default_number, None)]
-    for rule in rules:
+    interval_minutes = []
+    # (-sequence, phone_number), the default number is active from the start
+    heap: List[Tuple[int, str]] = [(0, default_number)]
+    # (pair_id, phone_number) -> sequences of the not yet ended substitutions started by matching FROM rules
+    active: Dict[Tuple[Optional[int], str], List[int]] = {(None, default_number): [0]}
+    ended: Set[int] = set()
+
+    for sequence, rule in enumerate(rules, start=1):
+        key = (rule.pair_id, rule.phone_number)
         if rule.from_or_till == FromOrTill.FROM:
-            stack.insert(0, rule) # the top of the stack is at 0, this is needes because the remove function scans an array from left to right.
+            active.setdefault(key, []).append(sequence)
+            heapq.heappush(heap, (-sequence, rule.phone_number))
         else: # TILL
-            if rule in stack:
-                stack.remove(rule)  # remove previously added FROM with same phone_number & pair_id
+            sequences = active.get(key)
+            if sequences:
+                ended.add(sequences.pop()) # ends the most recent FROM with same phone_number & pair_id
+
+        while heap and -heap[0][0] in ended:
+            heapq.heappop(heap)
 
-        intervals.append([rule.time, stack[0].phone_number])
+        intervals.append([rule.time, heap[0][1] if heap else default_number])
+        interval_minutes.append(rule.minutes)
 
     for i in range(len(intervals) - 1):
         intervals[i].insert(1, intervals[i + 1][0])
     intervals[-1].insert(1, shift_end)
 
-    no_empty_intervals = filter(lambda interval: interval[0] != interval[1], intervals)
-    return list(no_empty_intervals)
+    # minutes of the shift end since the shift start, which all rules are relative to
+    shift_start_minutes = time_to_minutes(rules[-1].time) - rules[-1].minutes
+    interval_minutes.append((time_to_minutes(shift_end) - shift_start_minutes) % MINUTES_PER_DAY or MINUTES_PER_DAY)
+
+    no_empty_intervals = [interval for i, interval in enumerate(intervals) if interval_minutes[i] != interval_minutes[i + 1]]
+    return no_empty_intervals
 
 
 def get_interval_list_from_message(shift_start: str, shift_end: str, default_number: str, message: str):
@@ -161,3 +205,114 @@ def get_interval_list_from_message(shift_start: str, shift_end: str, default_num
                                      default_number=default_number,
                                      message=message)
     return time_rules_to_interval_list(rules, default_number, shift_end)
+
+
+# (shift_start, shift_end, default_number, message)
+IntervalKey = Tuple[str, str, str, str]
+# ((interval_start, interval_end, phone_number), ...)
+Intervals = Tuple[Tuple[str, str, str], ...]
+
+
+class IntervalCache(object):
+    """
+    LRU cache of `get_interval_list_from_message`, the same notes and default numbers recur on most days of a month.
+
+    Intervals are returned as tuples of tuples, so callers can't modify the cached result.
+    `hits` and `misses` tell how well the cache works, at most `maxsize` results are kept.
+    Thread safe, the tenants and the prefetch of the next month parse notes at the same time.
+    With a `path` the cache can be `save`d and is loaded again by the next process, unless it was saved
+    with another `VERSION`.
+    """
+
+    # bump whenever `get_interval_list_from_message` returns something else for the same note,
+    # so that intervals of the previous parser aren't loaded from a saved cache
+    VERSION = 1
+
+    def __init__(self, maxsize: int = 4096, path: str = None):
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.__entries: "OrderedDict[IntervalKey, Intervals]" = OrderedDict()
+        self.__dirty = False
+        # a note is parsed outside of the lock, at worst two threads parse the same one
+        self.__lock = threading.Lock()
+        if path:
+            self.__load()
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__entries)
+
+    def __load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as cache_file:
+                saved = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable interval cache '%s': %s", self.path, e)
+            return
+        if not isinstance(saved, dict) or saved.get('version') != IntervalCache.VERSION:
+            logger.info("Ignoring interval cache '%s' of another parser version", self.path)
+            return
+        for key, intervals in saved['entries'][-self.maxsize:]:
+            self.__entries[tuple(key)] = tuple(map(tuple, intervals))
+
+    def save(self):
+        """
+        Writes the cache to `path`, if it has changed since it was loaded.
+        """
+        with self.__lock:
+            if not self.path or not self.__dirty:
+                return
+            entries = list(self.__entries.items())
+            self.__dirty = False
+        # write to a temporary file first, so an interrupted write never leaves a corrupt cache behind
+        with open(self.path + '.tmp', 'w') as cache_file:
+            json.dump({'version': IntervalCache.VERSION, 'entries': entries}, cache_file)
+        os.replace(self.path + '.tmp', self.path)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.__dirty = True
+
+    def get_interval_list_from_message(self, shift_start: str, shift_end: str, default_number: str, message: str) -> Intervals:
+        key = (shift_start, shift_end, default_number, message or "")
+        with self.__lock:
+            intervals = self.__entries.get(key)
+            if intervals is not None:
+                self.hits += 1
+                self.__entries.move_to_end(key)
+                return intervals
+            self.misses += 1
+
+        intervals = tuple(map(tuple, get_interval_list_from_message(shift_start, shift_end, default_number, message)))
+        with self.__lock:
+            self.__entries[key] = intervals
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+            self.__dirty = True
+        return intervals
+
+
+interval_cache = IntervalCache()
+
+
+def set_interval_cache(cache: IntervalCache):
+    """
+    Replaces the cache used by `get_cached_interval_list`, e.g. by a persistent one.
+    """
+    global interval_cache
+    interval_cache = cache
+
+
+def get_cached_interval_list(shift_start: str, shift_end: str, default_number: str, message: str) -> Intervals:
+    """
+    `get_interval_list_from_message` through `interval_cache`, as tuples instead of lists.
+    """
+    return interval_cache.get_interval_list_from_message(shift_start, shift_end, default_number, message)
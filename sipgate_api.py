@@ -1,12 +1,24 @@
 import requests
 import json
 import logging
-from typing import List, Set, Dict, Tuple, Optional
+import os
+import random
+import threading
+import time
+import e164
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from dataclasses import dataclass
+from enum import Enum
+from typing import List, Set, Dict, Tuple, Optional, Iterable, Iterator
 
 class UserInfo(object):
     """
     Holds information about users (retrieved from the SIPGATE API).
     """
+    __slots__ = ('id', 'firstname', 'lastname', 'email')
+
     def __init__(self, id : str, firstname : str, lastname : str, email : str):
         self.id = id
         self.firstname = firstname
@@ -16,17 +28,187 @@ class UserInfo(object):
     def __str__(self):
         return f"[User ID={self.id} FirstName={self.firstname} LastName={self.lastname} Email={self.email}]"
 
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in UserInfo.__slots__}
+
+class TokenBucket(object):
+    """
+    Limits the requests of all `ApiCaller`s with the same credentials to `rate` per second, with bursts of up to `capacity`.
+    Without a `rate` it only enforces pauses, e.g. the `Retry-After` of a 429 response.
+
+    Thread safe. Use `TokenBucket.shared` to get the one bucket of a credential.
+    """
+
+    __shared: Dict[str, 'TokenBucket'] = {}
+    __shared_lock = threading.Lock()
+
+    def __init__(self, rate: Optional[float] = None, capacity: int = 10, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.wait_time = 0.0
+        self.__clock = clock
+        self.__sleep = sleep
+        self.__lock = threading.Lock()
+        self.__tokens = float(capacity)
+        self.__updated = clock()
+        self.__paused_until = 0.0
+
+    @classmethod
+    def shared(cls, credential: str, rate: Optional[float] = None, capacity: int = 10) -> 'TokenBucket':
+        """
+        The bucket of `credential`, created with `rate` and `capacity` by the first caller.
+        Callers with other limits share the strictest of them, with a warning. Without a `rate` a caller has
+        no preference and leaves the limit as it is.
+        """
+        with cls.__shared_lock:
+            bucket = cls.__shared.get(credential)
+            if bucket is None:
+                bucket = cls.__shared[credential] = cls(rate, capacity)
+            elif rate is not None and (bucket.rate, bucket.capacity) != (rate, capacity):
+                strictest = (rate, capacity) if bucket.rate is None else (min(bucket.rate, rate), min(bucket.capacity, capacity))
+                logging.getLogger(TokenBucket.__name__).warning(
+                    f"Callers of these credentials configure different rate limits, {bucket.rate}/s (burst {bucket.capacity}) "
+                    f"and {rate}/s (burst {capacity}), all of them are limited to {strictest[0]}/s (burst {strictest[1]})")
+                bucket.configure(*strictest)
+            return bucket
+
+    def configure(self, rate: Optional[float], capacity: int):
+        """
+        Changes `rate` and `capacity`, the tokens taken so far still count.
+        """
+        with self.__lock:
+            now = self.__clock()
+            if self.rate:
+                self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+            self.__updated = now
+            self.__tokens = min(float(capacity), self.__tokens)
+            self.rate = rate
+            self.capacity = capacity
+
+    def acquire(self) -> float:
+        """
+        Takes a token, waiting until one is available and any pause is over. Returns the seconds waited.
+        """
+        waited = 0.0
+        while True:
+            with self.__lock:
+                now = self.__clock()
+                if self.rate:
+                    self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+                self.__updated = now
+                delay = self.__paused_until - now
+                if self.rate and self.__tokens < 1:
+                    delay = max(delay, (1 - self.__tokens) / self.rate)
+                if delay <= 0:
+                    if self.rate:
+                        self.__tokens -= 1
+                    self.wait_time += waited
+                    return waited
+            self.__sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float):
+        """
+        Holds back all requests for `seconds`, e.g. because the API answered 429.
+        """
+        with self.__lock:
+            self.__paused_until = max(self.__paused_until, self.__clock() + seconds)
+
+
+def get_retry_after(response: requests.Response) -> Optional[float]:
+    """
+    The seconds to wait according to the `Retry-After` header (seconds or an HTTP date) of `response`, if any.
+    """
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
 class ApiCaller(object):
     """
-    Wrapper for API calls, for better error handling, logging and a foundation for retries
+    Wrapper for API calls, for better error handling, logging and retries.
+
+    All calls go through one pooled keep-alive `requests.Session`.
+    Idempotent calls (GET and PUT `/numbers/{id}`) are retried on connection errors and 5xx responses
+    with jittered exponential backoff.
+
+    Requests are throttled by the `TokenBucket` shared by all callers with the same credentials. A 429 response
+    pauses that bucket for `Retry-After` seconds and the request is sent again afterwards, whatever its method.
+    `throttle_wait` and `throttled_count` tell how long requests were held back and how often the API answered 429.
     """
 
-    def __init__(self, base_url: str, headers, logger=None):
+    RETRY_STATUS_CODES = {500, 502, 503, 504}
+    # the list endpoints known to page by `offset` and `limit`, the others are fetched at once
+    PAGED_LISTS = {'/app/users', '/numbers'}
+
+    def __init__(self, base_url: str, headers, logger=None, pool_size: int = 10, timeout: float = 10,
+                 max_retries: int = 3, backoff_factor: float = 0.5, max_concurrent_requests: int = 8,
+                 rate_limit: float = None, burst: int = 10, max_throttle_retries: int = 5, page_size: int = 100,
+                 transport: requests.adapters.BaseAdapter = None):
+        """
+        Parameters
+        ----------
+        pool_size
+            Maximum number of kept alive connections to the API.
+        timeout
+            Seconds to wait for the API to connect and to respond, per request.
+        max_retries
+            How often an idempotent request is retried before giving up.
+        backoff_factor
+            The nth retry waits a random time between 0 and `backoff_factor * 2^n` seconds.
+        max_concurrent_requests
+            How many requests may run in parallel when fanning out, e.g. to fetch the devices of all users.
+        rate_limit
+            Maximum requests per second with these credentials, unlimited by default.
+        burst
+            How many requests may be sent at once before `rate_limit` applies.
+        max_throttle_retries
+            How often a request is sent again after a 429 response before giving up.
+        page_size
+            How many items to request per page of a list, e.g. of the users.
+        transport
+            Sends the requests instead of a pooled `HTTPAdapter`, e.g. the adapter of a `cassette.Cassette`.
+        """
         self.base_url = base_url
         self.headers = headers
         self.logger = logger   
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_throttle_retries = max_throttle_retries
+        self.page_size = page_size
+        self.retry_count = 0
+        self.throttled_count = 0
+        self.throttle_wait = 0.0
+        self.rate_limiter = TokenBucket.shared(base_url + ' ' + str(headers.get('Authorization')), rate_limit, burst)
         self.__logger = logging.getLogger(ApiCaller.__name__)
 
+        self.session = requests.Session()
+        adapter = transport or requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, max_concurrent_requests))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if transport:
+            # the transport does its own networking, if any, so there are no proxies to look up per request
+            self.session.trust_env = False
+
+    @staticmethod
+    def is_idempotent(http_method: str, relative_url: str) -> bool:
+        return http_method == 'get' or (http_method == 'put' and relative_url.startswith('/numbers/'))
+
+    def __backoff(self, attempt: int):
+        delay = random.uniform(0, self.backoff_factor * 2 ** attempt)
+        self.__logger.debug(f"Retrying in {delay:.2f}s")
+        time.sleep(delay)
+
     def __request(self, http_method, relative_url, data=None, headers=None):
         """
         Parameters
@@ -38,20 +220,96 @@ class ApiCaller(object):
         headers : {Authorization, Accept, content type}
         """
         headers = headers or self.headers
-        try:
-            response = requests.request(
-                http_method, self.base_url + relative_url, data=data, headers=headers)
-            response.raise_for_status()
+        retries = self.max_retries if ApiCaller.is_idempotent(http_method, relative_url) else 0
+        attempt = 0
+        throttled = 0
 
+        while True:
+            self.throttle_wait += self.rate_limiter.acquire()
             try:
-                return response.json()
-            except:
-                return True
+                response = self.session.request(
+                    http_method, self.base_url + relative_url, data=data, headers=headers, timeout=self.timeout)
+                if response.status_code == 429 and throttled < self.max_throttle_retries:
+                    # the request wasn't processed, so even a non idempotent one can be sent again
+                    retry_after = get_retry_after(response)
+                    delay = retry_after if retry_after is not None else random.uniform(0, self.backoff_factor * 2 ** throttled)
+                    self.__logger.warning(f"{http_method.upper()} {relative_url} throttled, sending it again in {delay:.2f}s")
+                    self.throttled_count += 1
+                    throttled += 1
+                    self.rate_limiter.pause(delay)
+                    continue
+                if response.status_code in ApiCaller.RETRY_STATUS_CODES and attempt < retries:
+                    self.__logger.warning(f"{http_method.upper()} {relative_url} failed with HTTP {response.status_code}")
+                    self.retry_count += 1
+                    self.__backoff(attempt)
+                    attempt += 1
+                    continue
+                response.raise_for_status()
 
-        except requests.exceptions.RequestException as e:
-            # Log error e to log
-            self.__logger.error(e)
-            return False
+                try:
+                    return response.json()
+                except:
+                    return True
+
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt < retries:
+                    self.__logger.warning(f"{http_method.upper()} {relative_url} failed: {e}")
+                    self.retry_count += 1
+                    self.__backoff(attempt)
+                    attempt += 1
+                    continue
+                self.__logger.error(e)
+                return False
+
+            except requests.exceptions.RequestException as e:
+                # Log error e to log
+                self.__logger.error(e)
+                return False
+
+    def iter_items(self, relative_url: str) -> Iterator[dict]:
+        """
+        Yields the `items` of a list endpoint page by page (`offset` and `limit`), as soon as each page arrives,
+        if the endpoint is one of the `PAGED_LISTS`, otherwise all of them from a single request.
+        Stops after `totalCount` items, or at the first page that isn't full if the API doesn't tell the count.
+        A page with more than `limit` items or the same items as the page before means the endpoint ignores paging,
+        so its items are taken as the whole list.
+        """
+        if relative_url not in self.PAGED_LISTS:
+            response = self.__request('get', relative_url)
+            if not response:
+                raise Exception(f"Failed to get {relative_url}")
+            yield from response['items']
+            return
+
+        offset = 0
+        previous_items = None
+        while True:
+            response = self.__request('get', f"{relative_url}?offset={offset}&limit={self.page_size}")
+            if not response:
+                raise Exception(f"Failed to get {relative_url} (offset {offset})")
+            items = response['items']
+            if items and items == previous_items:
+                self.__logger.warning(f"{relative_url} ignores the offset, stopped paging at {offset} items")
+                return
+            yield from items
+            if len(items) > self.page_size:
+                self.__logger.warning(f"{relative_url} ignores the limit of {self.page_size}, took its {len(items)} items as the whole list")
+                return
+            offset += len(items)
+            previous_items = items
+            total_count = response.get('totalCount')
+            if not items or (offset >= total_count if total_count is not None else len(items) < self.page_size):
+                return
+
+    def iter_users(self) -> Iterator[UserInfo]:
+        """
+        Yields the ids, first and last names and email address of the users, page by page.
+        """
+        for item in self.iter_items("/app/users"):
+            yield UserInfo(id = item['id'],
+                firstname = item['firstname'],
+                lastname = item['lastname'],
+                email = item['email'])
 
     def get_users(self) -> List[UserInfo]:
         """
@@ -63,16 +321,7 @@ class ApiCaller(object):
         UserInfo[]
         ```
         """
-        response = self.__request('get', "/app/users") # todo 
-        
-        users:List[UserInfo] = []
-        
-        for item in response['items']:
-            users.append(UserInfo(id = item['id'],
-                firstname = item['firstname'],
-                lastname = item['lastname'],
-                email = item['email']))
-        return users
+        return list(self.iter_users())
 
     def get_public_phone_numbers(self):
         """
@@ -88,19 +337,20 @@ class ApiCaller(object):
         ```
         """
         numbers = {}
-        response = self.__request('get', '/numbers')
-        for item in response['items']:
-            numbers[item['number']] = {'id': item['id']} # , 'endpointId': item['endpointId']} ToDo do we need the endpoint?
+        for item in self.iter_items('/numbers'):
+            # the endpoint is the phone line the number currently routes to, it allows to skip redundant rerouting
+            numbers[e164.normalize(item['number'])] = {'id': item['id'], 'endpointId': item.get('endpointId')}
         
         return numbers
 
-    def fetch_private_phone_number_to_user_mapping(self, users: List[UserInfo]):
+    def fetch_private_phone_number_to_user_mapping(self, users: Iterable[UserInfo]):
         """
         Get all private numbers of all given users mapped to the user.
 
         Parameters
         ----------
-        users: Users from ApiCaller.get_users()
+        users: Users from ApiCaller.get_users(), or streamed from ApiCaller.iter_users() to fetch the devices
+            of the first users while the next page of users is still loading
 
         Returns
         -------
@@ -114,40 +364,396 @@ class ApiCaller(object):
         # - Type2: Sipgate sim card
         # - Type3: Sipgate VOIP
 
+        # The requests run in parallel, but the responses are merged in the order of `users`,
+        # so duplicates are resolved (and logged) exactly as if they were fetched one after another
         target_phone_numbers: Dict = {}
-        for user in users: # todo get users
-            response = self.__request('get', '/' + user.id + '/devices')
-            for device_dict in response['items']:
-                device_phone_number = device_dict.get('number')
-                if not device_phone_number:
-                    self.__logger.info(f"device {device_dict['id']} of user {user.lastname} ({user.id}) does not have a linked phone number")
-                    continue
-
-                if device_phone_number in target_phone_numbers:
-                    if target_phone_numbers[device_phone_number]['userId'] != user.id:
-                        self.__logger.warning(f"Number {device_phone_number} from user {user.id} was already target number of user {target_phone_numbers[device_phone_number]}. Skipping.")
-                    else:
-                        self.__logger.info(f"Number {device_phone_number} from user {user.id} is a duplicate.")
-                    continue
-
-                # saving userId and all active phone line ids under the target number. The phone lines are sorted by id (in length and value)
-                target_phone_numbers[device_phone_number] = {'userId': user.id, 'activePhonelines': sorted(
-                    device_dict['activePhonelines'], key=lambda ps: (len(ps['id']), ps['id']))}
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_requests) as executor:
+            # submitted while `users` is iterated, not after
+            futures = [(user, executor.submit(lambda user: list(self.iter_items('/' + user.id + '/devices')), user)) for user in users]
+            for user, future in futures:
+                self.__merge_devices(target_phone_numbers, user, future.result())
 
         self.__logger.debug(f"Dictionary with target_numbers with their user's ids and active phone lines: {target_phone_numbers}")
             
         return target_phone_numbers
-    
+
+    def __merge_devices(self, target_phone_numbers: Dict, user: UserInfo, devices: List[dict]):
+        """
+        Adds the devices of `user` (the items of `GET /{userId}/devices`) to `target_phone_numbers`.
+        """
+        for device_dict in devices:
+            # normalized, so that the number matches however it was entered in the schedule or in sipgate
+            device_phone_number = e164.normalize(device_dict.get('number'))
+            if not device_phone_number:
+                self.__logger.info(f"device {device_dict['id']} of user {user.lastname} ({user.id}) does not have a linked phone number")
+                continue
+
+            if device_phone_number in target_phone_numbers:
+                if target_phone_numbers[device_phone_number]['userId'] != user.id:
+                    self.__logger.warning(f"Number {device_phone_number} from user {user.id} was already target number of user {target_phone_numbers[device_phone_number]}. Skipping.")
+                else:
+                    self.__logger.info(f"Number {device_phone_number} from user {user.id} is a duplicate.")
+                continue
+
+            # saving userId and all active phone line ids under the target number. The phone lines are sorted by id (in length and value)
+            target_phone_numbers[device_phone_number] = {'userId': user.id, 'activePhonelines': sorted(
+                device_dict['activePhonelines'], key=lambda ps: (len(ps['id']), ps['id']))}
+
     def forward_outbound_to_private_phone_number(self, outbound_phone_number_id : str, private_phone_number_id : str) -> bool:
         return self.__request('put', '/numbers/' + outbound_phone_number_id, data=json.dumps({'endpointId': private_phone_number_id}))
 
 
+class DirectorySnapshot(object):
+    """
+    Caches the SIPGATE directory (users, their devices and the public numbers) in memory and in a json file,
+    as it rarely changes but is expensive to fetch.
+
+    Where the public numbers currently route to can be changed by hand any time, so their endpoints aren't kept:
+    the public numbers are always fetched again, with a single request.
+    """
+
+    # path -> snapshot, shared by all instances of the process
+    __memory: Dict[str, dict] = {}
+
+    def __init__(self, path: str, ttl: float = 86400, clock=time.time):
+        """
+        Parameters
+        ----------
+        path
+            File to persist the snapshot to.
+        ttl
+            Seconds after which a snapshot is considered stale.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.__clock = clock
+        self.__logger = logging.getLogger(DirectorySnapshot.__name__)
+
+    def load(self) -> Optional[dict]:
+        """
+        Returns the snapshot `{created, users, private_phone_number_to_user_mapping, numbers}`,
+        or None if there is none or it is older than the ttl.
+        """
+        snapshot = DirectorySnapshot.__memory.get(self.path)
+        if not snapshot and os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except (OSError, ValueError) as e:
+                self.__logger.warning(f"Ignoring unreadable directory snapshot '{self.path}': {e}")
+                return None
+            DirectorySnapshot.__memory[self.path] = snapshot
+
+        if not snapshot or self.__clock() - snapshot['created'] >= self.ttl:
+            return None
+        return snapshot
+
+    def save(self, users: List[UserInfo], private_phone_number_to_user_mapping: dict, numbers: dict):
+        snapshot = {
+            'created': self.__clock(),
+            'users': [user.to_dict() for user in users],
+            'private_phone_number_to_user_mapping': private_phone_number_to_user_mapping,
+            'numbers': {number: {'id': public_number['id']} for number, public_number in numbers.items()},
+        }
+        DirectorySnapshot.__memory[self.path] = snapshot
+
+        # write to a temporary file first, so an interrupted write never leaves a corrupt snapshot behind
+        with open(self.path + '.tmp', 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(self.path + '.tmp', self.path)
+
+    def invalidate(self):
+        DirectorySnapshot.__memory.pop(self.path, None)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class PublicNumber(object):
+    """
+    A public number of the SIPGATE account and the phone line (endpoint) it currently routes to.
+    """
+    __slots__ = ('number', 'id', 'endpoint_id')
+
+    def __init__(self, number: str, id: str, endpoint_id: Optional[str]):
+        self.number = number
+        self.id = id
+        self.endpoint_id = endpoint_id
+
+
+class DirectoryIndex(object):
+    """
+    The SIPGATE directory, indexed once for constant time lookups in both directions:
+    private number -> endpoint, endpoint -> private number, user -> private numbers and public number -> current target.
+
+    Built from the raw API payloads (or a `DirectorySnapshot` of them), which aren't kept.
+    A private number routes to the first of its active phone lines, every one of them maps back to it.
+    """
+    __slots__ = ('users', '__endpoints', '__private_numbers', '__devices', '__public_numbers')
+
+    def __init__(self, users: List[UserInfo], private_phone_number_to_user_mapping: dict, numbers: dict):
+        """
+        Parameters
+        ----------
+        users
+            From `ApiCaller.get_users`.
+        private_phone_number_to_user_mapping
+            From `ApiCaller.fetch_private_phone_number_to_user_mapping`.
+        numbers
+            From `ApiCaller.get_public_phone_numbers`.
+        """
+        self.users: Dict[str, UserInfo] = {user.id: user for user in users}
+        self.__endpoints: Dict[str, str] = {}
+        self.__private_numbers: Dict[str, str] = {}
+        self.__devices: Dict[str, List[str]] = {}
+        for private_number, device in private_phone_number_to_user_mapping.items():
+            private_number = e164.normalize(private_number)
+            self.__devices.setdefault(device['userId'], []).append(private_number)
+            phone_lines = device['activePhonelines']
+            if phone_lines:
+                self.__endpoints[private_number] = phone_lines[0]['id']
+            for phone_line in phone_lines:
+                self.__private_numbers.setdefault(phone_line['id'], private_number)
+        self.__public_numbers: Dict[str, PublicNumber] = {}
+        for public_number, number in numbers.items():
+            public_number = e164.normalize(public_number)
+            self.__public_numbers[public_number] = PublicNumber(public_number, number['id'], number.get('endpointId'))
+
+    def get_endpoint(self, private_phone_number: str) -> Optional[str]:
+        """
+        The id of the phone line calls to `private_phone_number` have to be routed to, None if it is unknown.
+        """
+        return self.__endpoints.get(private_phone_number)
+
+    def get_private_number(self, endpoint_id: str) -> Optional[str]:
+        """
+        The private number of the device the phone line `endpoint_id` belongs to.
+        """
+        return self.__private_numbers.get(endpoint_id)
+
+    def get_devices(self, user_id: str) -> List[str]:
+        """
+        The private numbers of all devices of a user.
+        """
+        return self.__devices.get(user_id, [])
+
+    def get_public_number(self, public_phone_number: str) -> Optional[PublicNumber]:
+        return self.__public_numbers.get(public_phone_number)
+
+    def get_current_target(self, public_phone_number: str) -> Optional[str]:
+        """
+        The private number `public_phone_number` currently routes to, None if it is unknown or routes elsewhere
+        (e.g. to a phone line without a private number).
+        """
+        public_number = self.__public_numbers.get(public_phone_number)
+        return public_number and self.__private_numbers.get(public_number.endpoint_id)
+
+    def set_endpoint(self, public_phone_number: str, endpoint_id: str):
+        self.__public_numbers[public_phone_number].endpoint_id = endpoint_id
+
+    def get_numbers(self) -> dict:
+        """
+        The public numbers in the format of `ApiCaller.get_public_phone_numbers`, for the `DirectorySnapshot`.
+        """
+        return {number.number: {'id': number.id, 'endpointId': number.endpoint_id} for number in self.__public_numbers.values()}
+
+
+@dataclass
+class PlannedRedirect:
+    """
+    Desired versus actual routing of a public number.
+    `error` is set if the redirect can't be applied, e.g. because a number is unknown to sipgate.
+    """
+    outbound_phone_number: str
+    redirect_phone_number: str
+    outbound_number_id: Optional[str] = None
+    current_endpoint_id: Optional[str] = None
+    target_endpoint_id: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def is_unchanged(self) -> bool:
+        return not self.error and self.current_endpoint_id == self.target_endpoint_id
+
+    def __str__(self):
+        if self.error:
+            return f"{self.outbound_phone_number} -> {self.redirect_phone_number}: {self.error}"
+        change = "unchanged" if self.is_unchanged else f"{self.current_endpoint_id} -> {self.target_endpoint_id}"
+        return f"{self.outbound_phone_number} -> {self.redirect_phone_number}: {change}"
+
+
+class RedirectJournal(object):
+    """
+    Append-only JSONL log of the redirect writes to SIPGATE, synced to disk before and after every write.
+
+    A write is journaled as "planned" before the request and as "completed" after it, so after a crash
+    the unfinished ones are known and can be replayed (setting the endpoint of a number is idempotent).
+    Lines whose routing was checked against the directory are journaled as "verified".
+    The latest successful entry of every public number is what it is believed to route to right now.
+    """
+
+    PLAN_FIELDS = ['outbound_phone_number', 'redirect_phone_number', 'outbound_number_id', 'target_endpoint_id']
+
+    def __init__(self, path: str, max_age: float = 3600, max_entries: int = 1000, clock=time.time):
+        """
+        Parameters
+        ----------
+        path
+            File of the journal.
+        max_age
+            Seconds for which a believed routing is trusted without loading the directory of SIPGATE.
+        max_entries
+            The journal is compacted to the latest entry of every number once it grows beyond this.
+        """
+        self.path = path
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__logger = logging.getLogger(RedirectJournal.__name__)
+        self.__next_id = 1
+        self.__entry_count = 0
+        # id -> planned entry which isn't completed yet
+        self.__unfinished: Dict[int, dict] = {}
+        # outbound phone number -> latest entry, with `success` once completed
+        self.__latest: Dict[str, dict] = {}
+        self.__load()
+
+    def __load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as journal_file:
+            for line in journal_file:
+                try:
+                    self.__apply(json.loads(line))
+                except ValueError:
+                    # the last line may be cut off by a crash
+                    self.__logger.warning(f"Ignoring corrupt line in redirect journal '{self.path}'")
+        if self.__entry_count > self.max_entries:
+            self.compact()
+
+    def __apply(self, entry: dict):
+        self.__entry_count += 1
+        self.__next_id = max(self.__next_id, entry['id'] + 1)
+        if entry['event'] == 'completed':
+            planned = self.__unfinished.pop(entry['id'], None)
+            if planned:
+                planned = dict(planned, success=entry['success'], time=entry['time'])
+                if self.__latest.get(planned['outbound_phone_number'], {}).get('id', 0) <= planned['id']:
+                    self.__latest[planned['outbound_phone_number']] = planned
+            return
+        if entry['event'] == 'planned':
+            self.__unfinished[entry['id']] = entry
+        self.__latest[entry['outbound_phone_number']] = entry
+
+    def __append(self, entry: dict):
+        with open(self.path, 'a') as journal_file:
+            journal_file.write(json.dumps(entry) + '\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self.__apply(entry)
+
+    def __record(self, event: str, plan: PlannedRedirect, **fields) -> int:
+        with self.__lock:
+            entry = {'id': self.__next_id, 'event': event, 'time': self.__clock(),
+                     **{name: getattr(plan, name) for name in RedirectJournal.PLAN_FIELDS}, **fields}
+            self.__append(entry)
+            return entry['id']
+
+    def record_planned(self, plan: PlannedRedirect) -> int:
+        """
+        Journals a write before it is sent, returns the id to complete it with.
+        """
+        return self.__record('planned', plan)
+
+    def record_completed(self, entry_id: int, success: bool):
+        with self.__lock:
+            self.__append({'id': entry_id, 'event': 'completed', 'time': self.__clock(), 'success': success})
+        if self.__entry_count > self.max_entries:
+            self.compact()
+
+    def record_verified(self, plan: PlannedRedirect):
+        """
+        Journals that a number was found to already route where it should.
+        """
+        self.__record('verified', plan, success=True)
+
+    def get_unfinished(self) -> List[Tuple[int, PlannedRedirect, float]]:
+        """
+        The ids, plans and ages in seconds of the writes which were planned but never completed,
+        e.g. because the process died, oldest first.
+        """
+        return [(entry_id, PlannedRedirect(**{name: entry[name] for name in RedirectJournal.PLAN_FIELDS}), self.__clock() - entry['time'])
+                for entry_id, entry in sorted(self.__unfinished.items())]
+
+    def get_believed_plans(self, redirects: Dict[str, str]) -> Optional[List[PlannedRedirect]]:
+        """
+        Unchanged plans for `redirects` if, according to the journal, all of them already route where they should
+        (and that isn't older than `max_age`), otherwise None.
+        """
+        plans = []
+        for outbound_phone_number, redirect_phone_number in redirects.items():
+            entry = self.__latest.get(outbound_phone_number)
+            if (not entry or not entry.get('success') or entry['redirect_phone_number'] != redirect_phone_number
+                    or self.__clock() - entry['time'] >= self.max_age):
+                return None
+            plans.append(PlannedRedirect(outbound_phone_number, redirect_phone_number, entry['outbound_number_id'],
+                                         entry['target_endpoint_id'], entry['target_endpoint_id']))
+        return plans
+
+    def compact(self):
+        """
+        Rewrites the journal with only the latest entry of every number and the unfinished writes.
+        """
+        with self.__lock:
+            entries = sorted(list(self.__latest.values()) + list(self.__unfinished.values()), key=lambda entry: entry['id'])
+            # a completed write becomes a planned entry plus its completion again
+            lines = []
+            for entry in {entry['id']: entry for entry in entries}.values():
+                if entry['event'] == 'planned' and 'success' in entry:
+                    lines.append({key: value for key, value in entry.items() if key != 'success'})
+                    lines.append({'id': entry['id'], 'event': 'completed', 'time': entry['time'], 'success': entry['success']})
+                else:
+                    lines.append(entry)
+            with open(self.path + '.tmp', 'w') as journal_file:
+                journal_file.writelines(json.dumps(line) + '\n' for line in lines)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            os.replace(self.path + '.tmp', self.path)
+            self.__entry_count = len(lines)
+
+
+class RedirectStatus(Enum):
+    APPLIED = 'applied'
+    UNCHANGED = 'unchanged'
+    FAILED = 'failed'
+    DRYRUN = 'dryrun'
+
+
+@dataclass
+class RedirectResult:
+    """
+    Outcome of a single line of `SipgateManager.apply_redirects`.
+    `duration` is how many seconds the write took, 0 if nothing had to be written.
+    """
+    plan: PlannedRedirect
+    status: RedirectStatus
+    duration: float = 0
+
+    @property
+    def is_success(self) -> bool:
+        return self.status != RedirectStatus.FAILED
+
+    def __str__(self):
+        return f"{self.status.value}: {self.plan} ({self.duration * 1000:.0f}ms)"
+
+
 class SipgateManager(object):
     """
     Establishes a connection to sipgate and allows to redirect public phone numbers to private ones.
     """
     
-    def __init__(self, base_url: str, headers: dict, dryrun: bool = False):
+    def __init__(self, base_url: str, headers: dict, dryrun: bool = False, directory_cache: DirectorySnapshot = None,
+                 journal: RedirectJournal = None, **connection_options):
         """
         Parameters
         ----------
@@ -158,31 +764,73 @@ class SipgateManager(object):
         dryrun
             If true `set_redirect_phone_number` does not actually reroute phone numbers 
             but just logs intended changes to WARNING.
+        directory_cache
+            If given, the directory is taken from this snapshot while it is fresh, instead of fetching it via the API.
+        journal
+            If given, every write is journaled, and writes a previous process didn't finish are replayed
+            by `apply_redirects`.
+        connection_options
+            Passed on to `ApiCaller`, e.g. `pool_size`, `timeout` and `max_retries`.
         """
         self.__dryrun = dryrun
-        self.__sipgate_api = ApiCaller(base_url, headers)
+        self.__sipgate_api = ApiCaller(base_url, headers, **connection_options)
         self.__logger = logging.getLogger(SipgateManager.__name__)
-        
+        self.__directory_cache = directory_cache
+        self.__journal = journal
+        # redirects may be applied from several threads at once, see `apply_redirects`
+        self.__numbers_lock = threading.Lock()
+
+        snapshot = directory_cache and directory_cache.load()
+        if snapshot:
+            self.__logger.debug(f"Using directory snapshot '{directory_cache.path}'")
+            # the endpoints may have been changed by hand since the snapshot, so only users and devices are taken from it.
+            # snapshots of older versions may contain numbers which aren't normalized yet, the index normalizes them
+            self.__directory = DirectoryIndex([UserInfo(**user) for user in snapshot['users']],
+                                              snapshot['private_phone_number_to_user_mapping'],
+                                              self.__sipgate_api.get_public_phone_numbers())
+            self.__is_directory_from_cache = True
+        else:
+            self.__load_directory()
+
+    def __load_directory(self):
+        """
+        Fetches users, their devices and the public numbers via the API and updates the snapshot.
+        """
+        self.__is_directory_from_cache = False
         self.__logger.debug("Get all users")
 
-        users = self.__sipgate_api.get_users()
+        users: List[UserInfo] = []
 
-        for user in users: 
-            self.__logger.debug(f"Found user {user}")
+        def stream_users():
+            # the devices of a user are fetched as soon as its page of users arrived
+            for user in self.__sipgate_api.iter_users():
+                self.__logger.debug(f"Found user {user}")
+                users.append(user)
+                yield user
 
-        self.__private_phone_number_to_user_mapping = self.__sipgate_api.fetch_private_phone_number_to_user_mapping(users)
+        private_phone_number_to_user_mapping = self.__sipgate_api.fetch_private_phone_number_to_user_mapping(stream_users())
 
-        for phone_number in self.__private_phone_number_to_user_mapping: 
-            self.__logger.debug(f"Public phone number {phone_number} maps to private phone number {self.__private_phone_number_to_user_mapping[phone_number]}")
+        for phone_number in private_phone_number_to_user_mapping: 
+            self.__logger.debug(f"Public phone number {phone_number} maps to private phone number {private_phone_number_to_user_mapping[phone_number]}")
 
-        self.__numbers = self.__sipgate_api.get_public_phone_numbers()
+        numbers = self.__sipgate_api.get_public_phone_numbers()
 
-        self.__logger.debug(f"Dictionary with numbers and their ids and endpoints: {self.__numbers}")
+        self.__logger.debug(f"Dictionary with numbers and their ids and endpoints: {numbers}")
 
-    def set_redirect_phone_number(self, outbound_phone_number: str, redirect_phone_number: str) -> bool:
+        self.__directory = DirectoryIndex(users, private_phone_number_to_user_mapping, numbers)
+        if self.__directory_cache:
+            self.__directory_cache.save(users, private_phone_number_to_user_mapping, numbers)
+
+    @property
+    def directory(self) -> DirectoryIndex:
         """
-        Function to reroute outbound number to employees phone number
-        returns True for success ans False for Failure
+        The index of the SIPGATE directory, e.g. for reports of who every public number currently routes to.
+        """
+        return self.__directory
+
+    def plan_redirect(self, outbound_phone_number: str, redirect_phone_number: str) -> PlannedRedirect:
+        """
+        Compares the current endpoint of `outbound_phone_number` with the one `redirect_phone_number` requires.
 
         Parameters
         ----------
@@ -191,29 +839,154 @@ class SipgateManager(object):
             redirect_phone_number : str
                 The number to redirect to.
         """
-        try:
-            outbund_number_id = self.__numbers[outbound_phone_number]['id']
-        except:
-            self.__logger.error(f"Desired outbund number '{outbound_phone_number}' not found via api. Make sure to use full number (+49...)")
-            return False
-        try:
-            # Redirect calls to the outbund number to the first active phoneline connected with the targeted external phone number
-            redirect_target_id = self.__private_phone_number_to_user_mapping[redirect_phone_number]['activePhonelines'][0]['id']
-        except:
-            self.__logger.error(f"Target phone number '{redirect_phone_number}' not found. Outbund number '{redirect_phone_number}' not rerouted")
+        outbound_phone_number, redirect_phone_number = e164.normalize(outbound_phone_number), e164.normalize(redirect_phone_number)
+        if self.__is_directory_from_cache and (not self.__directory.get_public_number(outbound_phone_number)
+                                               or not self.__directory.get_endpoint(redirect_phone_number)):
+            self.__logger.info(f"'{outbound_phone_number}' or '{redirect_phone_number}' not in directory snapshot, refreshing it")
+            self.__load_directory()
+
+        plan = PlannedRedirect(outbound_phone_number, redirect_phone_number)
+        public_number = self.__directory.get_public_number(outbound_phone_number)
+        if public_number:
+            plan.outbound_number_id = public_number.id
+            plan.current_endpoint_id = public_number.endpoint_id
+        else:
+            plan.error = f"Desired outbund number '{outbound_phone_number}' not found via api. Make sure to use full number (+49...)"
+            self.__logger.error(plan.error)
+            return plan
+        # Redirect calls to the outbund number to the first active phoneline connected with the targeted external phone number
+        plan.target_endpoint_id = self.__directory.get_endpoint(redirect_phone_number)
+        if not plan.target_endpoint_id:
+            plan.error = f"Target phone number '{redirect_phone_number}' not found. Outbund number '{outbound_phone_number}' not rerouted"
+            self.__logger.error(plan.error)
+            return plan
+
+        return plan
+
+    def plan_redirects(self, redirects: Dict[str, str]) -> List[PlannedRedirect]:
+        """
+        Plans all redirects at once.
+
+        Parameters
+        ----------
+            redirects
+                Dictionary<outbound_phone_number, redirect_phone_number>
+        """
+        return [self.plan_redirect(outbound_phone_number, redirect_phone_number)
+                for outbound_phone_number, redirect_phone_number in redirects.items()]
+
+    def apply_redirect(self, plan: PlannedRedirect) -> bool:
+        """
+        Reroutes the outbound number of `plan`, unless it already routes to the desired endpoint.
+        returns True for success ans False for Failure
+        """
+        if plan.error:
             return False
 
+        if plan.is_unchanged:
+            self.__logger.info(f"Outbund number '{plan.outbound_phone_number}'({plan.outbound_number_id}) already routes"
+                + f" to user device number '{plan.redirect_phone_number}'(id: {plan.target_endpoint_id})")
+            return True
+
         if not self.__dryrun:
-            if self.__sipgate_api.forward_outbound_to_private_phone_number(outbund_number_id, redirect_target_id):
-                self.__logger.info(f"Successfully rerouted outbund number '{outbound_phone_number}'({outbund_number_id})"
-                    + f" to user device number '{redirect_phone_number}'(id: {redirect_target_id})")
+            entry_id = self.__journal and self.__journal.record_planned(plan)
+            success = self.__sipgate_api.forward_outbound_to_private_phone_number(plan.outbound_number_id, plan.target_endpoint_id)
+            if self.__journal:
+                self.__journal.record_completed(entry_id, success)
+            if success:
+                self.__logger.info(f"Successfully rerouted outbund number '{plan.outbound_phone_number}'({plan.outbound_number_id})"
+                    + f" to user device number '{plan.redirect_phone_number}'(id: {plan.target_endpoint_id})")
+                with self.__numbers_lock:
+                    self.__directory.set_endpoint(plan.outbound_phone_number, plan.target_endpoint_id)
                 return True
             else:
                 return False
         else:
-            self.__logger.warning(f"[DRYRUN] Would have rerouted outbund number '{outbound_phone_number}'({outbund_number_id})"
-                    + f" to user device number '{redirect_phone_number}'(id: {redirect_target_id}) otherwise.")
+            self.__logger.warning(f"[DRYRUN] Would have rerouted outbund number '{plan.outbound_phone_number}'({plan.outbound_number_id})"
+                    + f" to user device number '{plan.redirect_phone_number}'(id: {plan.target_endpoint_id}) otherwise.")
             return True
 
+    def apply_redirects(self, redirects: Dict[str, str]) -> List[RedirectResult]:
+        """
+        Validates all redirects against the directory first, then reroutes the changed ones in parallel
+        (at most `max_concurrent_requests` at once).
+
+        Parameters
+        ----------
+            redirects
+                Dictionary<outbound_phone_number, redirect_phone_number>
+
+        Returns
+        -------
+        One result per redirect, in the order of `redirects`.
+        """
+        self.resume(redirects)
+
+        results = []
+        for plan in self.plan_redirects(redirects):
+            if plan.error:
+                results.append(RedirectResult(plan, RedirectStatus.FAILED))
+            elif plan.is_unchanged:
+                results.append(RedirectResult(plan, RedirectStatus.UNCHANGED))
+            else:
+                results.append(RedirectResult(plan, RedirectStatus.DRYRUN if self.__dryrun else RedirectStatus.APPLIED))
+
+        def apply(result: RedirectResult):
+            start = time.perf_counter()
+            if not self.apply_redirect(result.plan):
+                result.status = RedirectStatus.FAILED
+            result.duration = time.perf_counter() - start
+
+        writes = [result for result in results if result.status == RedirectStatus.APPLIED]
+        if len(writes) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(writes), self.__sipgate_api.max_concurrent_requests)) as executor:
+                list(executor.map(apply, writes))
+        else:
+            for result in writes:
+                apply(result)
+        for result in results:
+            if result.status == RedirectStatus.DRYRUN:
+                apply(result)
+            elif result.status == RedirectStatus.UNCHANGED and self.__journal:
+                self.__journal.record_verified(result.plan)
+
+        return results
+
+    def resume(self, redirects: Dict[str, str] = None) -> int:
+        """
+        Replays the writes of the journal which a previous process planned but never completed.
+
+        Writes older than the `max_age` of the journal, or of numbers which `redirects` is about to route anyway,
+        are given up instead (journaled as failed), so a line is never routed to someone who is no longer on call.
+        Returns how many were replayed.
+        """
+        if not self.__journal or self.__dryrun:
+            return 0
+        outbound_phone_numbers = {e164.normalize(outbound_phone_number) for outbound_phone_number in redirects or {}}
+        replayed = 0
+        for entry_id, plan, age in self.__journal.get_unfinished():
+            if age >= self.__journal.max_age or plan.outbound_phone_number in outbound_phone_numbers:
+                self.__logger.info(f"Giving up unfinished redirect {plan}")
+                self.__journal.record_completed(entry_id, False)
+                continue
+            self.__logger.warning(f"Replaying unfinished redirect {plan}")
+            self.__journal.record_completed(entry_id, self.apply_redirect(plan))
+            replayed += 1
+        return replayed
+
+    def set_redirect_phone_number(self, outbound_phone_number: str, redirect_phone_number: str) -> bool:
+        """
+        Function to reroute outbound number to employees phone number
+        returns True for success ans False for Failure
+
+        Parameters
+        ----------
+            outbound_phone_number : str
+                Public constant number which shall redirect to the redirect_phone_number.
+            redirect_phone_number : str
+                The number to redirect to.
+        """
+        return self.apply_redirect(self.plan_redirect(outbound_phone_number, redirect_phone_number))
+
     def __str__(self):
         return f"[{SipgateManager.__name__}<{self.__sipgate_api.base_url}>]"
\ No newline at end of file
@@ -0,0 +1,164 @@
+import json, threading, time
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Tuple, Optional
+
+
+class SipgateStubHandler(BaseHTTPRequestHandler):
+    # keep-alive, so that connection reuse of the clients is observable
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def handle_request(self, method: str):
+        stub: SipgateStub = self.server.stub
+        started_at = time.monotonic()
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        with self.server.lock:
+            stub.requests.append((method, self.path, body))
+            retry_after = stub.consume_quota()
+            failures = stub.failures.get(urlsplit(self.path).path)
+            status = failures.pop(0) if failures and retry_after is None else None
+
+        if stub.delay:
+            time.sleep(stub.delay)
+        with self.server.lock:
+            stub.intervals.append((self.path, started_at, time.monotonic()))
+
+        if retry_after is not None:
+            self.respond(429, {}, {'Retry-After': f"{retry_after:.3f}"})
+            return
+        if status:
+            self.respond(status, {})
+            return
+
+        status, payload = stub.route(method, self.path, body)
+        self.respond(status, payload)
+
+    def respond(self, status: int, payload, headers: Dict[str, str] = None):
+        content = json.dumps(payload).encode() if status != 204 else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class SipgateStub(object):
+    """
+    Local stand-in for the parts of the SIPGATE API we use, for tests and benchmarks.
+
+    Serves `users`, their `devices` and the public `numbers`, records every request and
+    can be told to answer with error codes via `failures = {path: [status, ...]}`.
+    `intervals` tells when each request was received and answered.
+    Lists are paged by `offset` and `limit` query parameters, but at most `max_page_size` items per page,
+    with the `totalCount` of all items.
+    With a `quota = (requests, seconds)` it answers 429 with a `Retry-After` header once more than
+    `requests` arrive within `seconds`, like the real API does, and counts that in `throttled_count`.
+    """
+
+    def __init__(self, users: List[dict] = None, devices: Dict[str, List[dict]] = None, numbers: List[dict] = None, delay: float = 0,
+                 quota: Optional[Tuple[int, float]] = None, max_page_size: int = 1000):
+        self.users = users or []
+        self.devices = devices or {}
+        self.numbers = numbers or []
+        self.delay = delay
+        self.quota = quota
+        self.max_page_size = max_page_size
+        self.failures: Dict[str, List[int]] = {}
+        self.requests = []
+        # (path, monotonic start, monotonic end) of every request, to tell which requests overlapped
+        self.intervals: List[Tuple[str, float, float]] = []
+        self.throttled_count = 0
+        self.__accepted: List[float] = []
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SipgateStubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.server.lock = threading.Lock()
+        self.server.connection_count = 0
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    @property
+    def connection_count(self) -> int:
+        return self.server.connection_count
+
+    def consume_quota(self) -> Optional[float]:
+        """
+        None if a request is within the quota, otherwise the seconds until it would be. Called under the server lock.
+        """
+        if not self.quota:
+            return None
+        limit, period = self.quota
+        now = time.monotonic()
+        self.__accepted = [accepted for accepted in self.__accepted if now - accepted < period]
+        if len(self.__accepted) >= limit:
+            self.throttled_count += 1
+            return period - (now - self.__accepted[0])
+        self.__accepted.append(now)
+        return None
+
+    def page(self, items: List[dict], query: Dict[str, List[str]]) -> dict:
+        offset = int(query.get('offset', [0])[0])
+        limit = min(int(query.get('limit', [self.max_page_size])[0]), self.max_page_size)
+        return {'items': items[offset:offset + limit], 'totalCount': len(items)}
+
+    def route(self, method: str, path: str, body: bytes):
+        url = urlsplit(path)
+        path, query = url.path, parse_qs(url.query)
+        if method == 'GET' and path == '/app/users':
+            return 200, self.page(self.users, query)
+        if method == 'GET' and path == '/numbers':
+            return 200, self.page(self.numbers, query)
+        if method == 'GET' and path.endswith('/devices'):
+            user_id = path.split('/')[1]
+            if user_id in self.devices:
+                return 200, self.page(self.devices[user_id], query)
+        if method == 'PUT' and path.startswith('/numbers/'):
+            number_id = path.split('/')[2]
+            for number in self.numbers:
+                if number['id'] == number_id:
+                    number['endpointId'] = json.loads(body)['endpointId']
+                    return 204, None
+        return 404, {}
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def create_team(user_count: int, delay: float = 0, quota: Optional[Tuple[int, float]] = None, max_page_size: int = 1000) -> SipgateStub:
+    """
+    A stub with `user_count` users, each with one external phone, and three public numbers.
+    """
+    users = [{'id': f"w{i}", 'firstname': f"First{i}", 'lastname': f"Last{i}", 'email': f"user{i}@example.com"}
+             for i in range(user_count)]
+    devices = {f"w{i}": [{'id': f"x{i}", 'number': f"+49170{i:07}", 'activePhonelines': [{'id': f"p{i}", 'alias': f"Line {i}"}]}]
+               for i in range(user_count)}
+    numbers = [{'id': str(i), 'number': f"+49231{i:05}", 'endpointId': 'p0'} for i in range(3)]
+    return SipgateStub(users, devices, numbers, delay, quota, max_page_size)
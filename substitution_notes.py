@@ -0,0 +1,20 @@
+import random
+from typing import List
+
+
+def generate_substitution_notes(count: int, seed: int = 0) -> List[str]:
+    """
+    Random notes in (and sometimes slightly out of) the format documented in `messageparser.get_interval_list_from_message`.
+    """
+    generator = random.Random(seed)
+    time = lambda: f"{generator.randint(0, 23):0{generator.choice([1, 2])}}{generator.choice([':', ':', ':', '.'])}{generator.choice(['00', '15', '30', '45'])}"
+    uhr = lambda: generator.choice(['', '', ' Uhr', ' uhr', 'Uhr'])
+    number = lambda: generator.choice(['+49', '0', '+44', '']) + str(generator.randint(10 ** 3, 10 ** 9))
+    timeslot = lambda: generator.choice([
+        lambda: f"{time()}{uhr()}{generator.choice(['-', ' - ', ' -', ' bis '])}{time()}{uhr()}",
+        lambda: f"{generator.choice(['bis', 'ab', 'Bis', 'Ab', 'von'])} {time()}{uhr()}",
+        lambda: generator.choice(['Pfarrer Mustermann', 'danach', 'übernimmt', '']),
+    ])()
+    substitute = lambda: generator.choice([', ', ' und ', ' UND ', ',']).join(timeslot() for _ in range(generator.randint(1, 3))) \
+        + generator.choice([' ', '  ', ': ', '']) + ' '.join(number() for _ in range(generator.choice([1, 1, 1, 0, 2])))
+    return ['; '.join(substitute() for _ in range(generator.randint(1, 4))) for _ in range(count)]
@@ -0,0 +1,179 @@
+import json, logging, os, argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Dict, Optional
+import crawl, crawler, messageparser
+from cassette import Cassette
+from sipgate_api import SipgateManager, RedirectResult
+
+logger = logging.getLogger('tenants')
+
+# sections which are merged key by key with the shared section instead of being replaced
+MERGED_SECTIONS = ["sipgate", "daemon"]
+
+
+def tenant_path(path: str, name: str) -> str:
+    """
+    "sipgate_directory.json" -> "sipgate_directory.<name>.json"
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}.{name}{extension}"
+
+
+def get_tenant_configs(config_data: dict) -> Dict[str, dict]:
+    """
+    The config of every tenant in the "tenants" section, by name.
+
+    Everything outside of "tenants" is shared and only overridden by what a tenant sets itself. Cache files
+    inherited from the shared config get the name of the tenant in their path, so no two tenants share a file.
+    A config without "tenants" is a single tenant named "default".
+    """
+    if "tenants" not in config_data:
+        return {"default": config_data}
+
+    shared = {key: value for key, value in config_data.items() if key != "tenants"}
+    tenant_configs = {}
+    for tenant in config_data["tenants"]:
+        name = tenant["name"]
+        if name in tenant_configs:
+            raise Exception(f"Tenant '{name}' is configured twice")
+        tenant_config = {**shared, **tenant}
+        for section in MERGED_SECTIONS:
+            if section in shared or section in tenant:
+                tenant_config[section] = {**shared.get(section, {}), **tenant.get(section, {})}
+
+        if "schedule_cache" not in tenant and "schedule_cache" in shared:
+            tenant_config["schedule_cache"] = dict(shared["schedule_cache"], path=tenant_path(shared["schedule_cache"]["path"], name))
+        for sipgate_file in ["directory_cache", "journal"]:
+            file_config = shared.get("sipgate", {}).get(sipgate_file)
+            if file_config and sipgate_file not in tenant.get("sipgate", {}):
+                tenant_config["sipgate"][sipgate_file] = dict(file_config, path=tenant_path(file_config["path"], name))
+
+        tenant_configs[name] = tenant_config
+
+    # the journal of a tenant is replayed with its credentials, it must never see the writes of another one
+    journal_paths = [tenant_config["sipgate"]["journal"]["path"] for tenant_config in tenant_configs.values()
+                     if "journal" in tenant_config.get("sipgate", {})]
+    if len(set(journal_paths)) != len(journal_paths):
+        raise Exception("Tenants must not share a redirect journal, give each of them its own sipgate.journal.path")
+    return tenant_configs
+
+
+@dataclass
+class TenantResult:
+    """
+    Outcome of one tenant of `run_tenants`. `error` is set if the tenant failed entirely.
+    `redirects` are those due now, `results` those of every run (see `crawler.NEXTDAY_RUNS`),
+    `errors` and `warnings` count what was logged for this tenant alone.
+    """
+    name: str
+    redirects: Dict[str, Optional[str]] = field(default_factory=dict)
+    results: List[RedirectResult] = field(default_factory=list)
+    error: Optional[str] = None
+    errors: int = 0
+    warnings: int = 0
+
+    @property
+    def is_success(self) -> bool:
+        return not self.error and not self.errors and all(self.redirects.values()) and all(result.is_success for result in self.results)
+
+
+def run_tenant(name: str, tenant_config: dict, session: requests.Session = None, refresh_directory: bool = False,
+               now: datetime = None, cassette: Cassette = None) -> TenantResult:
+    """
+    Redirects the lines of a single tenant to the shift which is due at `now`, and then to the one of the next day,
+    like `crawler.run` does. Any exception is caught and reported in the result, so it never affects other tenants,
+    and its errors and warnings are counted in the result instead of `crawler.errors` and `crawler.warnings`.
+    With a `cassette` all HTTP traffic of the tenant is recorded into or replayed from it, see `crawler.use_cassette`.
+    """
+    result = TenantResult(name)
+    with crawler.own_tally() as tally:
+        try:
+            run_tenant_days(name, tenant_config, result, session, refresh_directory, now, cassette)
+        except Exception as e:
+            logger.exception(f"[{name}] Failed: {e}")
+            result.error = str(e)
+    result.errors, result.warnings = tally.errors, tally.warnings
+    return result
+
+
+def run_tenant_days(name: str, tenant_config: dict, result: TenantResult, session: requests.Session, refresh_directory: bool,
+                    now: Optional[datetime], cassette: Optional[Cassette]):
+    """
+    The body of `run_tenant`, applies the shifts of every run of `crawler.NEXTDAY_RUNS` like `crawler.run` does.
+    """
+    testing = tenant_config["TESTING"]
+    schedule_base_url = tenant_config["test_base_url" if testing else "real_base_url"]
+    number_map = tenant_config["NUMBER_MAP"]
+    sipgate_headers = {'Authorization': 'Basic ' + tenant_config["sipgate"]["pass_base64"],
+                       'Accept': 'application/json', 'Content-Type': 'application/json'}
+    sipgate_options = crawler.get_sipgate_options(tenant_config["sipgate"], refresh_directory)
+    if cassette:
+        session = crawler.use_cassette(cassette, sipgate_options)
+    schedule_cache_config = tenant_config.get("schedule_cache")
+
+    # today and next day usually are in the same month, download and parse it only once
+    month_cache = crawl.MonthCache(schedule_base_url, tenant_config["schedule_login_payload"], testing=testing, session=session,
+                                   schedule_cache=schedule_cache_config and crawl.ScheduleCache(schedule_cache_config["path"]))
+    # every tenant has its own account, connection pool and request limit at Sipgate
+    sipgate_manager = None
+    for nextday in crawler.NEXTDAY_RUNS:
+        target_daytime_object = crawler.determine_target_date(nextday, now)
+        redirects = crawler.fetch_shift_schedule_entries(
+            schedule_base_url, tenant_config["schedule_login_payload"], crawler.is_first_shift_at(target_daytime_object),
+            target_daytime_object, month_cache, list(number_map), tenant_config.get("lines"))
+        logger.info(f"[{name}] Redirects{' of the next day' if nextday else ''}: {redirects}")
+        if not nextday:
+            result.redirects = redirects
+
+        sipgate_manager = sipgate_manager or SipgateManager(tenant_config["sipgate"]["base_url"], sipgate_headers,
+                                                            tenant_config["sipgate"]["dryrun"], **sipgate_options)
+        result.results += crawler.make_redirects(None, None, number_map, redirects, None, sipgate_manager=sipgate_manager)
+
+
+def run_tenants(config_data: dict, refresh_directory: bool = False, now: datetime = None,
+                cassette: Cassette = None) -> List[TenantResult]:
+    """
+    Runs every tenant of the config in one process, several at once (`tenant_workers`, 4 by default).
+
+    All tenants share the worker threads, the connections to the schedule servers, the html parser and the cache of
+    parsed notes. Credentials, lines, Sipgate connections and caches are per tenant, and so are failures.
+    All of them record into or replay from the same `cassette`, by default the one of the config.
+    """
+    tenant_configs = get_tenant_configs(config_data)
+    cassette = cassette or crawler.get_cassette(config_data)
+    crawl.set_parser_backend(config_data.get("html_parser", "auto"))
+    messageparser.set_interval_cache(crawler.get_interval_cache(config_data))
+
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=config_data.get("tenant_workers", 4),
+                                                           thread_name_prefix="tenant") as executor:
+        results = list(executor.map(
+            lambda tenant: run_tenant(tenant[0], tenant[1], session, refresh_directory, now, cassette), tenant_configs.items()))
+
+    messageparser.interval_cache.save()
+    for result in results:
+        if result.is_success:
+            logger.info(f"[{result.name}] Success")
+        else:
+            logger.warning(f"[{result.name}] Finished with {result.errors} error(s) and {result.warnings} warning(s): "
+                           f"{result.error or [str(r) for r in result.results if not r.is_success]}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Redirects the public phone numbers of every tenant according to its shift schedule")
+    parser.add_argument('--refresh-directory', action='store_true', help="ignore the cached Sipgate directories and fetch them again")
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument('--record', metavar='DIRECTORY', help="record all HTTP responses into a cassette directory")
+    cassette_group.add_argument('--replay', metavar='DIRECTORY', help="replay the HTTP responses of a cassette directory instead of going online")
+    args = parser.parse_args()
+
+    with open('config.json', 'r') as config_file:
+        config_data = json.load(config_file)
+
+    logging.basicConfig(level=logging.INFO)
+    cassette = args.record and Cassette(args.record, 'record') or args.replay and Cassette(args.replay, 'replay') or None
+    results = run_tenants(config_data, refresh_directory=args.refresh_directory, cassette=cassette)
+    exit(0 if all(result.is_success for result in results) else 1)
@@ -0,0 +1,97 @@
+import pytest, requests
+from datetime import datetime
+import crawl, crawler, sipgate_stub
+from cassette import Cassette
+from dummy_server import DummyScheduleServer
+from sipgate_api import ApiCaller, RedirectStatus
+
+HEADERS = {'Authorization': 'Basic dGVzdA==', 'Accept': 'application/json', 'Content-Type': 'application/json'}
+NUMBER_MAP = {"NFS1": "+4923100000", "NFS2": "+4923100001", "Leitung": "+4923100002"}
+
+
+def test_Cassette_GivenRecordedRun_ReplaysItWithoutServers(tmp_path):
+    with DummyScheduleServer() as server, sipgate_stub.create_team(user_count=5) as stub:
+        session = Cassette(str(tmp_path), 'record').mount(requests.Session())
+        recorded_html = crawl.get_html_of_month(server.base_url, 2019, 5, testing=True, session=session)
+        recorded_users = ApiCaller(stub.base_url, HEADERS, transport=Cassette(str(tmp_path), 'record').adapter).get_users()
+
+    cassette = Cassette(str(tmp_path), 'replay')
+    replayed_html = crawl.get_html_of_month(server.base_url, 2019, 5, testing=True, session=cassette.mount(requests.Session()))
+    replayed_users = ApiCaller(stub.base_url, HEADERS, transport=cassette.adapter).get_users()
+
+    assert replayed_html == recorded_html
+    assert [user.id for user in replayed_users] == [user.id for user in recorded_users]
+    assert cassette.replayed == 2
+
+
+def test_Cassette_GivenChangingResponses_ReplaysThemInOrderAndRepeatsTheLast(tmp_path):
+    with sipgate_stub.create_team(user_count=2) as stub:
+        api = ApiCaller(stub.base_url, HEADERS, transport=Cassette(str(tmp_path), 'record').adapter)
+        for endpoint in ['p1', 'p1', 'p0']:
+            api.forward_outbound_to_private_phone_number('0', endpoint)
+            api.get_public_phone_numbers()
+
+    cassette = Cassette(str(tmp_path), 'replay')
+    api = ApiCaller(stub.base_url, HEADERS, transport=cassette.adapter)
+
+    assert [api.get_public_phone_numbers()['+4923100000']['endpointId'] for _ in range(5)] == ['p1', 'p1', 'p0', 'p0', 'p0']
+    cassette.rewind()
+    assert api.get_public_phone_numbers()['+4923100000']['endpointId'] == 'p1'
+    assert len(list(tmp_path.iterdir())) == 3
+
+
+def test_Cassette_GivenUnrecordedRequest_FailsLikeUnreachableServer(tmp_path):
+    api = ApiCaller("http://127.0.0.1:1", HEADERS, backoff_factor=0, transport=Cassette(str(tmp_path), 'replay').adapter)
+
+    assert api.forward_outbound_to_private_phone_number('0', 'p1') is False
+    with pytest.raises(Exception):
+        api.get_users()
+
+
+def test_Cassette_record_GivenSessionCookieAndCredentials_DoesNotStoreThem(tmp_path):
+    request = requests.Request('POST', 'http://localhost:8081/login.php', data={'password': 'secret'}).prepare()
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response.headers = requests.structures.CaseInsensitiveDict({
+        'Content-Type': 'text/html', 'Set-Cookie': 'PHPSESSID=secret-session', 'WWW-Authenticate': 'Bearer realm="secret"',
+        'Authorization': 'Bearer secret-token'})
+    response._content = b'<html></html>'
+
+    Cassette(str(tmp_path), 'record').record(request, response)
+    replayed = Cassette(str(tmp_path), 'replay').replay(request)
+
+    assert dict(replayed.headers) == {'Content-Type': 'text/html'}
+    assert all('secret' not in path.read_text() for path in tmp_path.iterdir())
+
+
+def test_fetch_and_apply_redirects_GivenReplayedCassette_RedirectsAsRecorded(tmp_path):
+    def run(cassette: Cassette, schedule_base_url: str, sipgate_base_url: str):
+        crawler.errors, crawler.warnings = 0, 0
+        month_cache = crawl.MonthCache(schedule_base_url, testing=True, session=cassette.mount(requests.Session()))
+        crawler.fetch_and_apply_redirects(schedule_base_url, {}, NUMBER_MAP, sipgate_base_url, HEADERS, False,
+                                          sipgate_options={"transport": cassette.adapter}, month_cache=month_cache,
+                                          now=datetime(2019, 5, 5, 9, 30))
+
+    with DummyScheduleServer() as server, sipgate_stub.create_team(user_count=3) as stub:
+        stub.devices['w1'][0]['number'] = '+491727716898'
+        stub.devices['w2'][0]['number'] = '+4917683035545'
+        run(Cassette(str(tmp_path), 'record'), server.base_url, stub.base_url)
+        recorded_puts = [(method, path) for method, path, _ in stub.requests if method == 'PUT']
+    assert crawler.errors == 0 and recorded_puts
+
+    cassette = Cassette(str(tmp_path), 'replay')
+    run(cassette, server.base_url, stub.base_url)
+
+    assert crawler.errors == 0
+    assert cassette.replayed == len(stub.requests) + 1
+
+
+def test_use_cassette_GivenReplay_DropsJournalAndDirectorySnapshot(tmp_path):
+    sipgate_options = crawler.get_sipgate_options({"connection": {"timeout": 5},
+                                                   "journal": {"path": str(tmp_path / "journal.jsonl")},
+                                                   "directory_cache": {"path": str(tmp_path / "directory.json")}})
+
+    crawler.use_cassette(Cassette(str(tmp_path / "cassette"), 'replay'), sipgate_options)
+
+    assert set(sipgate_options) == {"timeout", "transport"}
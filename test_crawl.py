@@ -1,5 +1,8 @@
 import pytest
+import threading
+from datetime import datetime, date
 import crawl
+from dummy_server import DummyScheduleServer
 
 
 @pytest.mark.parametrize('expected_url, base_url, year, month', [
@@ -10,13 +13,253 @@ def test_build_url_for_month(expected_url, base_url, year, month):
     assert expected_url == crawl.build_url_for_month(base_url, year, month)
 
 
-def test_get_html_of_month():
-    html = crawl.get_html_of_month("http://localhost:8081/", 2019, 8, testing=True)
+@pytest.fixture(scope="module")
+def dummy_server():
+    with DummyScheduleServer() as server:
+        yield server
+
+
+def test_get_html_of_month(dummy_server):
+    html = crawl.get_html_of_month(dummy_server.base_url, 2019, 8, testing=True)
     assert len(html) >= 10000
 
 
-def test_get_html_of_month_different_months_are_different():
-    july = crawl.get_html_of_month("http://localhost:8081/", 2019, 7, testing=True)
-    august = crawl.get_html_of_month("http://localhost:8081/", 2019, 8, testing=True)
+def test_get_html_of_month_different_months_are_different(dummy_server):
+    july = crawl.get_html_of_month(dummy_server.base_url, 2019, 7, testing=True)
+    august = crawl.get_html_of_month(dummy_server.base_url, 2019, 8, testing=True)
     assert july != august
-    
\ No newline at end of file
+    
+
+def test_ScheduleCache_GivenUnmodifiedPage_SkipsParsing(tmp_path):
+    with DummyScheduleServer() as server:
+        first = crawl.ScheduleCache(str(tmp_path / "schedule.json"))
+        day_infos = first.get_day_infos(server.base_url, 2019, 5, testing=True)
+
+        # a restarted process only has the file
+        second = crawl.ScheduleCache(str(tmp_path / "schedule.json"))
+        cached_day_infos = second.get_day_infos(server.base_url, 2019, 5, testing=True)
+
+    assert (first.parse_count, second.parse_count, second.not_modified_count) == (1, 0, 1)
+    assert [code for _, _, code in server.responses] == [200, 304]
+    assert cached_day_infos == day_infos
+    assert len(day_infos) == 31
+
+
+def test_ScheduleCache_GivenSameContentWithoutValidators_SkipsParsing(tmp_path, monkeypatch):
+    with open("dummy_dienstplan/2019-05/index.htm", "rb") as html_file:
+        html = html_file.read()
+    monkeypatch.setattr(crawl, "fetch_month", lambda *args, **kwargs: crawl.MonthPage(html, None, None))
+    schedule_cache = crawl.ScheduleCache(str(tmp_path / "schedule.json"))
+
+    day_infos = schedule_cache.get_day_infos("http://localhost:8081/", 2019, 5)
+    cached_day_infos = schedule_cache.get_day_infos("http://localhost:8081/", 2019, 5)
+
+    assert (schedule_cache.parse_count, schedule_cache.unchanged_count) == (1, 1)
+    assert cached_day_infos == day_infos
+
+
+def edit_night_shift_of_day_14(html: bytes) -> bytes:
+    """
+    The dummy May with the phone number of the Leitung night shift on the 14th changed.
+    """
+    row = crawl.find_day_row_html(html.decode('utf-8'), 14)
+    edited_row = row[::-1].replace("01606391781"[::-1], "01600000000"[::-1], 1)[::-1]
+    return html.decode('utf-8').replace(row, edited_row).encode('utf-8')
+
+
+def test_ScheduleCache_GivenNotModifiedWithoutEntry_FetchesPageAgain(tmp_path, monkeypatch):
+    with open("dummy_dienstplan/2019-05/index.htm", "rb") as html_file:
+        html = html_file.read()
+    pages = [crawl.MonthPage(None, None, None), crawl.MonthPage(html, None, None)]
+    monkeypatch.setattr(crawl, "fetch_month", lambda *args, **kwargs: pages.pop(0))
+    schedule_cache = crawl.ScheduleCache(str(tmp_path / "schedule_cache.json"))
+
+    assert len(schedule_cache.get_day_infos("http://localhost:8081/", 2019, 5)) == 31
+    assert (schedule_cache.parse_count, schedule_cache.not_modified_count) == (1, 0)
+
+
+def test_ScheduleCache_GivenEditedRow_ParsesOnlyThatRowAndReportsChange(tmp_path, monkeypatch):
+    with open("dummy_dienstplan/2019-05/index.htm", "rb") as html_file:
+        html = html_file.read()
+    pages = [html, edit_night_shift_of_day_14(html)]
+    monkeypatch.setattr(crawl, "fetch_month", lambda *args, **kwargs: crawl.MonthPage(pages.pop(0), None, None))
+    schedule_cache = crawl.ScheduleCache(str(tmp_path / "schedule.json"))
+    schedule_cache.get_day_infos("http://localhost:8081/", 2019, 5)
+    assert (schedule_cache.row_parse_count, schedule_cache.changes[(2019, 5)]) == (31, [])
+
+    schedule_cache = crawl.ScheduleCache(str(tmp_path / "schedule.json"))
+    day_infos = schedule_cache.get_day_infos("http://localhost:8081/", 2019, 5)
+
+    assert schedule_cache.row_parse_count == 1
+    assert schedule_cache.changes[(2019, 5)] == [crawl.ShiftChange(2019, 5, 14, 2, 1, "phone_number", "01606391781", "01600000000")]
+    assert str(schedule_cache.changes[(2019, 5)][0]) == "day 14, group 2, shift 1: phone_number changed"
+    assert day_infos == list(map(crawl.get_day_info, crawl.get_day_rows(crawl.get_month_view(edit_night_shift_of_day_14(html)))))
+
+
+@pytest.mark.parametrize('month', [5, 7, 8])
+def test_find_day_rows_html_GivenDummyMonth_EqualsSingleRows(month):
+    with open(f"dummy_dienstplan/2019-{month:02}/index.htm", "rb") as html_file:
+        html = html_file.read().decode('utf-8')
+
+    rows = crawl.find_day_rows_html(html)
+
+    assert rows == [crawl.find_day_row_html(html, day) for day in range(1, len(rows) + 1)]
+    assert len(rows) == len(crawl.get_day_rows(crawl.get_month_view(html)))
+
+
+@pytest.mark.parametrize('month', [5, 7, 8])
+def test_extract_day_info_GivenDummyMonth_EqualsFullParse(month):
+    with open(f"dummy_dienstplan/2019-{month:02}/index.htm", "rb") as html_file:
+        html = html_file.read()
+    day_rows = crawl.get_day_rows(crawl.get_month_view(html))
+
+    for day, day_row in enumerate(day_rows, start=1):
+        assert crawl.get_day_info(day_row) == crawl.extract_day_info(html, day)
+
+
+def test_extract_day_info_GivenDayOutsideOfMonth_Raises():
+    with open("dummy_dienstplan/2019-05/index.htm", "rb") as html_file:
+        html = html_file.read()
+
+    with pytest.raises(Exception):
+        crawl.extract_day_info(html, 32)
+
+
+def test_find_month_view_GivenErrorPage_RaisesWithStartOfPage():
+    with pytest.raises(Exception) as error:
+        crawl.find_month_view(crawl.parse_html("<html><body>Login expired</body></html>"))
+
+    assert "month-view" in str(error.value)
+    assert "Login expired" in error.value.args[1]
+
+
+@pytest.mark.parametrize('backend', crawl.get_available_parser_backends())
+@pytest.mark.parametrize('month', [5, 7, 8])
+def test_parser_backends_GivenDummyMonth_ProduceIdenticalDayInfos(backend, month):
+    with open(f"dummy_dienstplan/2019-{month:02}/index.htm", "rb") as html_file:
+        html = html_file.read()
+    expected = list(map(crawl.get_day_info, crawl.get_day_rows(crawl.get_month_view(html, 'html.parser'))))
+
+    actual = list(map(crawl.get_day_info, crawl.get_day_rows(crawl.get_month_view(html, backend))))
+    actual_fast_path = [crawl.extract_day_info(html, day, backend) for day in range(1, len(expected) + 1)]
+
+    assert expected == actual
+    assert expected == actual_fast_path
+
+
+def test_set_parser_backend_GivenAuto_SelectsFastestInstalled(monkeypatch):
+    monkeypatch.setattr(crawl, "parser_backend", "html.parser")
+
+    crawl.set_parser_backend("auto")
+
+    assert crawl.parser_backend == crawl.get_available_parser_backends()[0]
+
+
+def test_set_parser_backend_GivenUnknownBackend_Raises():
+    with pytest.raises(Exception):
+        crawl.set_parser_backend("selectolax")
+
+
+SHIFT_STARTS = ["08:00", "20:00"]
+SHIFT_ENDS = ["20:00", "08:00"]
+
+
+def test_build_month_timeline_GivenDummyMonth_LooksUpNumberOnCall(dummy_schedule):
+    month_cache = crawl.MonthCache("http://localhost:8081/", None, testing=True)
+
+    timeline = crawl.build_month_timeline(month_cache.get_day_infos, 2019, 5, SHIFT_STARTS, SHIFT_ENDS, "+49111")
+
+    assert timeline.lookup_all(datetime(2019, 5, 5, 9, 30)) == ['+441111111', '+49111', '01727716898']
+    assert timeline.lookup(0, datetime(2019, 5, 1, 7, 59)) is None # April is not available
+    assert next(timeline.change_points(datetime(2019, 5, 5, 9, 30))) == datetime(2019, 5, 5, 10, 0)
+
+
+def test_build_month_timeline_GivenPreviousMonth_CoversFirstMorning(dummy_schedule):
+    month_cache = crawl.MonthCache("http://localhost:8081/", None, testing=True)
+
+    timeline = crawl.build_month_timeline(month_cache.get_day_infos, 2019, 8, SHIFT_STARTS, SHIFT_ENDS, "+49111")
+    july = crawl.build_month_timeline(month_cache.get_day_infos, 2019, 7, SHIFT_STARTS, SHIFT_ENDS, "+49111")
+
+    assert timeline.lookup_all(datetime(2019, 8, 1, 7, 0)) == july.lookup_all(datetime(2019, 8, 1, 7, 0))
+    assert timeline.lookup(1, datetime(2019, 8, 1, 7, 0)) == "+49111"
+
+
+def test_RoutingTimeline_GivenAdjacentSegments_MergesSameNumberAndListsChanges():
+    timeline = crawl.RoutingTimeline([
+        [(datetime(2019, 5, 5, 10), datetime(2019, 5, 5, 20), "B"), (datetime(2019, 5, 5, 8), datetime(2019, 5, 5, 10), "A"),
+         (datetime(2019, 5, 5, 20), datetime(2019, 5, 6, 8), "B")],
+        [(datetime(2019, 5, 5, 8), datetime(2019, 5, 5, 12), "C")],
+    ])
+
+    assert timeline.lines[0] == [(datetime(2019, 5, 5, 8), datetime(2019, 5, 5, 10), "A"), (datetime(2019, 5, 5, 10), datetime(2019, 5, 6, 8), "B")]
+    assert [timeline.lookup(0, datetime(2019, 5, 5, hour)) for hour in (7, 8, 9, 10, 23)] == [None, "A", "A", "B", "B"]
+    assert timeline.lookup(1, datetime(2019, 5, 5, 12)) is None
+    assert list(timeline.change_points(datetime(2019, 5, 5, 9))) == [datetime(2019, 5, 5, 10), datetime(2019, 5, 5, 12), datetime(2019, 5, 6, 8)]
+
+
+def test_RoutingTimeline_replace_days_GivenEditedDay_EqualsRecompiledTimeline(dummy_schedule):
+    month_cache = crawl.MonthCache("http://localhost:8081/", None, testing=True)
+    day_infos = month_cache.get_day_infos(2019, 5)
+    days = [(date(2019, 5, day), day_infos[day - 1]) for day in range(12, 17)]
+    timeline = crawl.RoutingTimeline.from_days(days, SHIFT_STARTS, SHIFT_ENDS, "+49111")
+    with open("dummy_dienstplan/2019-05/index.htm", "rb") as html_file:
+        edited_day = crawl.extract_day_info(edit_night_shift_of_day_14(html_file.read()), 14)
+
+    timeline.replace_days([(date(2019, 5, 14), edited_day)], SHIFT_STARTS, SHIFT_ENDS, "+49111")
+
+    days[2] = (date(2019, 5, 14), edited_day)
+    assert timeline.lines == crawl.RoutingTimeline.from_days(days, SHIFT_STARTS, SHIFT_ENDS, "+49111").lines
+    assert timeline.lookup(2, datetime(2019, 5, 14, 23, 0)) == "01600000000"
+    assert next(timeline.change_points(datetime(2019, 5, 14, 12, 0))) == datetime(2019, 5, 14, 20, 0)
+
+
+@pytest.mark.parametrize('expected, year, month, offset', [
+    ((2019, 4), 2019, 5, -1),
+    ((2018, 12), 2019, 1, -1),
+    ((2020, 1), 2019, 12, 1),
+    ((2019, 5), 2019, 5, 0)])
+def test_get_adjacent_month(expected, year, month, offset):
+    assert expected == crawl.get_adjacent_month(year, month, offset)
+
+
+def test_MonthCache_warm_GivenLastDaysOfMonth_PrefetchesNextMonth(dummy_schedule, monkeypatch):
+    month_cache = crawl.MonthCache("http://localhost:8081/", testing=True)
+
+    month_cache.warm(datetime(2019, 7, 29, 20, 0))
+    month_cache.prefetch(2019, 8).result()
+    monkeypatch.setattr(crawl, "get_html_of_month", None)
+
+    assert len(month_cache.get_day_infos(2019, 8)) == 31
+    assert month_cache.fetch_count == 1
+
+
+def test_MonthCache_warm_GivenFirstOfMonth_PrefetchesPreviousMonthAndEvictsOthers(dummy_schedule):
+    month_cache = crawl.MonthCache("http://localhost:8081/", testing=True)
+    month_cache.get_day_infos(2019, 5)
+
+    month_cache.warm(datetime(2019, 8, 1, 0, 0))
+    month_cache.prefetch(2019, 7).result()
+
+    assert month_cache.get_loaded_at(2019, 5) is None
+    assert month_cache.get_loaded_at(2019, 7) is not None
+    assert month_cache.get_loaded_at(2019, 8) is None
+
+
+def test_MonthCache_prefetch_GivenSlowDownloadOfNextMonth_DoesNotBlockCurrentMonth(dummy_schedule, monkeypatch):
+    get_html_of_month = crawl.get_html_of_month
+    release = threading.Event()
+
+    def slow_get_html_of_month(base_url, year, month, **kwargs):
+        if month == 8:
+            release.wait(5)
+        return get_html_of_month(base_url, year, month, **kwargs)
+
+    monkeypatch.setattr(crawl, "get_html_of_month", slow_get_html_of_month)
+    month_cache = crawl.MonthCache("http://localhost:8081/", testing=True)
+
+    prefetch = month_cache.prefetch(2019, 8)
+    assert len(month_cache.get_day_infos(2019, 7)) == 31
+    assert not prefetch.done()
+
+    release.set()
+    assert len(prefetch.result()) == 31
@@ -35,3 +35,129 @@ def test_format_phone_number_alternative_GivenPhoneNumberString_WhenParsingAndFo
         return phonenumbers.format_number(matches[0].number, phonenumbers.PhoneNumberFormat.E164)
 
     assert expected_phone_number == parse_and_format(given_phone_number)
+
+
+def test_make_redirects_GivenPartlyCorrectRouting_OnlyReroutesChangedLines():
+    import sipgate_stub
+    headers = {'Authorization': 'Basic dGVzdA==', 'Accept': 'application/json', 'Content-Type': 'application/json'}
+    number_map = {'NFS1': '+4923100000', 'NFS2': '+4923100001', 'Leitung': '+4923100002'}
+    redirects = {'NFS1': '+491700000000', 'NFS2': '+491700000001', 'Leitung': '+491700000000'}
+
+    with sipgate_stub.create_team(user_count=3) as stub:
+        results = crawler.make_redirects(stub.base_url, headers, number_map, redirects, dryrun=False)
+
+        assert [result.plan.is_unchanged for result in results] == [True, False, True]
+        assert [(method, path) for method, path, _ in stub.requests if method == 'PUT'] == [('PUT', '/numbers/1')]
+
+
+def test_fetch_shift_schedule_entries_GivenSharedMonthCache_FetchesMonthOnceAndOnlyParsesTheDays(dummy_schedule):
+    from datetime import datetime
+    from crawl import MonthCache
+    month_cache = MonthCache("http://localhost:8081/", testing=True)
+
+    today = crawler.fetch_shift_schedule_entries(None, None, True, datetime(2019, 5, 2, 9), month_cache)
+    next_day = crawler.fetch_shift_schedule_entries(None, None, True, datetime(2019, 5, 3, 9), month_cache)
+
+    assert today['NFS1'] == '+491735496595'
+    assert today != next_day
+    assert (month_cache.fetch_count, month_cache.parse_count, month_cache.fragment_parse_count) == (1, 0, 2)
+
+    crawler.fetch_shift_schedule_entries(None, None, False, datetime(2019, 7, 1, 21), month_cache)
+
+    assert (month_cache.fetch_count, month_cache.parse_count, month_cache.fragment_parse_count) == (2, 0, 3)
+
+
+def test_fetch_shift_schedule_entries_GivenReorderedNumberMap_MapsLinesByName(dummy_schedule):
+    from datetime import datetime
+    from crawl import MonthCache
+    month_cache = MonthCache("http://localhost:8081/", testing=True)
+
+    redirects = crawler.fetch_shift_schedule_entries(None, None, True, datetime(2019, 5, 2, 9), month_cache)
+    reordered = crawler.fetch_shift_schedule_entries(None, None, True, datetime(2019, 5, 2, 9), month_cache, ["Leitung", "NFS1"])
+
+    assert reordered == {"Leitung": redirects["Leitung"], "NFS1": redirects["NFS1"]}
+    assert redirects["Leitung"] != redirects["NFS1"]
+
+
+@pytest.mark.parametrize('year, month', [(2019, 5), (2019, 7), (2019, 8)])
+def test_fetch_shift_schedule_entries_GivenScheduleCache_EqualsDayRowLookup(dummy_schedule, year, month):
+    from datetime import datetime
+    from crawl import MonthCache, ScheduleCache
+    month_cache = MonthCache("http://localhost:8081/", testing=True)
+    cached_month_cache = MonthCache("http://localhost:8081/", testing=True, schedule_cache=ScheduleCache(None))
+
+    for day in range(1, 29):
+        for is_first_shift in (True, False):
+            target = datetime(year, month, day, 9 if is_first_shift else 21)
+            assert crawler.fetch_shift_schedule_entries(None, None, is_first_shift, target, cached_month_cache) \
+                == crawler.fetch_shift_schedule_entries(None, None, is_first_shift, target, month_cache)
+
+
+def test_fetch_shift_schedule_entries_GivenPersistedScheduleCache_SecondRunNeitherDownloadsNorParses(tmp_path):
+    from datetime import datetime
+    from crawl import MonthCache, ScheduleCache
+    from dummy_server import DummyScheduleServer
+    path = str(tmp_path / "schedule_cache.json")
+
+    def run():
+        schedule_cache = ScheduleCache(path)
+        month_cache = MonthCache(server.base_url, testing=True, schedule_cache=schedule_cache)
+        return crawler.fetch_shift_schedule_entries(server.base_url, None, True, datetime(2019, 5, 2, 9), month_cache), schedule_cache
+
+    with DummyScheduleServer() as server:
+        first_redirects, first_cache = run()
+        second_redirects, second_cache = run()
+
+    assert second_redirects == first_redirects
+    assert first_cache.parse_count == 1
+    assert (second_cache.parse_count, second_cache.not_modified_count + second_cache.unchanged_count) == (0, 1)
+    assert [status for _, _, status in server.responses] == [200, 304]
+
+
+def test_get_line_columns_GivenUnknownKey_RequiresExplicitLines():
+    with pytest.raises(Exception):
+        crawler.get_line_columns(["NFS1", "Reserve"])
+
+    assert crawler.get_line_columns(["Reserve", "NFS1"], ["NFS1", "NFS2", "Leitung", "Reserve"]) == {"Reserve": 3, "NFS1": 0}
+
+
+def test_determine_target_date_GivenFirstOfMonthBeforeEight_UsesNightShiftOfPreviousMonth(dummy_schedule):
+    from datetime import datetime
+    from crawl import MonthCache
+    month_cache = MonthCache("http://localhost:8081/", testing=True)
+
+    target = crawler.determine_target_date(now=datetime(2019, 8, 1, 7, 30))
+    redirects = crawler.fetch_shift_schedule_entries(None, None, 8 <= target.hour < 20, target, month_cache)
+
+    assert (target.month, target.day) == (7, 31)
+    assert redirects == crawler.fetch_shift_schedule_entries(None, None, False, datetime(2019, 7, 31, 21), month_cache)
+
+
+def test_fetch_and_apply_redirects_concurrently_GivenSlowServers_OverlapsRequests():
+    import sipgate_stub
+    from datetime import datetime
+    from crawl import MonthCache
+    from dummy_server import DummyScheduleServer
+    headers = {'Authorization': 'Basic dGVzdA==', 'Accept': 'application/json', 'Content-Type': 'application/json'}
+    number_map = {'NFS1': '+4923100000', 'NFS2': '+4923100001', 'Leitung': '+4923100002'}
+    now = datetime(2019, 5, 2, 9, 0) # NFS1 +491735496595, Leitung +491711734480
+
+    def count_overlaps(fetch_and_apply_redirects):
+        with DummyScheduleServer(delay=0.1) as schedule_server, sipgate_stub.create_team(user_count=2, delay=0.1) as stub:
+            stub.devices['w0'][0]['number'] = '+491735496595'
+            stub.devices['w1'][0]['number'] = '+491711734480'
+            for number in stub.numbers:
+                number['endpointId'] = 'p9'
+            month_cache = MonthCache(schedule_server.base_url, testing=True)
+            assert fetch_and_apply_redirects(schedule_server.base_url, None, number_map, stub.base_url, headers, False,
+                                             month_cache=month_cache, now=now) is False # NFS2 is empty
+            assert [number['endpointId'] for number in stub.numbers] == ['p0', 'p9', 'p1']
+            return sum(schedule_start < sipgate_end and sipgate_start < schedule_end
+                       for _, schedule_start, schedule_end in schedule_server.intervals
+                       for _, sipgate_start, sipgate_end in stub.intervals)
+
+    crawler.errors, crawler.warnings = 0, 0
+    assert count_overlaps(crawler.fetch_and_apply_redirects) == 0
+    crawler.errors, crawler.warnings = 0, 0
+    # the schedule is crawled while users, devices and numbers are loaded
+    assert count_overlaps(crawler.fetch_and_apply_redirects_concurrently) > 0
@@ -0,0 +1,99 @@
+import pytest
+from datetime import datetime, date, timedelta
+import crawl
+import daemon, sipgate_stub
+
+CONFIG = {
+    "TESTING": True,
+    "test_base_url": "http://localhost:8081/",
+    "schedule_login_payload": {},
+    "fallback_phone_number": "+49111",
+    "NUMBER_MAP": {"Leitung": "+49003", "NFS1": "+49001", "NFS2": "+49002"},
+    "sipgate": {"base_url": "http://localhost", "pass_base64": "", "dryrun": True},
+    "daemon": {"poll_interval": 3600},
+}
+
+
+@pytest.mark.parametrize('expected, shift_date, shift_start, time_string, is_end', [
+    (datetime(2019, 5, 5, 10, 0), date(2019, 5, 5), "08:00", "10:00", False),
+    (datetime(2019, 5, 5, 20, 0), date(2019, 5, 5), "08:00", "20:00", True),
+    (datetime(2019, 5, 5, 22, 0), date(2019, 5, 5), "20:00", "22:00", False),
+    (datetime(2019, 5, 6, 7, 0), date(2019, 5, 5), "20:00", "07:00", False),
+    (datetime(2019, 5, 6, 8, 0), date(2019, 5, 5), "20:00", "08:00", True),
+    (datetime(2019, 6, 1, 8, 0), date(2019, 5, 31), "20:00", "08:00", True)])
+def test_time_on_shift(expected, shift_date, shift_start, time_string, is_end):
+    assert expected == daemon.time_on_shift(shift_date, shift_start, time_string, is_end)
+
+
+def test_tick_GivenSubstitutions_WakesUpAtNextSubstitution(dummy_schedule):
+    now = datetime(2019, 5, 5, 9, 30)
+    schedule_daemon = daemon.ScheduleDaemon(CONFIG, clock=lambda: now)
+
+    timeline = schedule_daemon.get_timeline(now)
+
+    assert schedule_daemon.get_redirects(now, timeline)["NFS1"] == "+441111111"
+    assert schedule_daemon.get_next_wakeup(now, timeline) == datetime(2019, 5, 5, 10, 0)
+
+
+def test_get_redirects_GivenEarlyMorning_UsesNightShiftOfPreviousDay(dummy_schedule):
+    now = datetime(2019, 5, 6, 7, 59, 59)
+    schedule_daemon = daemon.ScheduleDaemon(CONFIG, clock=lambda: now)
+
+    timeline = schedule_daemon.get_timeline(now)
+
+    assert schedule_daemon.get_redirects(now, timeline)["NFS1"] == "+491711546904"
+    assert schedule_daemon.get_next_wakeup(now, timeline) == datetime(2019, 5, 6, 8, 0)
+
+
+def test_get_day_infos_GivenWarmCache_DoesNotCrawlAgain(dummy_schedule, monkeypatch):
+    now = datetime(2019, 5, 5, 9, 30)
+    schedule_daemon = daemon.ScheduleDaemon(CONFIG, clock=lambda: now)
+    schedule_daemon.get_day_infos(2019, 5)
+
+    monkeypatch.setattr(crawl, "get_html_of_month", None)
+    monkeypatch.setattr(crawl, "fetch_month", None)
+
+    assert len(schedule_daemon.get_day_infos(2019, 5)) == 31
+
+
+def test_get_timeline_GivenScheduleEditedBetweenCrawls_PatchesTimeline(dummy_schedule, monkeypatch):
+    now = [datetime(2019, 5, 14, 21, 0)]
+    schedule_daemon = daemon.ScheduleDaemon(CONFIG, clock=lambda: now[0])
+    assert schedule_daemon.get_redirects(now[0], schedule_daemon.get_timeline(now[0]))["Leitung"] == "+491606391781"
+
+    with open("dummy_dienstplan/2019-05/index.htm", "rb") as html_file:
+        html = html_file.read()
+    row = crawl.find_day_row_html(html.decode('utf-8'), 14)
+    edited_html = html.decode('utf-8').replace(row, row.replace("01606391781", "01600000000")).encode('utf-8')
+    monkeypatch.setattr(crawl, "fetch_month", lambda *args, **kwargs: crawl.MonthPage(edited_html, None, None))
+    now[0] += timedelta(hours=1)
+
+    timeline = schedule_daemon.get_timeline(now[0])
+
+    assert schedule_daemon.get_redirects(now[0], timeline)["Leitung"] == "+491600000000"
+    assert schedule_daemon.schedule_cache.row_parse_count == 31 + 1
+
+
+def test_tick_GivenLastDaysOfMonth_PrefetchesNextMonth(dummy_schedule):
+    now = datetime(2019, 7, 29, 12, 0)
+    with sipgate_stub.create_team(user_count=3) as stub:
+        schedule_daemon = daemon.ScheduleDaemon(dict(CONFIG, sipgate=dict(CONFIG["sipgate"], base_url=stub.base_url)), clock=lambda: now)
+
+        schedule_daemon.tick()
+        schedule_daemon.month_cache.prefetch(2019, 8).result()
+
+    assert [schedule_daemon.month_cache.get_loaded_at(2019, month) for month in (6, 7, 8)] == [None, now, now]
+
+
+def test_tick_GivenSipgateUnreachable_SurvivesAndRetriesNextPoll(dummy_schedule):
+    now = datetime(2019, 5, 5, 9, 30)
+    sipgate_config = dict(CONFIG["sipgate"], base_url="http://127.0.0.1:9", connection={"max_retries": 0, "backoff_factor": 0})
+    schedule_daemon = daemon.ScheduleDaemon(dict(CONFIG, sipgate=sipgate_config), clock=lambda: now)
+
+    assert schedule_daemon.tick() == now + timedelta(seconds=3600)
+
+    with sipgate_stub.create_team(user_count=3) as stub:
+        schedule_daemon.sipgate_base_url = stub.base_url
+        schedule_daemon.tick()
+
+        assert ('GET', '/app/users?offset=0&limit=100', b'') in stub.requests
@@ -0,0 +1,22 @@
+import pytest
+import e164
+from test_crawler import testdata
+
+
+@pytest.mark.parametrize("given_phone_number, expected_phone_number", testdata + [
+    ('0049 172 9394781', '+491729394781'),
+    ('491729394781', '+491729394781'),
+    ('(0231) 12345', '+4923112345'),
+    ('', ''),
+])
+def test_normalize_GivenPhoneNumberString_ReturnsE164(given_phone_number, expected_phone_number):
+    assert e164.normalize(given_phone_number) == expected_phone_number
+    assert e164.normalize_uncached(given_phone_number) == expected_phone_number
+
+
+def test_normalize_GivenOtherCountryCode_PrefixesIt():
+    assert e164.normalize('0 7746 493918', '+44') == '+447746493918'
+
+
+def test_normalize_GivenEqualNumbersInDifferentFormats_ReturnsSameObject():
+    assert e164.normalize('0172 9394781') is e164.normalize(''.join(['+49', '172', '9394781']))
@@ -1,5 +1,10 @@
-import pytest
+import pytest, re
 import messageparser
+from substitution_notes import generate_substitution_notes
+
+# the patterns `messageparser.regex_timeslot` combines, as the reference implementation used them
+regex_from_to = re.compile(f" (?P<from>{messageparser.regex_valid_time}) (?:uhr)? - (?P<to>{messageparser.regex_valid_time}) (?:uhr)?".replace(' ', r'\s*'))
+regex_from_or_to = re.compile(f" (?P<fromOrTo>(?:bis)|(?:ab)) (?P<time>{messageparser.regex_valid_time})".replace(' ', r'\s*'))
 
 
 def test_TimeRule_sort_GivenSameTime_SortsByFromOrTill_And_PersistsRelativeOrder():
@@ -84,3 +89,178 @@ def test_time_rules_to_interval_list():
     actual_intervals = messageparser.time_rules_to_interval_list(rules, default_number, shift_end)
     
     assert expected_intervals == actual_intervals
+
+
+def reference_parse_rules_from_message(shift_start: str, shift_end: str, default_number: str, message: str):
+    """
+    The parsing logic of the original implementation of `messageparser.parse_rules_from_message`, which the
+    precompiled one has to match. Rules are ordered relative to the shift start like `TimeRule` does now.
+    """
+    import re
+    from messageparser import TimeRule, FromOrTill
+    rules = []
+    if message:
+        message = message.lower()
+        pair_id = 1
+        for substitute in message.split(';'):
+            numbers = re.findall(r"(?:\s)\+?\d{5,}", substitute)
+            if len(numbers) != 1:
+                continue
+            number = numbers[0].strip()
+            for timeslot in re.split(r"(?:und)|,", substitute):
+                matches = regex_from_to.match(timeslot)
+                if matches:
+                    time_from, time_till = matches.group('from'), matches.group('to')
+                    rules.append(TimeRule(time=time_from, from_or_till=FromOrTill.FROM, phone_number=number, pair_id=pair_id, shift_start=shift_start))
+                    rules.append(TimeRule(time=time_till, from_or_till=FromOrTill.TILL, phone_number=number, pair_id=pair_id, shift_start=shift_start))
+                    pair_id += 1
+                    continue
+                matches = regex_from_or_to.match(timeslot)
+                if matches:
+                    prefix, time = matches.group('fromOrTo'), matches.group('time')
+                    if prefix == 'bis':
+                        rules.append(TimeRule(time=shift_start, from_or_till=FromOrTill.FROM, phone_number=number, shift_start=shift_start))
+                        rules.append(TimeRule(time=time, from_or_till=FromOrTill.TILL, phone_number=number, shift_start=shift_start))
+                    elif prefix == 'ab':
+                        rules.append(TimeRule(time=time, from_or_till=FromOrTill.FROM, phone_number=number, shift_start=shift_start))
+                        rules.append(TimeRule(time=shift_end, from_or_till=FromOrTill.TILL, phone_number=number, shift_start=shift_start))
+    if not any(rule.minutes == 0 for rule in rules):
+        rules.append(TimeRule(time=shift_start, from_or_till=FromOrTill.FROM, phone_number=default_number, shift_start=shift_start))
+    return TimeRule.sort(rules)
+
+
+@pytest.mark.parametrize('shift_start, shift_end', [("08:00", "20:00"), ("20:00", "08:00")])
+def test_parse_rules_from_message_GivenFuzzCorpus_MatchesReferenceImplementation(shift_start, shift_end):
+    default_number = "+49767676"
+
+    for message in generate_substitution_notes(2000) + [None, "", ";", "und", "bis 12:00 Uhr +491231"]:
+        expected = reference_parse_rules_from_message(shift_start, shift_end, default_number, message)
+        actual = messageparser.parse_rules_from_message(shift_start, shift_end, default_number, message)
+        assert list(map(repr, expected)) == list(map(repr, actual)), message
+
+
+def test_get_interval_list_from_message_GivenNightShift_HandlesMidnight():
+    intervals = messageparser.get_interval_list_from_message("20:00", "08:00", "+49000", "bis 22:00 Uhr +491111; 06:00 - 07:00 +492222")
+
+    assert intervals == [
+        ['20:00', '22:00', '+491111'],
+        ['22:00', '06:00', '+49000'],
+        ['06:00', '07:00', '+492222'],
+        ['07:00', '08:00', '+49000'],
+    ]
+
+
+def test_TimeRule_sort_GivenShiftStart_SortsRelativeToShiftStart():
+    rules = [
+        messageparser.TimeRule(time="07:00", from_or_till=messageparser.FromOrTill.FROM, phone_number="0", shift_start="20:00"),
+        messageparser.TimeRule(time="23:00", from_or_till=messageparser.FromOrTill.FROM, phone_number="1", shift_start="20:00"),
+        messageparser.TimeRule(time="0:30", from_or_till=messageparser.FromOrTill.FROM, phone_number="2", shift_start="20:00"),
+    ]
+
+    assert [rules[1], rules[2], rules[0]] == messageparser.TimeRule.sort(rules)
+    assert [rule.minutes for rule in rules] == [660, 180, 270]
+
+
+def reference_time_rules_to_interval_list(rules, default_number: str, shift_end: str):
+    """
+    The original stack based implementation of `messageparser.time_rules_to_interval_list`.
+    """
+    intervals = []
+    stack = [messageparser.TimeRule("00:00", messageparser.FromOrTill.FROM, default_number, None)]
+    for rule in rules:
+        if rule.from_or_till == messageparser.FromOrTill.FROM:
+            stack.insert(0, rule)
+        elif rule in stack:
+            stack.remove(rule)
+        intervals.append([rule.time, stack[0].phone_number])
+    for i in range(len(intervals) - 1):
+        intervals[i].insert(1, intervals[i + 1][0])
+    intervals[-1].insert(1, shift_end)
+    to_minutes = messageparser.time_to_minutes
+    return [interval for interval in intervals if to_minutes(interval[0]) != to_minutes(interval[1])]
+
+
+@pytest.mark.parametrize('shift_start, shift_end', [("08:00", "20:00"), ("20:00", "08:00")])
+def test_time_rules_to_interval_list_GivenFuzzCorpus_MatchesStackImplementation(shift_start, shift_end):
+    default_number = "+49767676"
+
+    for message in generate_substitution_notes(2000):
+        rules = messageparser.parse_rules_from_message(shift_start, shift_end, default_number, message)
+        try:
+            expected = reference_time_rules_to_interval_list(rules, default_number, shift_end)
+        except IndexError:
+            continue # the stack implementation crashes when the default number is ended
+        assert expected == messageparser.time_rules_to_interval_list(rules, default_number, shift_end), message
+
+
+def test_IntervalCache_GivenRecurringNote_ParsesItOnce():
+    cache = messageparser.IntervalCache()
+    message = "bis 10:00 Uhr +491234; ab 17:00 Uhr +494321"
+
+    first = cache.get_interval_list_from_message("08:00", "20:00", "+49767676", message)
+    second = cache.get_interval_list_from_message("08:00", "20:00", "+49767676", message)
+    other_default = cache.get_interval_list_from_message("08:00", "20:00", "+49000", message)
+
+    assert first is second
+    assert [list(interval) for interval in first] == messageparser.get_interval_list_from_message("08:00", "20:00", "+49767676", message)
+    assert other_default[1] == ("10:00", "17:00", "+49000")
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_IntervalCache_GivenMoreNotesThanMaxsize_EvictsLeastRecentlyUsed():
+    cache = messageparser.IntervalCache(maxsize=2)
+    cache.get_interval_list_from_message("08:00", "20:00", "+49000", "ab 10:00 +491111")
+    cache.get_interval_list_from_message("08:00", "20:00", "+49000", "ab 11:00 +491111")
+    cache.get_interval_list_from_message("08:00", "20:00", "+49000", "ab 10:00 +491111")
+    cache.get_interval_list_from_message("08:00", "20:00", "+49000", "ab 12:00 +491111")
+
+    cache.get_interval_list_from_message("08:00", "20:00", "+49000", "ab 10:00 +491111")
+    cache.get_interval_list_from_message("08:00", "20:00", "+49000", "ab 11:00 +491111")
+
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_IntervalCache_GivenPath_IsLoadedByNextProcess(tmp_path):
+    path = str(tmp_path / "intervals.json")
+    cache = messageparser.IntervalCache(path=path)
+    intervals = cache.get_interval_list_from_message("20:00", "08:00", "+49000", "bis 22:00 +491111")
+    cache.save()
+
+    restarted = messageparser.IntervalCache(path=path)
+
+    assert restarted.get_interval_list_from_message("20:00", "08:00", "+49000", "bis 22:00 +491111") == intervals
+    assert (restarted.hits, restarted.misses) == (1, 0)
+
+
+def test_IntervalCache_GivenCacheOfOtherParserVersion_IgnoresIt(tmp_path, monkeypatch):
+    path = str(tmp_path / "intervals.json")
+    cache = messageparser.IntervalCache(path=path)
+    cache.get_interval_list_from_message("20:00", "08:00", "+49000", "bis 22:00 +491111")
+    cache.save()
+
+    monkeypatch.setattr(messageparser.IntervalCache, "VERSION", messageparser.IntervalCache.VERSION + 1)
+    restarted = messageparser.IntervalCache(path=path)
+
+    assert len(restarted) == 0
+    restarted.get_interval_list_from_message("20:00", "08:00", "+49000", "bis 22:00 +491111")
+    assert (restarted.hits, restarted.misses) == (0, 1)
+
+
+def test_IntervalCache_GivenConcurrentThreadsAndEvictions_StaysConsistent():
+    from concurrent.futures import ThreadPoolExecutor
+    cache = messageparser.IntervalCache(maxsize=16)
+    notes = generate_substitution_notes(64)
+
+    def parse_all(offset):
+        return [cache.get_interval_list_from_message("08:00", "20:00", "+49000", notes[(offset + i) % len(notes)])
+                for i in range(500)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(parse_all, range(8)))
+
+    expected = {note: tuple(map(tuple, messageparser.get_interval_list_from_message("08:00", "20:00", "+49000", note))) for note in notes}
+    for offset, intervals in enumerate(results):
+        assert intervals == [expected[notes[(offset + i) % len(notes)]] for i in range(500)]
+    assert len(cache) <= 16
+    assert cache.hits + cache.misses == 8 * 500
@@ -0,0 +1,504 @@
+import pytest, time
+import sipgate_stub
+from sipgate_api import ApiCaller, SipgateManager, DirectoryIndex, DirectorySnapshot, UserInfo, PlannedRedirect, RedirectJournal, RedirectStatus, TokenBucket
+
+HEADERS = {'Authorization': 'Basic dGVzdA==', 'Accept': 'application/json', 'Content-Type': 'application/json'}
+
+
+@pytest.fixture
+def stub():
+    with sipgate_stub.create_team(user_count=5) as stub:
+        yield stub
+
+
+def test_ApiCaller_GivenManyCalls_ReusesConnection(stub):
+    api = ApiCaller(stub.base_url, HEADERS)
+
+    for _ in range(10):
+        assert len(api.get_users()) == 5
+
+    assert stub.connection_count == 1
+
+
+def test_SipgateManager_GivenStub_LoadsDirectoryOverPooledConnections(stub):
+    SipgateManager(stub.base_url, HEADERS, max_concurrent_requests=2)
+
+    assert len(stub.requests) == 1 + 5 + 1
+    assert stub.connection_count <= 2
+
+
+def test_ApiCaller_GivenTransientServerErrors_RetriesGet(stub):
+    api = ApiCaller(stub.base_url, HEADERS, backoff_factor=0)
+    stub.failures['/app/users'] = [503, 502]
+
+    assert len(api.get_users()) == 5
+    assert api.retry_count == 2
+    assert len(stub.requests) == 3
+
+
+def test_ApiCaller_GivenTransientServerErrors_RetriesPutOfNumber(stub):
+    api = ApiCaller(stub.base_url, HEADERS, backoff_factor=0)
+    stub.failures['/numbers/1'] = [500]
+
+    assert api.forward_outbound_to_private_phone_number('1', 'p3')
+    assert api.retry_count == 1
+    assert stub.numbers[1]['endpointId'] == 'p3'
+
+
+def test_ApiCaller_GivenPersistentServerErrors_GivesUpAfterMaxRetries(stub):
+    api = ApiCaller(stub.base_url, HEADERS, max_retries=2, backoff_factor=0)
+    stub.failures['/numbers/1'] = [500] * 5
+
+    assert api.forward_outbound_to_private_phone_number('1', 'p3') is False
+    assert api.retry_count == 2
+    assert len(stub.requests) == 3
+
+
+def test_ApiCaller_GivenClientError_DoesNotRetry(stub):
+    api = ApiCaller(stub.base_url, HEADERS, backoff_factor=0)
+
+    assert api.forward_outbound_to_private_phone_number('unknown', 'p3') is False
+    assert api.retry_count == 0
+
+
+def test_ApiCaller_GivenUnreachableServer_RetriesAndFails():
+    api = ApiCaller("http://127.0.0.1:9", HEADERS, max_retries=1, backoff_factor=0, timeout=1)
+
+    assert api.forward_outbound_to_private_phone_number('1', 'p3') is False
+    assert api.retry_count == 1
+
+
+@pytest.mark.parametrize('expected, http_method, relative_url', [
+    (True, 'get', '/app/users'),
+    (True, 'put', '/numbers/1'),
+    (False, 'put', '/app/users'),
+    (False, 'post', '/numbers/1')])
+def test_ApiCaller_is_idempotent(expected, http_method, relative_url):
+    assert expected == ApiCaller.is_idempotent(http_method, relative_url)
+
+
+def test_fetch_private_phone_number_to_user_mapping_GivenSlowServer_FetchesDevicesConcurrently():
+    with sipgate_stub.create_team(user_count=20, delay=0.02) as stub:
+        serial_api = ApiCaller(stub.base_url, HEADERS, max_concurrent_requests=1)
+        concurrent_api = ApiCaller(stub.base_url, HEADERS, max_concurrent_requests=10)
+        users = serial_api.get_users()
+
+        start = time.perf_counter()
+        serial_mapping = serial_api.fetch_private_phone_number_to_user_mapping(users)
+        serial_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        concurrent_mapping = concurrent_api.fetch_private_phone_number_to_user_mapping(users)
+        concurrent_duration = time.perf_counter() - start
+
+    assert serial_mapping == concurrent_mapping
+    assert concurrent_duration < serial_duration / 2
+
+
+def test_fetch_private_phone_number_to_user_mapping_GivenSharedNumbers_MergesInUserOrder(caplog):
+    with sipgate_stub.create_team(user_count=6) as stub:
+        # w1, w3 and w5 all claim the same number, the first user wins no matter which response arrives first
+        for user_id in ['w3', 'w5']:
+            stub.devices[user_id][0]['number'] = stub.devices['w1'][0]['number']
+        api = ApiCaller(stub.base_url, HEADERS, max_concurrent_requests=6)
+
+        mapping = api.fetch_private_phone_number_to_user_mapping(api.get_users())
+
+    assert mapping['+491700000001']['userId'] == 'w1'
+    assert [record.getMessage().split(' from user ')[1][:2] for record in caplog.records if record.levelname == 'WARNING'] == ['w3', 'w5']
+
+
+def test_SipgateManager_GivenFreshSnapshot_OnlyFetchesPublicNumbers(stub, tmp_path):
+    SipgateManager(stub.base_url, HEADERS, directory_cache=DirectorySnapshot(str(tmp_path / "directory.json")))
+    stub.requests.clear()
+
+    manager = SipgateManager(stub.base_url, HEADERS, directory_cache=DirectorySnapshot(str(tmp_path / "directory.json")))
+
+    assert manager.set_redirect_phone_number('+4923100001', '+491700000003')
+    assert [(method, path.split('?')[0]) for method, path, _ in stub.requests] == [('GET', '/numbers'), ('PUT', '/numbers/1')]
+
+
+def test_SipgateManager_GivenNumberReroutedByHandSinceSnapshot_ReroutesItBack(stub, tmp_path):
+    SipgateManager(stub.base_url, HEADERS, directory_cache=DirectorySnapshot(str(tmp_path / "directory.json")))
+    stub.numbers[0]['endpointId'] = 'p4'
+
+    manager = SipgateManager(stub.base_url, HEADERS, directory_cache=DirectorySnapshot(str(tmp_path / "directory.json")))
+    results = manager.apply_redirects({'+4923100000': '+491700000000'})
+
+    assert [result.status for result in results] == [RedirectStatus.APPLIED]
+    assert stub.numbers[0]['endpointId'] == 'p0'
+
+
+def test_SipgateManager_GivenStaleSnapshot_FetchesDirectory(stub, tmp_path):
+    now = [1000.0]
+    directory_cache = DirectorySnapshot(str(tmp_path / "directory.json"), ttl=60, clock=lambda: now[0])
+    SipgateManager(stub.base_url, HEADERS, directory_cache=directory_cache)
+    stub.requests.clear()
+    now[0] += 60
+
+    SipgateManager(stub.base_url, HEADERS, directory_cache=directory_cache)
+
+    assert len(stub.requests) == 1 + 5 + 1
+
+
+def test_SipgateManager_GivenSnapshotOnlyOnDisk_LoadsIt(stub, tmp_path):
+    path = str(tmp_path / "directory.json")
+    DirectorySnapshot(path).save([], {'+49170': {'userId': 'w0', 'activePhonelines': [{'id': 'p0'}]}}, {'+49231': {'id': '0'}})
+    DirectorySnapshot._DirectorySnapshot__memory.clear()
+
+    assert DirectorySnapshot(path).load()['numbers'] == {'+49231': {'id': '0'}}
+
+
+def test_set_redirect_phone_number_GivenNumberMissingInSnapshot_RefreshesDirectory(stub, tmp_path):
+    directory_cache = DirectorySnapshot(str(tmp_path / "directory.json"))
+    SipgateManager(stub.base_url, HEADERS, directory_cache=directory_cache)
+    stub.users.append({'id': 'w9', 'firstname': 'New', 'lastname': 'User', 'email': 'new@example.com'})
+    stub.devices['w9'] = [{'id': 'x9', 'number': '+491709999999', 'activePhonelines': [{'id': 'p9'}]}]
+    manager = SipgateManager(stub.base_url, HEADERS, directory_cache=directory_cache)
+
+    assert manager.set_redirect_phone_number('+4923100001', '+491709999999')
+    assert stub.numbers[1]['endpointId'] == 'p9'
+
+
+def test_DirectorySnapshot_invalidate_RemovesSnapshot(tmp_path):
+    directory_cache = DirectorySnapshot(str(tmp_path / "directory.json"))
+    directory_cache.save([], {}, {})
+
+    directory_cache.invalidate()
+
+    assert directory_cache.load() is None
+
+
+def test_plan_redirects_GivenCurrentEndpoints_ComparesDesiredAndActual(stub):
+    manager = SipgateManager(stub.base_url, HEADERS)
+
+    plan = manager.plan_redirects({'+4923100000': '+491700000000', '+4923100001': '+491700000002', '+4923100002': '+4917099'})
+
+    assert [(planned.current_endpoint_id, planned.target_endpoint_id) for planned in plan[:2]] == [('p0', 'p0'), ('p0', 'p2')]
+    assert [planned.is_unchanged for planned in plan] == [True, False, False]
+    assert plan[2].error
+
+
+def test_set_redirect_phone_number_GivenNumberAlreadyRoutedThere_SkipsPut(stub):
+    manager = SipgateManager(stub.base_url, HEADERS)
+    stub.requests.clear()
+
+    assert manager.set_redirect_phone_number('+4923100001', '+491700000002')
+    assert manager.set_redirect_phone_number('+4923100001', '+491700000002')
+    assert manager.set_redirect_phone_number('+4923100000', '+491700000000')
+
+    assert [(method, path) for method, path, _ in stub.requests] == [('PUT', '/numbers/1')]
+
+
+def test_apply_redirects_GivenMixedLines_ReportsResultPerLine(stub):
+    manager = SipgateManager(stub.base_url, HEADERS, backoff_factor=0)
+    stub.failures['/numbers/2'] = [400]
+
+    results = manager.apply_redirects({'+4923100000': '+491700000000', '+4923100001': '+491700000002',
+                                       '+4923100002': '+491700000003', '+4923199999': '+491700000001'})
+
+    assert [result.status for result in results] == [RedirectStatus.UNCHANGED, RedirectStatus.APPLIED, RedirectStatus.FAILED, RedirectStatus.FAILED]
+    assert [result.is_success for result in results] == [True, True, False, False]
+    assert results[1].duration > 0 and results[0].duration == 0
+    assert [number['endpointId'] for number in stub.numbers] == ['p0', 'p2', 'p0']
+
+
+def test_apply_redirects_GivenDryrun_DoesNotWrite(stub):
+    manager = SipgateManager(stub.base_url, HEADERS, dryrun=True)
+    stub.requests.clear()
+
+    results = manager.apply_redirects({'+4923100001': '+491700000002'})
+
+    assert [result.status for result in results] == [RedirectStatus.DRYRUN]
+    assert stub.requests == []
+
+
+def test_apply_redirects_GivenSlowServer_WritesLinesInParallel():
+    with sipgate_stub.create_team(user_count=5, delay=0.05) as stub:
+        stub.numbers.extend({'id': str(i), 'number': f"+49231{i:05}", 'endpointId': 'p0'} for i in range(3, 5))
+        manager = SipgateManager(stub.base_url, HEADERS)
+
+        start = time.perf_counter()
+        results = manager.apply_redirects({f"+49231{i:05}": f"+49170{i:07}" for i in range(1, 5)})
+        duration = time.perf_counter() - start
+
+    assert all(result.status == RedirectStatus.APPLIED for result in results)
+    assert duration < 4 * 0.05
+
+
+def test_TokenBucket_GivenBurstUsedUp_WaitsForRefill():
+    now = [0.0]
+    sleeps = []
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0], sleep=sleep)
+
+    waits = [bucket.acquire() for _ in range(4)]
+
+    assert waits == [0, 0, 0.5, 0.5]
+    assert bucket.wait_time == 1.0
+
+
+def test_TokenBucket_pause_GivenRetryAfter_HoldsBackUnlimitedBucket():
+    now = [0.0]
+    def sleep(seconds):
+        now[0] += seconds
+    bucket = TokenBucket(clock=lambda: now[0], sleep=sleep)
+
+    bucket.pause(3)
+
+    assert bucket.acquire() == 3
+    assert bucket.acquire() == 0
+
+
+def test_TokenBucket_shared_GivenSameCredential_ReturnsSameBucket():
+    assert TokenBucket.shared("test-credential", 5) is TokenBucket.shared("test-credential", 10)
+    assert TokenBucket.shared("test-credential") is not TokenBucket.shared("other-credential")
+
+
+def test_TokenBucket_shared_GivenConflictingRates_KeepsStrictestAndWarns(caplog):
+    bucket = TokenBucket.shared("conflicting-credential", 2, 10)
+
+    assert TokenBucket.shared("conflicting-credential", 5, 4) is bucket
+    assert (bucket.rate, bucket.capacity) == (2, 4)
+    TokenBucket.shared("conflicting-credential", 2, 10)
+    assert (bucket.rate, bucket.capacity) == (2, 4)
+    assert "different rate limits" in caplog.text
+
+
+def test_TokenBucket_shared_GivenNoRate_KeepsLimitOfOtherCallers():
+    bucket = TokenBucket.shared("limited-credential", 2, 4)
+
+    assert TokenBucket.shared("limited-credential") is bucket
+    assert (bucket.rate, bucket.capacity) == (2, 4)
+
+    unlimited = TokenBucket.shared("later-limited-credential")
+    TokenBucket.shared("later-limited-credential", 3, 5)
+    assert (unlimited.rate, unlimited.capacity) == (3, 5)
+
+
+def test_ApiCaller_GivenQuotaExceeded_WaitsForRetryAfterAndSucceeds():
+    with sipgate_stub.create_team(user_count=2, quota=(3, 0.2)) as stub:
+        api = ApiCaller(stub.base_url, HEADERS)
+
+        assert all(len(api.get_users()) == 2 for _ in range(8))
+        assert api.forward_outbound_to_private_phone_number('1', 'p1')
+
+    assert api.throttled_count == stub.throttled_count > 0
+    assert api.throttle_wait > 0
+    assert api.retry_count == 0
+
+
+def test_ApiCaller_GivenRateLimit_StaysWithinQuota():
+    with sipgate_stub.create_team(user_count=2, quota=(3, 0.2)) as stub:
+        api = ApiCaller(stub.base_url, HEADERS, rate_limit=8, burst=1)
+
+        assert all(len(api.get_users()) == 2 for _ in range(8))
+
+    assert stub.throttled_count == 0
+    assert api.throttle_wait > 0
+
+
+def test_ApiCaller_GivenPersistentThrottling_GivesUp(stub):
+    api = ApiCaller(stub.base_url, HEADERS, max_throttle_retries=2, backoff_factor=0)
+    stub.failures['/numbers/1'] = [429] * 5
+
+    assert api.forward_outbound_to_private_phone_number('1', 'p1') is False
+    assert api.throttled_count == 2
+
+
+def test_RedirectJournal_GivenCrashDuringPut_ReplaysItOnNextRun(stub, tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    manager = SipgateManager(stub.base_url, HEADERS)
+    plan = manager.plan_redirects({'+4923100001': '+491700000002'})[0]
+    # the process died after journaling the write, before sending it
+    RedirectJournal(journal_path).record_planned(plan)
+
+    journal = RedirectJournal(journal_path)
+    assert [unfinished_plan for _, unfinished_plan, _ in journal.get_unfinished()] == [
+        PlannedRedirect('+4923100001', '+491700000002', '1', None, 'p2')]
+
+    results = SipgateManager(stub.base_url, HEADERS, journal=journal).apply_redirects({'+4923100000': '+491700000000'})
+
+    assert [result.status for result in results] == [RedirectStatus.UNCHANGED]
+    assert [number['endpointId'] for number in stub.numbers] == ['p0', 'p2', 'p0']
+    assert journal.get_unfinished() == [] and RedirectJournal(journal_path).get_unfinished() == []
+
+
+def test_resume_GivenUnfinishedWriteOfLineInCurrentRun_GivesItUpInsteadOfReplaying(stub, tmp_path):
+    journal = RedirectJournal(str(tmp_path / "journal.jsonl"))
+    manager = SipgateManager(stub.base_url, HEADERS, journal=journal)
+    journal.record_planned(manager.plan_redirects({'+4923100001': '+491700000002'})[0])
+    stub.requests.clear()
+
+    results = manager.apply_redirects({'+4923100001': '+491700000003'})
+
+    assert [result.status for result in results] == [RedirectStatus.APPLIED]
+    assert [body for method, _, body in stub.requests if method == 'PUT'] == [b'{"endpointId": "p3"}']
+    assert journal.get_unfinished() == []
+
+
+def test_resume_GivenUnfinishedWriteOlderThanMaxAge_GivesItUp(stub, tmp_path):
+    now = [1000.0]
+    journal = RedirectJournal(str(tmp_path / "journal.jsonl"), max_age=60, clock=lambda: now[0])
+    manager = SipgateManager(stub.base_url, HEADERS, journal=journal)
+    journal.record_planned(manager.plan_redirects({'+4923100001': '+491700000002'})[0])
+    now[0] += 60
+
+    assert manager.resume({'+4923100000': '+491700000000'}) == 0
+    assert stub.numbers[1]['endpointId'] == 'p0'
+    assert journal.get_unfinished() == [] and journal.get_believed_plans({'+4923100001': '+491700000002'}) is None
+
+
+def test_RedirectJournal_GivenTruncatedLastLine_IgnoresIt(stub, tmp_path):
+    journal_path = tmp_path / "journal.jsonl"
+    manager = SipgateManager(stub.base_url, HEADERS, journal=RedirectJournal(str(journal_path)))
+    manager.apply_redirects({'+4923100001': '+491700000002'})
+    with open(journal_path, 'a') as journal_file:
+        journal_file.write('{"id": 3, "event": "plan')
+
+    journal = RedirectJournal(str(journal_path))
+
+    assert journal.get_unfinished() == []
+    assert journal.get_believed_plans({'+4923100001': '+491700000002'}) is not None
+
+
+def test_RedirectJournal_get_believed_plans_GivenAppliedAndVerifiedLines_ReturnsUnchangedPlans(stub, tmp_path):
+    now = [1000.0]
+    journal = RedirectJournal(str(tmp_path / "journal.jsonl"), max_age=60, clock=lambda: now[0])
+    manager = SipgateManager(stub.base_url, HEADERS, journal=journal)
+    redirects = {'+4923100000': '+491700000000', '+4923100001': '+491700000002'}
+
+    assert journal.get_believed_plans(redirects) is None
+    manager.apply_redirects(redirects)
+
+    plans = journal.get_believed_plans(redirects)
+    assert [(plan.outbound_number_id, plan.target_endpoint_id, plan.is_unchanged) for plan in plans] == [('0', 'p0', True), ('1', 'p2', True)]
+    assert journal.get_believed_plans({'+4923100001': '+491700000003'}) is None
+    now[0] += 60
+    assert journal.get_believed_plans(redirects) is None
+
+
+def test_RedirectJournal_GivenManyEntries_CompactsToLatestPerNumber(stub, tmp_path):
+    journal_path = tmp_path / "journal.jsonl"
+    journal = RedirectJournal(str(journal_path), max_entries=5)
+    manager = SipgateManager(stub.base_url, HEADERS, journal=journal)
+
+    for private_number in ['+491700000002', '+491700000003', '+491700000002', '+491700000004']:
+        manager.apply_redirects({'+4923100001': private_number})
+
+    assert len(journal_path.read_text().splitlines()) <= 5
+    assert RedirectJournal(str(journal_path)).get_believed_plans({'+4923100001': '+491700000004'})[0].target_endpoint_id == 'p4'
+
+
+def test_make_redirects_GivenJournalBelievesLinesApplied_OnlyChecksNumbers(stub, tmp_path):
+    import crawler
+    journal = RedirectJournal(str(tmp_path / "journal.jsonl"))
+    number_map = {'line1': '+4923100001'}
+    crawler.make_redirects(stub.base_url, HEADERS, number_map, {'line1': '+491700000002'}, False, sipgate_options={'journal': journal})
+    stub.requests.clear()
+
+    results = crawler.make_redirects(stub.base_url, HEADERS, number_map, {'line1': '+491700000002'}, False, sipgate_options={'journal': journal})
+
+    assert [result.status for result in results] == [RedirectStatus.UNCHANGED]
+    assert [(method, path) for method, path, _ in stub.requests] == [('GET', '/numbers?offset=0&limit=100')]
+
+
+def test_make_redirects_GivenJournaledLineReroutedByHand_ReroutesItBack(stub, tmp_path):
+    import crawler
+    journal = RedirectJournal(str(tmp_path / "journal.jsonl"))
+    number_map = {'line1': '+4923100001'}
+    crawler.make_redirects(stub.base_url, HEADERS, number_map, {'line1': '+491700000002'}, False, sipgate_options={'journal': journal})
+    stub.numbers[1]['endpointId'] = 'p0'
+
+    results = crawler.make_redirects(stub.base_url, HEADERS, number_map, {'line1': '+491700000002'}, False, sipgate_options={'journal': journal})
+
+    assert [result.status for result in results] == [RedirectStatus.APPLIED]
+    assert stub.numbers[1]['endpointId'] == 'p2'
+
+
+def test_SipgateManager_GivenNumbersFormattedDifferentlyInSipgate_MatchesThem():
+    with sipgate_stub.create_team(user_count=3) as stub:
+        stub.devices['w2'][0]['number'] = '0170 0000002'
+        stub.numbers[1]['number'] = '0049 231 00001'
+        manager = SipgateManager(stub.base_url, HEADERS)
+
+        results = manager.apply_redirects({'+4923100001': '+49 170 0000002'})
+
+        assert [result.status for result in results] == [RedirectStatus.APPLIED]
+        assert stub.numbers[1]['endpointId'] == 'p2'
+
+
+def test_DirectoryIndex_GivenDirectory_LooksUpBothDirections():
+    users = [UserInfo('w0', 'Max', 'Mustermann', 'max@example.com'), UserInfo('w1', 'Erika', 'Musterfrau', 'erika@example.com')]
+    devices = {'+491700000000': {'userId': 'w0', 'activePhonelines': [{'id': 'p0'}, {'id': 'p10'}]},
+               '0170 0000001': {'userId': 'w0', 'activePhonelines': []},
+               '+491700000002': {'userId': 'w1', 'activePhonelines': [{'id': 'p2'}]}}
+    numbers = {'+4923100000': {'id': '0', 'endpointId': 'p10'}, '+4923100001': {'id': '1', 'endpointId': 'g1'}}
+
+    directory = DirectoryIndex(users, devices, numbers)
+
+    assert [directory.get_endpoint(number) for number in ['+491700000000', '+491700000001', '+491700000002']] == ['p0', None, 'p2']
+    assert [directory.get_private_number(endpoint) for endpoint in ['p0', 'p10', 'p2', 'g1']] == ['+491700000000', '+491700000000', '+491700000002', None]
+    assert directory.get_devices('w0') == ['+491700000000', '+491700000001'] and directory.get_devices('w9') == []
+    assert [directory.get_current_target(number) for number in ['+4923100000', '+4923100001', '+4923199999']] == ['+491700000000', None, None]
+    assert directory.users['w1'].lastname == 'Musterfrau'
+    assert not hasattr(directory, '__dict__') and not hasattr(users[0], '__dict__')
+
+
+def test_SipgateManager_directory_GivenAppliedRedirect_ReportsNewTarget(stub):
+    manager = SipgateManager(stub.base_url, HEADERS)
+
+    manager.apply_redirects({'+4923100001': '+491700000002'})
+
+    assert manager.directory.get_current_target('+4923100001') == '+491700000002'
+    assert manager.directory.get_numbers()['+4923100001'] == {'id': '1', 'endpointId': 'p2'}
+
+
+def test_iter_items_GivenPagedList_FetchesAllPages():
+    with sipgate_stub.create_team(user_count=5, max_page_size=2) as stub:
+        api = ApiCaller(stub.base_url, HEADERS, page_size=10)
+
+        users = api.get_users()
+
+        assert [user.id for user in users] == [f"w{i}" for i in range(5)]
+        assert [path for _, path, _ in stub.requests] == ['/app/users?offset=0&limit=10', '/app/users?offset=2&limit=10',
+                                                          '/app/users?offset=4&limit=10']
+
+
+def test_iter_items_GivenNoTotalCount_StopsAtFirstPageThatIsNotFull(monkeypatch):
+    with sipgate_stub.create_team(user_count=5) as stub:
+        page = stub.page
+        monkeypatch.setattr(stub, 'page', lambda items, query: {'items': page(items, query)['items']})
+        api = ApiCaller(stub.base_url, HEADERS, page_size=2)
+
+        assert len(list(api.iter_items('/app/users'))) == 5
+        assert len(stub.requests) == 3
+
+
+def test_iter_items_GivenEndpointIgnoringPaging_StopsAfterFirstPage(monkeypatch):
+    with sipgate_stub.create_team(user_count=5) as stub:
+        monkeypatch.setattr(stub, 'page', lambda items, query: {'items': items})
+        api = ApiCaller(stub.base_url, HEADERS, page_size=2)
+
+        assert [user.id for user in api.get_users()] == [f"w{i}" for i in range(5)]
+        assert len(stub.requests) == 1
+
+
+def test_iter_items_GivenEndpointIgnoringOffset_StopsAtRepeatedPage(monkeypatch):
+    with sipgate_stub.create_team(user_count=5) as stub:
+        monkeypatch.setattr(stub, 'page', lambda items, query: {'items': items[:int(query['limit'][0])]})
+        api = ApiCaller(stub.base_url, HEADERS, page_size=2)
+
+        assert [user.id for user in api.get_users()] == ['w0', 'w1']
+        assert len(stub.requests) == 2
+
+
+def test_SipgateManager_GivenPagedUsers_FetchesDevicesWhileUsersAreStillLoading():
+    with sipgate_stub.create_team(user_count=6, delay=0.05, max_page_size=2) as stub:
+        manager = SipgateManager(stub.base_url, HEADERS, page_size=2)
+
+        paths = [path for _, path, _ in stub.requests]
+        assert paths.index('/w0/devices') < paths.index('/app/users?offset=4&limit=2')
+        assert manager.directory.get_endpoint('+491700000005') == 'p5'
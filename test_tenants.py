@@ -0,0 +1,101 @@
+import pytest
+from datetime import datetime
+import sipgate_stub
+import tenants
+from cassette import Cassette
+from dummy_server import DummyScheduleServer
+
+NOW = datetime(2019, 5, 2, 9, 0) # NFS1 +491735496595, NFS2 empty, Leitung +491711734480
+
+
+def test_get_tenant_configs_GivenSharedSections_MergesThemAndSeparatesCacheFiles():
+    config_data = {
+        "TESTING": False,
+        "schedule_cache": {"path": "schedule_cache.json"},
+        "sipgate": {"base_url": "https://api.sipgate.com/v2", "dryrun": False, "directory_cache": {"path": "directory.json", "ttl": 60},
+                    "journal": {"path": "redirect_journal.jsonl", "max_age": 600}},
+        "tenants": [
+            {"name": "dortmund", "sipgate": {"pass_base64": "a"}},
+            {"name": "unna", "sipgate": {"pass_base64": "b", "dryrun": True, "directory_cache": {"path": "unna.json"}}},
+        ],
+    }
+
+    tenant_configs = tenants.get_tenant_configs(config_data)
+
+    assert list(tenant_configs) == ["dortmund", "unna"]
+    assert tenant_configs["dortmund"]["sipgate"] == {"base_url": "https://api.sipgate.com/v2", "dryrun": False, "pass_base64": "a",
+                                                     "directory_cache": {"path": "directory.dortmund.json", "ttl": 60},
+                                                     "journal": {"path": "redirect_journal.dortmund.jsonl", "max_age": 600}}
+    assert tenant_configs["unna"]["sipgate"]["dryrun"] is True
+    assert tenant_configs["unna"]["sipgate"]["directory_cache"] == {"path": "unna.json"}
+    assert tenant_configs["unna"]["schedule_cache"] == {"path": "schedule_cache.unna.json"}
+    assert tenant_configs["unna"]["sipgate"]["journal"] == {"path": "redirect_journal.unna.jsonl", "max_age": 600}
+    assert "tenants" not in tenant_configs["unna"]
+
+
+def test_get_tenant_configs_GivenSameJournalForTwoTenants_Raises():
+    journal = {"journal": {"path": "redirect_journal.jsonl"}}
+    with pytest.raises(Exception):
+        tenants.get_tenant_configs({"tenants": [{"name": "dortmund", "sipgate": journal}, {"name": "unna", "sipgate": journal}]})
+
+
+def test_get_tenant_configs_GivenSingleTenantConfig_ReturnsIt():
+    assert tenants.get_tenant_configs({"TESTING": True}) == {"default": {"TESTING": True}}
+
+
+def test_get_tenant_configs_GivenDuplicateName_Raises():
+    with pytest.raises(Exception):
+        tenants.get_tenant_configs({"tenants": [{"name": "unna"}, {"name": "unna"}]})
+
+
+def test_run_tenants_GivenFailingTenant_IsolatesFailure():
+    with DummyScheduleServer() as schedule_server, \
+            sipgate_stub.create_team(user_count=2) as healthy_stub, sipgate_stub.create_team(user_count=2) as failing_stub:
+        healthy_stub.devices['w1'][0]['number'] = '+491735496595'
+        healthy_stub.devices['w0'][0]['number'] = '+491606391781' # NFS1 of the next day
+        failing_stub.failures['/app/users'] = [500] * 10
+        config_data = {
+            "TESTING": True,
+            "test_base_url": schedule_server.base_url,
+            "schedule_login_payload": {},
+            "sipgate": {"pass_base64": "", "dryrun": False, "connection": {"max_retries": 1, "backoff_factor": 0}},
+            "tenants": [
+                {"name": "healthy", "NUMBER_MAP": {"NFS1": "+4923100000"}, "sipgate": {"base_url": healthy_stub.base_url}},
+                {"name": "failing", "NUMBER_MAP": {"NFS1": "+4923100000"}, "sipgate": {"base_url": failing_stub.base_url}},
+                {"name": "unknown_line", "NUMBER_MAP": {"NFS1": "+4923100000", "NFS2": "+4923100001"},
+                 "sipgate": {"base_url": healthy_stub.base_url, "dryrun": True}},
+            ],
+        }
+
+        results = tenants.run_tenants(config_data, now=NOW)
+
+        assert [result.name for result in results] == ["healthy", "failing", "unknown_line"]
+        assert [result.is_success for result in results] == [True, False, False]
+        assert results[0].redirects == {"NFS1": "+491735496595"}
+        assert results[1].error
+        assert results[2].redirects == {"NFS1": "+491735496595", "NFS2": None}
+        # today's and then the next day's shift, like a single tenant run
+        assert [result.plan.redirect_phone_number for result in results[0].results] == ['+491735496595', '+491606391781']
+        assert healthy_stub.numbers[0]['endpointId'] == 'p0'
+        # counted per tenant, NFS2 is empty on both days
+        assert [(result.errors, result.warnings) for result in results] == [(0, 0), (0, 0), (2, 0)]
+
+
+def test_run_tenants_GivenReplayCassette_RunsWithoutServers(tmp_path):
+    with DummyScheduleServer() as schedule_server, sipgate_stub.create_team(user_count=2) as stub:
+        stub.devices['w1'][0]['number'] = '+491735496595'
+        stub.devices['w0'][0]['number'] = '+491606391781' # NFS1 of the next day
+        config_data = {
+            "TESTING": True,
+            "test_base_url": schedule_server.base_url,
+            "schedule_login_payload": {},
+            "sipgate": {"base_url": stub.base_url, "pass_base64": "", "dryrun": False},
+            "tenants": [{"name": "unna", "NUMBER_MAP": {"NFS1": "+4923100000"}}],
+        }
+        recorded = tenants.run_tenants(config_data, now=NOW, cassette=Cassette(str(tmp_path), 'record'))
+
+    replayed = tenants.run_tenants(dict(config_data, cassette={"path": str(tmp_path), "mode": "replay"}), now=NOW)
+
+    assert [result.is_success for result in recorded + replayed] == [True, True]
+    assert replayed[0].redirects == recorded[0].redirects == {"NFS1": "+491735496595"}
+    assert [result.status for result in replayed[0].results] == [result.status for result in recorded[0].results]